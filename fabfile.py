@@ -1,7 +1,9 @@
-from fabric.api import task, env, sudo, cd, shell_env, require, put
+from fabric.api import (task, env, sudo, cd, shell_env, require, put,
+                        settings, hide, abort)
 from functools import wraps
 
 import os
+import time
 
 env.use_ssh_config = True
 env.shell = '/bin/bash -c'
@@ -17,12 +19,41 @@ STAGES = {
         'local_config_file': './production.cfg',
         'branch': 'master',
     },
+    # Stand-in host for trying out deploys, such as a local VM or container
+    # with the staging puppet role applied and sshd running. The fabfile
+    # runs the router itself here.
+    'local': {
+        'hosts': [os.environ.get('IFTTT_LOCAL_HOST', 'localhost')],
+        'local_config_file': './local.cfg',
+        'branch': 'master',
+        'run_router': True,
+    },
 }
 
 SOURCE_DIR = '/srv/ifttt'
 VENV_DIR = '/srv/ifttt/venv'
 DEST_CONFIG_FILE = 'ifttt.cfg'
 
+# Rolling deploys run two instances of the channel side by side, each from
+# its own checkout, behind the router (router.py), and move the router from
+# one to the other by rewriting its backends file. The stage config must set
+# ROUTING_BACKENDS_FILE to BACKENDS_FILE.
+INSTANCES_DIR = '/srv/ifttt/instances'
+INSTANCE_PORTS = (8081, 8082)
+BACKENDS_FILE = '/srv/ifttt/backends'
+ROUTER_PORT = 8080
+UWSGI_PROCESSES = 4
+# Request threads per worker. Admission budgets (ADMISSION_BUDGET) are per
+# worker, and only hold anything back when a worker serves several
+# requests at once.
+UWSGI_THREADS = 16
+# Seconds a new instance gets to load, warm up and answer, and seconds the
+# old one keeps serving after the router has been switched away from it
+START_TIMEOUT = 300
+DRAIN_SECONDS = 30
+# How often the router checks its backends file (RELOAD_INTERVAL in router.py)
+ROUTER_RELOAD_INTERVAL = 5
+
 
 def sr(*cmd):
     """
@@ -45,6 +76,7 @@ def set_stage(stage='staging'):
     environment
     """
     env.stage = stage
+    env.run_router = False
     for option, value in STAGES[env.stage].items():
         setattr(env, option, value)
 
@@ -57,7 +89,7 @@ def ensure_stage(fn):
     def wrapper(*args, **kwargs):
         # The require operation will abort if the key stage
         # is not set in the environment
-        require('stage', provided_by=(staging, production,))
+        require('stage', provided_by=(staging, production, local,))
         return fn(*args, **kwargs)
     return wrapper
 
@@ -72,6 +104,11 @@ def staging():
     set_stage('staging')
 
 
+@task
+def local():
+    set_stage('local')
+
+
 @task
 @ensure_stage
 def initialize_server():
@@ -175,3 +212,164 @@ def restart_ifttt():
     """
     print 'Restarting ifttt'
     sudo('service uwsgi-ifttt restart')
+
+
+def read_local_config():
+    """
+    Read the config file of the stage, as the channel would
+    """
+    config = {}
+    execfile(env.local_config_file, config)
+    return config
+
+
+def instance_dir(port):
+    return os.path.join(INSTANCES_DIR, str(port))
+
+
+def live_port():
+    """
+    The port of the instance the router is sending requests to, if any
+    """
+    with settings(warn_only=True):
+        out = sr('cat', BACKENDS_FILE)
+    if out.succeeded:
+        for line in out.splitlines():
+            port = int(line.strip().rpartition(':')[2] or 0)
+            if port in INSTANCE_PORTS:
+                return port
+    return None
+
+
+def update_instance(directory):
+    """
+    Check out the source repo's current version, and its config, in an
+    instance directory
+    """
+    with settings(warn_only=True):
+        exists = sr('test', '-d', os.path.join(directory, '.git')).succeeded
+    if not exists:
+        sr('mkdir', '-p', INSTANCES_DIR)
+        sr('git', 'clone', SOURCE_DIR, directory)
+    with cd(directory):
+        sr('git', 'fetch', SOURCE_DIR, 'HEAD')
+        sr('git', 'reset', '--hard', 'FETCH_HEAD')
+    sr('cp', os.path.join(SOURCE_DIR, DEST_CONFIG_FILE),
+       os.path.join(directory, DEST_CONFIG_FILE))
+    sr('mkdir', '-p', os.path.join(directory, 'cache'))
+
+
+def uwsgi(directory, module, address, name):
+    """
+    Start a daemonized uwsgi serving `module` from `directory`. Each worker
+    loads the app itself after it is forked, so that the threads started
+    and the queries replayed at load belong to that worker
+    """
+    sr('uwsgi', '--plugin', 'python',
+       '--http-socket', address,
+       '--chdir', directory,
+       '--module', module,
+       '--virtualenv', VENV_DIR,
+       '--master', '--lazy-apps', '--processes', str(UWSGI_PROCESSES),
+       '--threads', str(UWSGI_THREADS), '--enable-threads',
+       '--pidfile', os.path.join(directory, name + '.pid'),
+       '--daemonize', os.path.join(directory, name + '.uwsgi.log'))
+
+
+def stop_uwsgi(directory, name):
+    with settings(warn_only=True):
+        sr('uwsgi', '--stop', os.path.join(directory, name + '.pid'))
+
+
+def prewarm_instance(new_dir, old_port):
+    """
+    Hand the new instance the old one's cache snapshot, and the queries it
+    is polled for most, to be replayed before the new one starts serving
+    """
+    print 'Pre-warming from the instance on port %d' % old_port
+    old_dir = instance_dir(old_port)
+    with settings(hide('running'), warn_only=True):
+        sr('cp', os.path.join(old_dir, 'cache', 'snapshot.bin'),
+           os.path.join(new_dir, 'cache', 'snapshot.bin'))
+        sr('curl', '-sf',
+           '-H', "'IFTTT-Channel-Key: %s'" % read_local_config().get(
+               'CHANNEL_KEY', ''),
+           '-o', os.path.join(new_dir, 'cache', 'warmup.json'),
+           'http://127.0.0.1:%d/v1/warmup' % old_port)
+
+
+def wait_until_up(port):
+    """
+    Wait for the instance on `port` to answer /v1/status
+    """
+    key = read_local_config().get('CHANNEL_KEY', '')
+    deadline = time.time() + START_TIMEOUT
+    while time.time() < deadline:
+        with settings(hide('everything'), warn_only=True):
+            if sr('curl', '-sf', '-H', "'IFTTT-Channel-Key: %s'" % key,
+                  'http://127.0.0.1:%d/v1/status' % port).succeeded:
+                return
+        time.sleep(2)
+    abort('The instance on port %d did not come up' % port)
+
+
+def switch_router(port):
+    """
+    Send every request to the instance on `port` from now on
+    """
+    print 'Switching the router to port %d' % port
+    sr('echo', '127.0.0.1:%d' % port, '>', BACKENDS_FILE + '.new', '&&',
+       'mv', BACKENDS_FILE + '.new', BACKENDS_FILE)
+
+
+def ensure_router():
+    """
+    Start the router, on stages where we run it ourselves
+    """
+    with settings(hide('everything'), warn_only=True):
+        running = sr('curl', '-s', '-o', '/dev/null',
+                     'http://127.0.0.1:%d/v1/routing' % ROUTER_PORT).succeeded
+    if not running:
+        print 'Starting the router on port %d' % ROUTER_PORT
+        uwsgi(SOURCE_DIR, 'router:application', '0.0.0.0:%d' % ROUTER_PORT,
+              'router')
+
+
+@task
+@ensure_stage
+def rolling_deploy():
+    """
+    Deploys updated code without downtime, from a pre-warmed new instance
+    """
+    print 'Rolling deploy to ' + env.stage
+    if read_local_config().get('ROUTING_BACKENDS_FILE') != BACKENDS_FILE:
+        abort('Set ROUTING_BACKENDS_FILE = %r in %s for rolling deploys' %
+              (BACKENDS_FILE, env.local_config_file))
+
+    update_source_repo()
+    upload_config()
+    upgrade_dependencies()
+
+    old_port = live_port()
+    new_port = [port for port in INSTANCE_PORTS if port != old_port][0]
+    new_dir = instance_dir(new_port)
+
+    # A leftover from a failed deploy may still hold the port
+    stop_uwsgi(new_dir, 'ifttt')
+    update_instance(new_dir)
+    if old_port:
+        prewarm_instance(new_dir, old_port)
+
+    # The new instance warms up before it starts answering
+    print 'Starting the instance on port %d' % new_port
+    uwsgi(new_dir, 'app:app', '127.0.0.1:%d' % new_port, 'ifttt')
+    wait_until_up(new_port)
+
+    if env.run_router:
+        ensure_router()
+    switch_router(new_port)
+
+    if old_port:
+        print 'Draining the instance on port %d' % old_port
+        time.sleep(ROUTER_RELOAD_INTERVAL + DRAIN_SECONDS)
+        stop_uwsgi(instance_dir(old_port), 'ifttt')
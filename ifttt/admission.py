@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+  Wikipedia channel for IFTTT
+  ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+  Copyright 2015 Ori Livneh <ori@wikimedia.org>
+                 Stephen LaPorte <stephen.laporte@gmail.com>
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+"""
+
+import threading
+import time
+
+# Requests of one trigger that run at once, requests that may queue for
+# a slot, and seconds a queued request waits before it is shed.
+DEFAULT_BUDGET = (8, 16, 2.0)
+DEFAULT_RETRY_AFTER = 30
+
+
+class Gate(object):
+    """Admits at most `slots` concurrent requests, and lets up to `queue`
+    more wait up to `wait` seconds for a slot. Requests beyond that, or
+    that time out waiting, are shed."""
+
+    def __init__(self, slots, queue, wait):
+        self.slots = slots
+        self.queue = queue
+        self.wait = wait
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = 0
+        self.max_waiting = 0
+        self._cond = threading.Condition()
+
+    def enter(self, wait=None):
+        """Take a slot, waiting for one if the queue has room. Returns
+        False if the request should be shed."""
+        if wait is None:
+            wait = self.wait
+        with self._cond:
+            if self.active >= self.slots:
+                if self.waiting >= self.queue or wait <= 0:
+                    self.shed += 1
+                    return False
+                self.waiting += 1
+                self.max_waiting = max(self.max_waiting, self.waiting)
+                deadline = time.time() + wait
+                try:
+                    while self.active >= self.slots:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            self.shed += 1
+                            return False
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.active += 1
+            self.admitted += 1
+            return True
+
+    def leave(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {'slots': self.slots,
+                    'queue': self.queue,
+                    'active': self.active,
+                    'waiting': self.waiting,
+                    'max_waiting': self.max_waiting,
+                    'admitted': self.admitted,
+                    'shed': self.shed}
+
+
+class AdmissionControl(object):
+    """A Gate per trigger class, so that triggers backed by slow queries
+    can't take every thread of a worker from the cheap ones. Budgets are
+    looked up by trigger name in `budgets`, falling back to
+    `default_budget`."""
+
+    def __init__(self, default_budget=DEFAULT_BUDGET, budgets=None):
+        self.configure(default_budget, budgets)
+
+    def configure(self, default_budget=None, budgets=None):
+        self.default_budget = default_budget or DEFAULT_BUDGET
+        self.budgets = budgets or {}
+        self._lock = threading.Lock()
+        self._gates = {}
+
+    def gate(self, name):
+        with self._lock:
+            gate = self._gates.get(name)
+            if gate is None:
+                gate = self._gates[name] = Gate(
+                    *self.budgets.get(name, self.default_budget))
+            return gate
+
+    def stats(self):
+        with self._lock:
+            gates = self._gates.items()
+        return dict((name, gate.stats()) for name, gate in gates)
+
+
+admission_control = AdmissionControl()
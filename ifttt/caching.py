@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+"""
+  Wikipedia channel for IFTTT
+  ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+  Copyright 2015 Ori Livneh <ori@wikimedia.org>
+                 Stephen LaPorte <stephen.laporte@gmail.com>
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+"""
+
+import collections
+import cPickle as pickle
+import errno
+import logging
+import os
+import threading
+import time
+import zlib
+
+import werkzeug.contrib.cache
+
+from utils import start_thread
+
+_cur_dir = os.path.dirname(__file__)
+_cache_dir = os.path.join(_cur_dir, '../cache')
+
+# Cache keys are prefixed with their namespace, e.g. 'feed:<url>'.
+FEEDS = 'feed'
+API = 'api'
+IMAGES = 'img'
+DAL = 'dal'
+RESPONSES = 'resp'
+TRENDING = 'trend'
+VALIDATION = 'valid'
+
+MB = 1024 * 1024
+DEFAULT_BYTE_BUDGET = 64 * MB
+DEFAULT_QUOTAS = {FEEDS: 4 * MB,
+                  API: 16 * MB,
+                  IMAGES: 4 * MB,
+                  DAL: 16 * MB,
+                  RESPONSES: 16 * MB,
+                  TRENDING: 8 * MB,
+                  VALIDATION: 1 * MB}
+# Rough per-entry bookkeeping cost on top of the key and payload.
+ENTRY_OVERHEAD = 200
+# Pickled values at least this large are stored zlib-compressed.
+DEFAULT_COMPRESS_MIN_SIZE = 16 * 1024
+COMPRESS_LEVEL = 1
+
+# How the payload of an entry is encoded
+PICKLED = 0
+RAW = 1
+COMPRESSED = 2
+
+SNAPSHOT_MAGIC = 'IFTTT-CACHE'
+SNAPSHOT_VERSION = 3
+SNAPSHOT_NAMESPACES = (FEEDS, IMAGES, DAL)
+DEFAULT_SNAPSHOT_FILE = os.path.join(_cache_dir, 'snapshot.bin')
+DEFAULT_SNAPSHOT_INTERVAL = 5 * 60
+
+log = logging.getLogger(__name__)
+
+
+def make_key(namespace, *parts):
+    return ':'.join((namespace,) + parts)
+
+
+def namespace_of(key):
+    return key.split(':', 1)[0]
+
+
+class Namespace(object):
+    """The entries of one namespace, least recently used first, and
+    their accounting."""
+
+    def __init__(self, quota):
+        self.quota = quota
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def pressure(self):
+        return float(self.size) / self.quota if self.quota else float('inf')
+
+    def remove(self, key):
+        entry = self.entries.pop(key)
+        self.size -= entry[3]
+        return entry
+
+    def stats(self):
+        return {'entries': len(self.entries),
+                'bytes': self.size,
+                'quota': self.quota,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations}
+
+
+class BoundedCache(werkzeug.contrib.cache.BaseCache):
+    """In-process cache bounded by approximate size in bytes rather than
+    by number of entries.
+
+    Values are stored pickled (strings are stored as they are, and large
+    pickles compressed), so the size of an entry is simply the length of
+    its key and payload. Each namespace is kept in LRU order within its
+    own byte quota, and when the cache as a whole is over budget, entries
+    are evicted from the namespace that is using the largest share of
+    its quota."""
+
+    def __init__(self, budget=DEFAULT_BYTE_BUDGET, quotas=None,
+                 default_timeout=300,
+                 compress_min_size=DEFAULT_COMPRESS_MIN_SIZE):
+        werkzeug.contrib.cache.BaseCache.__init__(self, default_timeout)
+        self.budget = budget
+        self.compress_min_size = compress_min_size
+        self.quotas = dict(DEFAULT_QUOTAS, **(quotas or {}))
+        self.size = 0
+        self._lock = threading.Lock()
+        self._namespaces = {}
+
+    def configure(self, budget=None, quotas=None, compress_min_size=None):
+        with self._lock:
+            if budget is not None:
+                self.budget = budget
+            if compress_min_size is not None:
+                self.compress_min_size = compress_min_size
+            for name, quota in (quotas or {}).items():
+                self.quotas[name] = quota
+                if name in self._namespaces:
+                    self._namespaces[name].quota = quota
+            for namespace in self._namespaces.values():
+                self._shrink(namespace, namespace.quota)
+            self._enforce_budget()
+
+    def _namespace(self, key):
+        name = namespace_of(key)
+        namespace = self._namespaces.get(name)
+        if namespace is None:
+            quota = self.quotas.get(name, self.budget)
+            namespace = self._namespaces[name] = Namespace(quota)
+        return namespace
+
+    def _expires(self, timeout):
+        if timeout is None:
+            timeout = self.default_timeout
+        if timeout == 0:
+            return float('inf')
+        return time.time() + timeout
+
+    def _drop(self, namespace, key):
+        self.size -= namespace.remove(key)[3]
+
+    def _shrink(self, namespace, limit):
+        while namespace.entries and namespace.size > limit:
+            key = next(iter(namespace.entries))
+            self._drop(namespace, key)
+            namespace.evictions += 1
+
+    def _enforce_budget(self):
+        while self.size > self.budget:
+            namespace = max((namespace
+                             for namespace in self._namespaces.values()
+                             if namespace.entries),
+                            key=Namespace.pressure)
+            self._drop(namespace, next(iter(namespace.entries)))
+            namespace.evictions += 1
+
+    def _lookup(self, key):
+        namespace = self._namespace(key)
+        entry = namespace.entries.get(key)
+        if entry is None:
+            namespace.misses += 1
+            return None
+        if entry[0] <= time.time():
+            self._drop(namespace, key)
+            namespace.expirations += 1
+            namespace.misses += 1
+            return None
+        # Move to the most recently used end
+        del namespace.entries[key]
+        namespace.entries[key] = entry
+        namespace.hits += 1
+        return entry
+
+    def get(self, key):
+        with self._lock:
+            entry = self._lookup(key)
+        if entry is None:
+            return None
+        expires, codec, payload, size = entry
+        if codec == RAW:
+            return payload
+        if codec == COMPRESSED:
+            payload = zlib.decompress(payload)
+        return pickle.loads(payload)
+
+    def has(self, key):
+        with self._lock:
+            return self._lookup(key) is not None
+
+    def encode(self, value):
+        """Serialize `value`, returning its codec and payload."""
+        if isinstance(value, str):
+            return RAW, value
+        payload = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if self.compress_min_size and len(payload) >= self.compress_min_size:
+            compressed = zlib.compress(payload, COMPRESS_LEVEL)
+            if len(compressed) < len(payload):
+                return COMPRESSED, compressed
+        return PICKLED, payload
+
+    def set(self, key, value, timeout=None):
+        codec, payload = self.encode(value)
+        self.restore(key, self._expires(timeout), codec, payload)
+        return True
+
+    def add(self, key, value, timeout=None):
+        if self.has(key):
+            return False
+        return self.set(key, value, timeout)
+
+    def delete(self, key):
+        with self._lock:
+            namespace = self._namespace(key)
+            if key not in namespace.entries:
+                return False
+            self._drop(namespace, key)
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._namespaces = {}
+            self.size = 0
+        return True
+
+    def restore(self, key, expires, codec, payload):
+        """Store an already serialized entry."""
+        size = len(key) + len(payload) + ENTRY_OVERHEAD
+        with self._lock:
+            namespace = self._namespace(key)
+            if key in namespace.entries:
+                self._drop(namespace, key)
+            if size > namespace.quota:
+                return
+            namespace.entries[key] = (expires, codec, payload, size)
+            namespace.size += size
+            self.size += size
+            self._shrink(namespace, namespace.quota)
+            self._enforce_budget()
+
+    def export(self, namespaces):
+        """Live entries of the given namespaces, as (key, expires, codec,
+        payload) tuples, copied without being decoded."""
+        now = time.time()
+        with self._lock:
+            return [(key, expires, codec, payload)
+                    for name in namespaces
+                    if name in self._namespaces
+                    for key, (expires, codec, payload, size)
+                    in self._namespaces[name].entries.items()
+                    if expires > now]
+
+    def stats(self):
+        with self._lock:
+            return {'bytes': self.size,
+                    'budget': self.budget,
+                    'compress_min_size': self.compress_min_size,
+                    'namespaces': dict((name, namespace.stats())
+                                       for name, namespace
+                                       in self._namespaces.items())}
+
+
+cache = BoundedCache()
+
+
+def write_snapshot(path=DEFAULT_SNAPSHOT_FILE):
+    """Write the hot cache entries to `path`. The file starts with a magic
+    string and a format version, followed by the zlib-compressed pickled
+    entries, and is replaced atomically."""
+    entries = cache.export(SNAPSHOT_NAMESPACES)
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp_path = '%s.%s.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write('%s %d\n' % (SNAPSHOT_MAGIC, SNAPSHOT_VERSION))
+        f.write(zlib.compress(pickle.dumps(entries, pickle.HIGHEST_PROTOCOL)))
+    os.rename(tmp_path, path)
+    return len(entries)
+
+
+def load_snapshot(path=DEFAULT_SNAPSHOT_FILE):
+    """Load entries from a snapshot at `path`, keeping whatever time they
+    had left to live. Snapshots that are missing, unreadable or of
+    another format version are ignored."""
+    try:
+        with open(path, 'rb') as f:
+            header = f.readline()
+            if header != '%s %d\n' % (SNAPSHOT_MAGIC, SNAPSHOT_VERSION):
+                return 0
+            entries = pickle.loads(zlib.decompress(f.read()))
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            log.warning('Could not load cache snapshot %s', path,
+                        exc_info=True)
+        return 0
+    except Exception:
+        log.warning('Could not load cache snapshot %s', path, exc_info=True)
+        return 0
+    now = time.time()
+    loaded = 0
+    for key, expires, codec, payload in entries:
+        if expires > now and not cache.has(key):
+            cache.restore(key, expires, codec, payload)
+            loaded += 1
+    return loaded
+
+
+class Snapshotter(object):
+    """Write a snapshot every `interval` seconds. Snapshots are taken in a
+    background thread when a request notices one is due, which keeps it
+    safe across forking workers.
+
+    Each worker snapshots its own cache to the same `path`, so the file
+    holds whichever worker wrote last. Every worker loads that one
+    snapshot at startup, which is enough to start warm."""
+
+    def __init__(self, path=DEFAULT_SNAPSHOT_FILE,
+                 interval=DEFAULT_SNAPSHOT_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.last_snapshot = time.time()
+        self._lock = threading.Lock()
+
+    def maybe_snapshot(self):
+        if not self.interval:
+            return
+        if self.last_snapshot + self.interval > time.time():
+            return
+        if not self._lock.acquire(False):
+            return
+        self.last_snapshot = time.time()
+        start_thread(self.run, 'cache-snapshot')
+
+    def run(self):
+        try:
+            count = write_snapshot(self.path)
+            log.info('Wrote %d cache entries to %s', count, self.path)
+        except Exception:
+            log.warning('Could not write cache snapshot %s', self.path,
+                        exc_info=True)
+        finally:
+            self._lock.release()
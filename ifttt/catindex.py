@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+  Wikipedia channel for IFTTT
+  ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+  Copyright 2015 Stephen LaPorte <stephen.laporte@gmail.com>
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+"""
+
+import bisect
+import datetime
+import logging
+import Queue
+import threading
+import time
+
+from array import array
+
+from flask import current_app as app
+
+from dal import get_category_links
+from utils import PerProcess, start_thread
+
+# How often a category is re-read from scratch, so that pages which were
+# removed from it drop out of the index.
+REBUILD_INTERVAL = 6 * 60 * 60
+# How often new members are pulled in past the timestamp watermark.
+REFRESH_INTERVAL = 60
+# Categories nobody has asked about for this long are forgotten.
+IDLE_EXPIRATION = 24 * 60 * 60
+# How far back we remember titles of newly added members.
+RECENT_HOURS = 24
+
+log = logging.getLogger(__name__)
+
+
+class CategoryMembers(object):
+    """The membership of a single category on a single wiki.
+
+    The full member list is kept as a sorted array of page IDs, which is
+    compact enough to hold categories with millions of members. Pages
+    added since the last rebuild live in a small set alongside it, and
+    the title and timestamp of recently added members are kept so that
+    NewCategoryMember can be answered without touching the database."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Held while the category is first read, so it is read only once
+        self.build_lock = threading.Lock()
+        self.members = array('l')
+        self.added = set()
+        self.recent = {}
+        self.watermark = None
+        self.built_at = 0
+        self.refreshed_at = 0
+        self.used_at = 0
+        self.rebuild_queued_at = 0
+
+    def __contains__(self, page_id):
+        if page_id in self.added:
+            return True
+        i = bisect.bisect_left(self.members, page_id)
+        return i < len(self.members) and self.members[i] == page_id
+
+    def __len__(self):
+        return len(self.members) + len(self.added)
+
+    def rebuild(self, category, lang):
+        """Read the whole category again, without holding the lock, and
+        swap the result in. Until then, the previous index is served."""
+        rebuilt = CategoryMembers()
+        horizon = self.horizon()
+        page_ids = set()
+        for row in get_category_links(category, lang=lang):
+            page_ids.add(row.page_id)
+            rebuilt.remember(row, horizon)
+        with self.lock:
+            self.members = array('l', sorted(page_ids))
+            self.added = set()
+            self.recent = rebuilt.recent
+            self.watermark = rebuilt.watermark
+            self.built_at = time.time()
+            # Pick up whatever was added while the category was read
+            self.refreshed_at = 0
+
+    def refresh(self, category, lang):
+        horizon = self.horizon()
+        for row in get_category_links(category, lang=lang,
+                                      since=self.watermark):
+            if row.page_id not in self:
+                self.added.add(row.page_id)
+            self.remember(row, horizon)
+        for page_id, row in self.recent.items():
+            if row.cl_timestamp < horizon:
+                del self.recent[page_id]
+        self.refreshed_at = time.time()
+
+    def horizon(self):
+        return datetime.datetime.utcnow() - \
+            datetime.timedelta(hours=RECENT_HOURS)
+
+    def remember(self, row, horizon):
+        """Advance the watermark and keep the row if it was added
+        recently."""
+        if self.watermark is None or row.cl_timestamp > self.watermark:
+            self.watermark = row.cl_timestamp
+        if row.cl_timestamp >= horizon:
+            self.recent[row.page_id] = row
+
+    def added_since(self, since):
+        """Members added at or after `since`, newest first."""
+        ret = [row for row in self.recent.values()
+               if row.cl_timestamp >= since]
+        ret.sort(key=lambda row: row.cl_timestamp, reverse=True)
+        return ret
+
+
+class CategoryIndex(object):
+    """Category-to-page membership for the categories that are actually
+    subscribed to, maintained incrementally from `categorylinks`.
+
+    A category is read in full the first time it is asked about, since
+    there is nothing to answer with until then. Concurrent first requests
+    wait for that one read. Later rebuilds run on a background thread,
+    one category at a time."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._categories = {}
+        self._rebuilds = PerProcess(self.start_rebuilder)
+
+    def start_rebuilder(self):
+        queue = Queue.Queue()
+        start_thread(lambda: self.run_rebuilds(queue), 'category-rebuild')
+        return queue
+
+    def run_rebuilds(self, queue):
+        while True:
+            flask_app, category, lang, members = queue.get()
+            try:
+                with flask_app.app_context():
+                    members.rebuild(category, lang)
+            except Exception:
+                log.warning('Could not rebuild category %s', category,
+                            exc_info=True)
+
+    def get(self, category, lang):
+        """Return the up-to-date CategoryMembers for `category`."""
+        key = (lang, category.replace(' ', '_'))
+        now = time.time()
+        with self._lock:
+            members = self._categories.get(key)
+            if members is None:
+                members = self._categories[key] = CategoryMembers()
+            self.expire(now)
+        members.used_at = now
+        if not members.built_at:
+            with members.build_lock:
+                if not members.built_at:
+                    members.rebuild(category, lang)
+        elif (members.built_at + REBUILD_INTERVAL < now and
+              members.rebuild_queued_at + REBUILD_INTERVAL < now):
+            members.rebuild_queued_at = now
+            self._rebuilds.get().put((app._get_current_object(), category,
+                                      lang, members))
+        with members.lock:
+            if members.refreshed_at + REFRESH_INTERVAL < now:
+                members.refresh(category, lang)
+        return members
+
+    def expire(self, now):
+        for key, members in self._categories.items():
+            if members.used_at and members.used_at + IDLE_EXPIRATION < now:
+                del self._categories[key]
+
+    def filter_revisions(self, category, lang, revisions):
+        """Keep only those recent changes that touch a member of
+        `category`."""
+        members = self.get(category, lang)
+        return [rev for rev in revisions if rev.rc_cur_id in members]
+
+    def new_members(self, category, lang, hours):
+        """Pages added to `category` within the last `hours`."""
+        members = self.get(category, lang)
+        since = datetime.datetime.utcnow() - datetime.timedelta(hours=hours)
+        return members.added_since(since)
+
+
+category_index = CategoryIndex()
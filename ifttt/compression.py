@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+  Wikipedia channel for IFTTT
+  ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+  Copyright 2015 Ori Livneh <ori@wikimedia.org>
+                 Stephen LaPorte <stephen.laporte@gmail.com>
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+"""
+
+import hashlib
+
+from utils import gzip_bytes
+from caching import cache, make_key, RESPONSES
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DEFAULT_MIN_SIZE = 500
+BROTLI_QUALITY = 5
+
+
+def supported_encodings():
+    """Content codings we can produce, most preferred first."""
+    if brotli is not None:
+        return ['br', 'gzip']
+    return ['gzip']
+
+
+def negotiate(request):
+    """Pick the best content coding the client accepts, or None."""
+    return request.accept_encodings.best_match(supported_encodings())
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip_bytes(body)
+
+
+def cached_compress(body, encoding):
+    """Compress `body`, reusing the result for identical bodies. Many
+    users polling the same trigger get the same bytes."""
+    key = make_key(RESPONSES, encoding, hashlib.sha1(body).hexdigest())
+    ret = cache.get(key)
+    if ret is None:
+        ret = compress(body, encoding)
+        cache.set(key, ret)
+    return ret
+
+
+def compress_response(request, response, min_size=DEFAULT_MIN_SIZE):
+    """Compress `response` in place if the client accepts it and it is
+    worth it. Only the body and encoding headers change, so the content
+    type set elsewhere is left intact."""
+    if (response.status_code != 200 or response.direct_passthrough or
+            'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate(request)
+    if encoding is None:
+        return response
+    body = response.get_data()
+    if len(body) < min_size:
+        return response
+    response.set_data(cached_compress(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
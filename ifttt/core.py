@@ -23,7 +23,25 @@
 import flask
 from flask import request
 
-from .utils import snake_case
+from .utils import snake_case, url_to_uuid5, diff_url, DEFAULT_MEMO_SIZE
+from .encoders import jsonify
+from .logs import setup_logging
+from .caching import (cache,
+                      load_snapshot,
+                      Snapshotter,
+                      DEFAULT_SNAPSHOT_FILE,
+                      DEFAULT_SNAPSHOT_INTERVAL)
+from .compression import compress_response, DEFAULT_MIN_SIZE
+from .trending import trending_engine
+from .realtime import notifier
+from .admission import admission_control, DEFAULT_RETRY_AFTER
+from .fetch import fetcher
+from .warmup import (poll_history,
+                     warm_from_file,
+                     DEFAULT_WARMUP_FILE,
+                     DEFAULT_TOP,
+                     DEFAULT_MAX_SECONDS)
+from .validators import ValidateArticleTitle, ValidateUser
 from .triggers import (ArticleOfTheDay,
                        PictureOfTheDay,
                        WordOfTheDay,
@@ -33,14 +51,8 @@ from .triggers import (ArticleOfTheDay,
                        NewHashtag,
                        NewCategoryMember,
                        TrendingTopics,
-                       CategoryMemberRevisions)
-
-import logging
-LOG_FILE = 'ifttt.log'
-logging.basicConfig(filename=LOG_FILE,
-                    format='%(asctime)s - %(message)s',
-                    datefmt='%m/%d/%Y %I:%M:%S %p',
-                    level=logging.DEBUG)
+                       CategoryMemberRevisions,
+                       GeoRevisions)
 
 
 ALL_TRIGGERS = [ArticleOfTheDay,
@@ -52,7 +64,11 @@ ALL_TRIGGERS = [ArticleOfTheDay,
                 NewHashtag,
                 NewCategoryMember,
                 TrendingTopics,
-                CategoryMemberRevisions]
+                CategoryMemberRevisions,
+                GeoRevisions]
+
+ALL_VALIDATORS = [ValidateArticleTitle,
+                  ValidateUser]
 
 app = flask.Flask(__name__)
 # Load default config first
@@ -60,27 +76,88 @@ app.config.from_pyfile('../default.cfg', silent=True)
 # Override defaults if ifttt.cfg is present
 app.config.from_pyfile('../ifttt.cfg', silent=True)
 
+setup_logging(app.config)
+
+for memoized in (url_to_uuid5, diff_url):
+    memoized.cache.resize(app.config.get('META_ID_CACHE_SIZE',
+                                         DEFAULT_MEMO_SIZE))
+cache.configure(app.config.get('CACHE_BYTE_BUDGET'),
+                app.config.get('CACHE_NAMESPACE_QUOTAS'),
+                app.config.get('CACHE_COMPRESS_MIN_SIZE'))
+
+# Start warm from the last snapshot of the cache, if there is one
+snapshotter = Snapshotter(app.config.get('CACHE_SNAPSHOT_FILE',
+                                         DEFAULT_SNAPSHOT_FILE),
+                          app.config.get('CACHE_SNAPSHOT_INTERVAL',
+                                         DEFAULT_SNAPSHOT_INTERVAL))
+if snapshotter.interval:
+    load_snapshot(snapshotter.path)
+
+notifier.configure(app, ALL_TRIGGERS)
+trending_engine.configure(app)
+fetcher.configure(app.config.get('FETCH_HEDGE_PERCENTILE'),
+                  app.config.get('FETCH_HEDGE_RATE'))
+admission_control.configure(app.config.get('ADMISSION_BUDGET'),
+                            app.config.get('ADMISSION_BUDGETS'))
+
+# Replay the most polled queries of the instance this one replaces, if it
+# left any, before taking traffic. uwsgi runs with --lazy-apps, so this
+# happens in each worker after it is forked rather than in the master.
+warm_from_file(app, app.config.get('WARMUP_FILE', DEFAULT_WARMUP_FILE),
+               dict((view_class.__name__, view_class)
+                    for view_class in ALL_TRIGGERS),
+               app.config.get('WARMUP_MAX_SECONDS', DEFAULT_MAX_SECONDS))
+
 
 @app.errorhandler(400)
 def missing_field(e):
     """There was something wrong with incoming data from IFTTT. """
     error = {'message': 'missing required trigger field'}
-    return flask.jsonify(errors=[error]), 400
+    return jsonify(errors=[error]), 400
 
 
 @app.errorhandler(401)
 def unauthorized(e):
     """Issue an HTTP 401 Unauthorized response with a JSON body."""
     error = {'message': 'Unauthorized'}
-    return flask.jsonify(errors=[error]), 401
+    return jsonify(errors=[error]), 401
+
+
+@app.errorhandler(503)
+def overloaded(e):
+    """A trigger is over its admission budget and there was no earlier
+    answer to serve instead."""
+    error = {'message': 'Service temporarily overloaded'}
+    response = jsonify(errors=[error])
+    response.status_code = 503
+    response.headers['Retry-After'] = str(app.config.get(
+        'ADMISSION_RETRY_AFTER', DEFAULT_RETRY_AFTER))
+    return response
 
 
 @app.after_request
 def force_content_type(response):
     """RFC 4627 stipulates that 'application/json' takes no charset parameter,
     but IFTTT expects one anyway. We have to twist Flask's arm to get it to
-    break the spec."""
-    response.headers['Content-Type'] = 'application/json; charset=utf-8'
+    break the spec. RSS feeds keep their own content type."""
+    if response.mimetype != 'application/xml':
+        response.headers['Content-Type'] = 'application/json; charset=utf-8'
+    return response
+
+
+@app.after_request
+def compress(response):
+    """Compress responses for clients that send a matching
+    Accept-Encoding, if they are larger than COMPRESS_MIN_SIZE bytes."""
+    return compress_response(request, response,
+                             app.config.get('COMPRESS_MIN_SIZE',
+                                            DEFAULT_MIN_SIZE))
+
+
+@app.after_request
+def snapshot_cache(response):
+    """Periodically save hot cache entries for the next worker to load."""
+    snapshotter.maybe_snapshot()
     return response
 
 
@@ -102,7 +179,7 @@ def test_setup():
         trigger_name = snake_case(trigger.__name__)
         if trigger.default_fields:
             ret['samples']['triggers'][trigger_name] = trigger.default_fields
-    return flask.jsonify(data=ret)
+    return jsonify(data=ret)
 
 
 @app.route('/v1/status')
@@ -111,7 +188,37 @@ def status():
     return ''
 
 
-for view_class in ALL_TRIGGERS:
+@app.route('/v1/stats')
+def stats():
+    """Report cache occupancy and hit rates, and admission queue depths
+    and shed counts, for this worker."""
+    return jsonify(data={'cache': cache.stats(),
+                         'trending': trending_engine.stats(),
+                         'realtime': notifier.stats(),
+                         'admission': admission_control.stats(),
+                         'fetch': fetcher.stats(),
+                         'url_to_uuid5': url_to_uuid5.cache.stats(),
+                         'diff_url': diff_url.cache.stats()})
+
+
+@app.route('/v1/triggers/<slug>/trigger_identity/<trigger_identity>',
+           methods=['DELETE'])
+def delete_trigger_identity(slug, trigger_identity):
+    """IFTTT tells us when an applet is turned off, so that we stop
+    sending realtime notifications for its trigger identity."""
+    notifier.forget(trigger_identity)
+    return ''
+
+
+@app.route('/v1/warmup')
+def warmup():
+    """List the queries this worker has been polled for most, for a new
+    instance to replay before it takes over."""
+    return jsonify(data=poll_history.top(app.config.get('WARMUP_TOP',
+                                                        DEFAULT_TOP)))
+
+
+for view_class in ALL_TRIGGERS + ALL_VALIDATORS:
     slug = getattr(view_class, 'url_pattern', None)
     if not slug:
         slug = snake_case(view_class.__name__)
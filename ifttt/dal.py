@@ -19,13 +19,150 @@
 
 """
 
+import collections
+import datetime
+import math
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
 from flask import current_app as app
 
 import oursql
 
+from utils import LRUCache, PerProcess
+
+EPOCH = datetime.datetime(1970, 1, 1)
 DEFAULT_HOURS = 1
 DEFAULT_LANG = 'en'
 DEFAULT_LIMIT = 50
+DEFAULT_REFRESH_INTERVAL = 15
+BUFFER_EXPIRATION = 60 * 60
+RC_TIMESTAMP_FORMAT = '%Y%m%d%H%M%S'
+FETCH_SIZE = 500
+# Per-title edit cache: titles remembered, edits kept per title, and the
+# size and concurrency of the batches missing titles are fetched in.
+TITLE_CACHE_SIZE = 20000
+TITLE_ROW_LIMIT = DEFAULT_LIMIT
+TITLE_BATCH_SIZE = 50
+TITLE_POOL_SIZE = 4
+# GeoData indexes coordinates rounded to this many steps per degree, in
+# gt_lat_int and gt_lon_int ($wgGeoDataIndexGranularity).
+GEO_INDEX_GRANULARITY = 10
+
+# Rows come back as compact records rather than per-row dicts. Each query
+# selects exactly these columns, in this order.
+
+# An edit from the hashtags database.
+Change = collections.namedtuple('Change', ['rc_id',
+                                           'rc_title',
+                                           'rc_timestamp',
+                                           'rc_this_oldid',
+                                           'rc_last_oldid',
+                                           'rc_user_text',
+                                           'rc_old_len',
+                                           'rc_new_len',
+                                           'rc_comment'])
+
+# An edit from a wiki's recentchanges table.
+Revision = collections.namedtuple('Revision', ['rc_id',
+                                               'rc_cur_id',
+                                               'rc_namespace',
+                                               'rc_title',
+                                               'rc_timestamp',
+                                               'rc_this_oldid',
+                                               'rc_last_oldid',
+                                               'rc_user_text',
+                                               'rc_old_len',
+                                               'rc_new_len',
+                                               'rc_comment'])
+
+# A category member, as the subject page of the categorized page.
+CategoryLink = collections.namedtuple('CategoryLink', ['page_id',
+                                                       'page_namespace',
+                                                       'page_title',
+                                                       'cl_timestamp'])
+
+# The primary coordinates of an article.
+GeoTag = collections.namedtuple('GeoTag', ['page_title', 'gt_lat', 'gt_lon'])
+
+
+class RowBuffer(object):
+    """A ring buffer holding the rows of one dal query, oldest first, and
+    the highest rc_id seen so far. Rows fall out of the buffer when more
+    than `limit` newer ones arrive or when they are older than `hours`."""
+
+    def __init__(self, limit=None, hours=None):
+        self.rows = collections.deque(maxlen=limit)
+        self.hours = hours
+        self.watermark = 0
+        self.refreshed_at = 0
+        self.used_at = 0
+        self.lock = threading.Lock()
+
+    def extend(self, rows):
+        for row in sorted(rows, key=lambda row: row.rc_id):
+            if row.rc_id > self.watermark:
+                self.rows.append(row)
+                self.watermark = row.rc_id
+
+    def cutoff(self):
+        if self.hours is None:
+            return None
+        return time.strftime(RC_TIMESTAMP_FORMAT,
+                             time.gmtime(time.time() - self.hours * 60 * 60))
+
+    def evict(self, cutoff):
+        while self.rows and self.rows[0].rc_timestamp < cutoff:
+            self.rows.popleft()
+
+    def newest_first(self):
+        cutoff = self.cutoff()
+        if cutoff is None:
+            return list(reversed(self.rows))
+        self.evict(cutoff)
+        # rc_id order follows rc_timestamp only loosely, so stragglers
+        # may still be sitting behind a younger row.
+        return [row for row in reversed(self.rows)
+                if row.rc_timestamp >= cutoff]
+
+
+class RowCache(object):
+    """Cache of dal query results, validated by rc_id watermark.
+
+    Each query is run once in full. After that, a refresh only asks for
+    the rows with an rc_id above the highest one already buffered, which
+    is a small range scan on the primary key instead of the full query."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buffers = {}
+
+    def fetch(self, key, query, limit=None, hours=None):
+        """Return the rows for `key`, newest first. `query` is called with
+        the current watermark and must return the rows above it."""
+        now = time.time()
+        with self._lock:
+            buf = self._buffers.get(key)
+            if buf is None:
+                buf = self._buffers[key] = RowBuffer(limit, hours)
+            buf.used_at = now
+            self.expire(now)
+        refresh_interval = app.config.get('DAL_REFRESH_INTERVAL',
+                                          DEFAULT_REFRESH_INTERVAL)
+        with buf.lock:
+            if buf.refreshed_at + refresh_interval <= now:
+                buf.extend(query(buf.watermark))
+                buf.refreshed_at = now
+            return buf.newest_first()
+
+    def expire(self, now):
+        for key, buf in self._buffers.items():
+            if buf.used_at + BUFFER_EXPIRATION < now:
+                del self._buffers[key]
+
+
+row_cache = RowCache()
 
 
 def ht_db_connect():
@@ -38,7 +175,22 @@ def ht_db_connect():
     return connection
 
 
-def run_query(query, query_params, lang):
+def stream(connection, cursor, record, size=FETCH_SIZE):
+    """Yield the rows of an executed query as `record`s, fetching `size`
+    rows at a time. The connection is closed once the rows run out."""
+    try:
+        while True:
+            rows = cursor.fetchmany(size)
+            if not rows:
+                break
+            for row in rows:
+                yield record._make(row)
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def run_query(query, query_params, lang, record=Revision):
     db_title = lang + 'wiki_p'
     db_host = lang + 'wiki.labsdb'
     connection = oursql.connect(db=db_title,
@@ -46,74 +198,180 @@ def run_query(query, query_params, lang):
                                 user=app.config['DB_USER'],
                                 passwd=app.config['DB_PASSWORD'],
                                 charset=None)
-    cursor = connection.cursor(oursql.DictCursor)
+    cursor = connection.cursor()
     cursor.execute(query, query_params)
-    ret = cursor.fetchall()
-    return ret
+    return stream(connection, cursor, record)
 
 
 def get_hashtags(tag, lang=DEFAULT_LANG, limit=DEFAULT_LIMIT):
     if tag and tag[0] == '#':
         tag = tag[1:]
-    connection = ht_db_connect()
-    cursor = connection.cursor(oursql.DictCursor)
-    query = '''
-    SELECT *
-    FROM recentchanges AS rc
-    JOIN hashtag_recentchanges AS htrc
-      ON htrc.htrc_id = rc.htrc_id
-    JOIN hashtags AS ht
-      ON ht.ht_id = htrc.ht_id
-    WHERE ht.ht_text = ?
-    AND rc.htrc_lang = ?
-    ORDER BY rc.rc_id DESC
-    LIMIT ?'''
-    params = (tag, lang, limit)
-    cursor.execute(query, params)
-    return cursor.fetchall()
+
+    def query(since_id):
+        connection = ht_db_connect()
+        cursor = connection.cursor()
+        query = '''
+        SELECT rc.rc_id,
+               rc.rc_title,
+               rc.rc_timestamp,
+               rc.rc_this_oldid,
+               rc.rc_last_oldid,
+               rc.rc_user_text,
+               rc.rc_old_len,
+               rc.rc_new_len,
+               rc.rc_comment
+        FROM recentchanges AS rc
+        JOIN hashtag_recentchanges AS htrc
+          ON htrc.htrc_id = rc.htrc_id
+        JOIN hashtags AS ht
+          ON ht.ht_id = htrc.ht_id
+        WHERE ht.ht_text = ?
+        AND rc.htrc_lang = ?
+        AND rc.rc_id > ?
+        ORDER BY rc.rc_id DESC
+        LIMIT ?'''
+        params = (tag, lang, since_id, limit)
+        cursor.execute(query, params)
+        return stream(connection, cursor, Change)
+
+    return row_cache.fetch(('hashtags', tag, lang, limit), query, limit=limit)
 
 
 def get_all_hashtags(lang=DEFAULT_LANG, limit=DEFAULT_LIMIT):
-    connection = ht_db_connect()
-    cursor = connection.cursor(oursql.DictCursor)
-    query = '''
-    SELECT *
-    FROM recentchanges AS rc
-    WHERE rc.rc_type = 0
-    ORDER BY rc.rc_id DESC
-    LIMIT ?'''
-    params = (limit,)
-    cursor.execute(query, params)
-    return cursor.fetchall()
-
-
-def get_category_members(category_name, lang=DEFAULT_LANG,
-                         hours=DEFAULT_HOURS, limit=DEFAULT_LIMIT):
-    query = '''SELECT rc.rc_title,
-       rc.rc_cur_id,
-       rc.rc_namespace,
-       cl.cl_timestamp
-       FROM recentchanges as rc
-       INNER JOIN recentchanges AS rc_talk
-             ON rc.rc_title = rc_talk.rc_title
-             AND rc_talk.rc_type = 0
-             AND rc.rc_namespace = (rc_talk.rc_namespace - (rc_talk.rc_namespace % 2))
-       INNER JOIN categorylinks AS cl
-             ON rc_talk.rc_cur_id = cl.cl_from
-       WHERE cl.cl_to = ?
-       AND rc.rc_type = 0
-       AND cl.cl_timestamp >= DATE_SUB(NOW(), INTERVAL ? HOUR)
-       GROUP BY rc.rc_cur_id
-       ORDER BY rc.rc_id DESC
-       LIMIT ?'''
-    query_params = (category_name.replace(' ', '_'), hours, limit)
-    ret = run_query(query, query_params, lang)
-    return ret
 
-def get_article_list_revisions(articles, lang=DEFAULT_LANG,
-                               hours=DEFAULT_HOURS, limit=DEFAULT_LIMIT):
-    query = '''SELECT DISTINCT rc_id,
+    def query(since_id):
+        connection = ht_db_connect()
+        cursor = connection.cursor()
+        query = '''
+        SELECT rc.rc_id,
+               rc.rc_title,
+               rc.rc_timestamp,
+               rc.rc_this_oldid,
+               rc.rc_last_oldid,
+               rc.rc_user_text,
+               rc.rc_old_len,
+               rc.rc_new_len,
+               rc.rc_comment
+        FROM recentchanges AS rc
+        WHERE rc.rc_type = 0
+        AND rc.rc_id > ?
+        ORDER BY rc.rc_id DESC
+        LIMIT ?'''
+        params = (since_id, limit)
+        cursor.execute(query, params)
+        return stream(connection, cursor, Change)
+
+    return row_cache.fetch(('all_hashtags', limit), query, limit=limit)
+
+
+def get_category_links(category_name, lang=DEFAULT_LANG, since=None):
+    """Fetch the members of a category that were added at or after `since`
+    (a UTC datetime, or None for the whole category). Talk pages are mapped
+    onto their subject pages, so each row describes the page an edit to
+    which counts as an edit to a category member."""
+    query = '''SELECT subject.page_id,
+                      subject.page_namespace,
+                      subject.page_title,
+                      cl.cl_timestamp
+               FROM categorylinks AS cl
+               INNER JOIN page AS p
+                   ON p.page_id = cl.cl_from
+               INNER JOIN page AS subject
+                   ON subject.page_title = p.page_title
+                   AND subject.page_namespace = (p.page_namespace - (p.page_namespace % 2))
+               WHERE cl.cl_to = ?
+               AND cl.cl_timestamp >= ?'''
+    if since is None:
+        since = EPOCH
+    query_params = (category_name.replace(' ', '_'), since)
+    return run_query(query, query_params, lang, record=CategoryLink)
+
+
+def get_geotagged_pages(south, west, north, east, lang=DEFAULT_LANG):
+    """Fetch the articles on `lang` Wikipedia whose primary coordinates on
+    Earth lie within the given bounding box, in degrees."""
+    query = '''SELECT p.page_title,
+                      gt.gt_lat,
+                      gt.gt_lon
+               FROM geo_tags AS gt
+               INNER JOIN page AS p
+                   ON p.page_id = gt.gt_page_id
+               WHERE gt.gt_primary = 1
+               AND gt.gt_globe = 'earth'
+               AND p.page_namespace = 0
+               AND gt.gt_lat_int BETWEEN ? AND ?
+               AND gt.gt_lon_int BETWEEN ? AND ?
+               AND gt.gt_lat BETWEEN ? AND ?
+               AND gt.gt_lon BETWEEN ? AND ?'''
+    query_params = (int(math.floor(south * GEO_INDEX_GRANULARITY)),
+                    int(math.ceil(north * GEO_INDEX_GRANULARITY)),
+                    int(math.floor(west * GEO_INDEX_GRANULARITY)),
+                    int(math.ceil(east * GEO_INDEX_GRANULARITY)),
+                    south, north, west, east)
+    return run_query(query, query_params, lang, record=GeoTag)
+
+
+def get_recent_changes(lang=DEFAULT_LANG, hours=DEFAULT_HOURS):
+    """Fetch every edit made to `lang` Wikipedia in the last `hours`."""
+
+    def query(since_id):
+        query = '''SELECT rc_id,
+                          rc_cur_id,
+                          rc_namespace,
+                          rc_title,
+                          rc_timestamp,
+                          rc_this_oldid,
+                          rc_last_oldid,
+                          rc_user_text,
+                          rc_old_len,
+                          rc_new_len,
+                          rc_comment
+                   FROM recentchanges
+                   WHERE rc_type = 0
+                   AND rc_id > ?
+                   AND rc_timestamp >= DATE_SUB(NOW(),
+                                                INTERVAL ? HOUR)
+                   ORDER BY rc_id DESC'''
+        query_params = (since_id, hours)
+        return run_query(query, query_params, lang)
+
+    return row_cache.fetch(('recentchanges', lang, hours), query, hours=hours)
+
+
+def get_changes_since(since_id, lang=DEFAULT_LANG, hours=DEFAULT_HOURS):
+    """Stream the edits by humans to articles on `lang` Wikipedia with an
+    rc_id above `since_id`, from the last `hours` at most, oldest first.
+    Used to tail recentchanges."""
+    query = '''SELECT rc_id,
                       rc_cur_id,
+                      rc_namespace,
+                      rc_title,
+                      rc_timestamp,
+                      rc_this_oldid,
+                      rc_last_oldid,
+                      rc_user_text,
+                      rc_old_len,
+                      rc_new_len,
+                      rc_comment
+               FROM recentchanges
+               WHERE rc_type IN (0, 1)
+               AND rc_namespace = 0
+               AND rc_bot = 0
+               AND rc_id > ?
+               AND rc_timestamp >= DATE_SUB(NOW(),
+                                            INTERVAL ? HOUR)
+               ORDER BY rc_id'''
+    query_params = (since_id, hours)
+    return run_query(query, query_params, lang)
+
+
+def get_title_revisions(titles, lang=DEFAULT_LANG, hours=DEFAULT_HOURS,
+                        since_id=0):
+    """Stream the edits to the given articles on `lang` Wikipedia with an
+    rc_id above `since_id`, from the last `hours`, newest first."""
+    query = '''SELECT rc_id,
+                      rc_cur_id,
+                      rc_namespace,
                       rc_title,
                       rc_timestamp,
                       rc_this_oldid,
@@ -124,43 +382,102 @@ def get_article_list_revisions(articles, lang=DEFAULT_LANG,
                       rc_comment
                FROM recentchanges
                WHERE rc_title IN (%s)
+               AND rc_namespace = 0
                AND rc_type = 0
+               AND rc_id > ?
                AND rc_timestamp >= DATE_SUB(NOW(),
                                                INTERVAL ? HOUR)
-               ORDER BY rc_id DESC
-               LIMIT ?''' % ', '.join(['?' for i in range(len(articles))])
-    query_params = tuple([article.replace(' ', '_') for article in articles]) + (hours, limit)
-    ret = run_query(query, query_params, lang)
-    return ret
-
-
-def get_category_member_revisions(category_name, lang=DEFAULT_LANG,
-                                  hours=DEFAULT_HOURS, limit=DEFAULT_LIMIT):
-    query = '''SELECT rc.rc_id,
-                      rc.rc_cur_id,
-                      rc.rc_title,
-                      rc.rc_timestamp,
-                      rc.rc_this_oldid,
-                      rc.rc_last_oldid,
-                      rc.rc_user_text,
-                      rc.rc_old_len,
-                      rc.rc_new_len,
-                      rc.rc_comment
-               FROM recentchanges AS rc
-               INNER JOIN recentchanges AS rc_talk
-                   ON rc.rc_title = rc_talk.rc_title
-                   AND rc_talk.rc_type = 0
-                   AND rc.rc_namespace = (rc_talk.rc_namespace - (rc_talk.rc_namespace % 2))
-               INNER JOIN categorylinks AS cl
-                   ON rc_talk.rc_cur_id = cl.cl_from
-               WHERE cl.cl_to = ?
-               AND rc.rc_type = 0
-               AND rc.rc_timestamp >= DATE_SUB(NOW(),
-                                               INTERVAL ? HOUR)
-               AND rc.rc_type = 0
-               GROUP BY rc.rc_this_oldid
-               ORDER BY rc.rc_id DESC
-               LIMIT ?'''
-    query_params = (category_name.replace(' ', '_'), hours, limit)
-    ret = run_query(query, query_params, lang)
-    return ret
+               ORDER BY rc_id DESC''' % ', '.join(['?' for i in range(len(titles))])
+    query_params = tuple(titles) + (since_id, hours)
+    return run_query(query, query_params, lang)
+
+
+class TitleRows(object):
+    """The recent edits to one title, newest first, and when they were
+    last brought up to date."""
+
+    __slots__ = ('rows', 'refreshed_at')
+
+    def __init__(self):
+        self.rows = []
+        self.refreshed_at = 0
+
+    @property
+    def watermark(self):
+        return self.rows[0].rc_id if self.rows else 0
+
+    def update(self, rows, cutoff):
+        rows = [row for row in rows if row.rc_id > self.watermark]
+        rows.sort(key=lambda row: row.rc_id, reverse=True)
+        self.rows = [row for row in rows + self.rows
+                     if row.rc_timestamp >= cutoff][:TITLE_ROW_LIMIT]
+
+
+class TitleRevisionCache(object):
+    """Recent edits per (wiki, title), shared by every title-list query.
+
+    A query for a list of titles is answered by merging the cached lists
+    of its titles. Only the titles that are missing or due for a refresh
+    are fetched, TITLE_BATCH_SIZE at a time, and each batch only asks for
+    the edits above the lowest rc_id its titles have seen. Batches run
+    concurrently on a thread pool."""
+
+    def __init__(self, maxsize=TITLE_CACHE_SIZE):
+        self.titles = LRUCache(maxsize)
+        self._lock = threading.Lock()
+        self._pool = PerProcess(lambda: ThreadPool(TITLE_POOL_SIZE))
+
+    def fetch(self, titles, lang, hours, limit):
+        now = time.time()
+        refresh_interval = app.config.get('DAL_REFRESH_INTERVAL',
+                                          DEFAULT_REFRESH_INTERVAL)
+        entries = {}
+        stale = []
+        for title in titles:
+            entry = self.titles.get((lang, hours, title))
+            if entry is None:
+                entry = TitleRows()
+                self.titles.set((lang, hours, title), entry)
+            entries[title] = entry
+            if entry.refreshed_at + refresh_interval <= now:
+                stale.append(title)
+        batches = [stale[i:i + TITLE_BATCH_SIZE]
+                   for i in range(0, len(stale), TITLE_BATCH_SIZE)]
+        # Pool threads have no app context of their own
+        flask_app = app._get_current_object()
+
+        def query(batch):
+            since_id = min(entries[title].watermark for title in batch)
+            with flask_app.app_context():
+                return batch, list(get_title_revisions(batch, lang, hours,
+                                                       since_id))
+
+        if len(batches) > 1:
+            results = self._pool.get().map(query, batches)
+        else:
+            results = map(query, batches)
+        cutoff = time.strftime(RC_TIMESTAMP_FORMAT,
+                               time.gmtime(now - hours * 60 * 60))
+        with self._lock:
+            for batch, rows in results:
+                by_title = collections.defaultdict(list)
+                for row in rows:
+                    by_title[row.rc_title].append(row)
+                for title in batch:
+                    entries[title].update(by_title[title], cutoff)
+                    entries[title].refreshed_at = now
+            rows = [row for title_rows in entries.values()
+                    for row in title_rows.rows if row.rc_timestamp >= cutoff]
+        rows.sort(key=lambda row: row.rc_id, reverse=True)
+        return rows[:limit]
+
+
+title_cache = TitleRevisionCache()
+
+
+def get_article_list_revisions(articles, lang=DEFAULT_LANG,
+                               hours=DEFAULT_HOURS, limit=DEFAULT_LIMIT):
+    """Fetch the latest `limit` edits to any of `articles` on `lang`
+    Wikipedia in the last `hours`, newest first."""
+    titles = set([article.replace(' ', '_') for article in articles])
+    return title_cache.fetch(titles, lang, hours, limit)
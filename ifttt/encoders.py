@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+  Wikipedia channel for IFTTT
+  ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+  Copyright 2015 Ori Livneh <ori@wikimedia.org>
+                 Stephen LaPorte <stephen.laporte@gmail.com>
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+"""
+
+import flask
+
+from caching import cache, make_key, RESPONSES
+
+# simplejson's C speedups are the fastest encoder that still round-trips
+# floats exactly; ujson truncates them. Without it, the standard library
+# json falls back to its own C encoder as long as we don't indent.
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+SEPARATORS = (',', ':')
+
+
+def dumps(obj):
+    """Encode `obj` as compact, ASCII-only JSON."""
+    return json.dumps(obj, separators=SEPARATORS)
+
+
+def encode_item(item, key=None):
+    """Encode a single trigger item. If `key` is given, the encoded item
+    is remembered under it, so that the next response containing the same
+    item can reuse the bytes instead of encoding it again."""
+    if key is None:
+        return dumps(item)
+    key = make_key(RESPONSES, 'item', repr(key))
+    ret = cache.get(key)
+    if ret is None:
+        ret = dumps(item)
+        cache.set(key, ret)
+    return ret
+
+
+def encode_data(fragments):
+    """Splice already encoded items into a `{"data": [...]}` body."""
+    return '{"data":[%s]}' % ','.join(fragments)
+
+
+def json_response(body, status=200):
+    """Wrap an encoded JSON body in a response."""
+    return flask.Response(body, status=status, mimetype='application/json')
+
+
+def jsonify(**kwargs):
+    """Drop-in replacement for flask.jsonify that encodes compactly."""
+    return json_response(dumps(kwargs))
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+  Wikipedia channel for IFTTT
+  ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+  Copyright 2015 Ori Livneh <ori@wikimedia.org>
+                 Stephen LaPorte <stephen.laporte@gmail.com>
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+"""
+
+import calendar
+import time
+from collections import namedtuple
+from email.utils import parsedate_tz
+
+import lxml.etree
+import lxml.html
+
+# An entry of a featured feed, as much of it as the triggers use.
+# `published_parsed` is a UTC time tuple, like feedparser's.
+FeedEntry = namedtuple('FeedEntry', ['id', 'published_parsed', 'summary'])
+# Elements that feedparser's sanitizer drops along with their text, like
+# the TemplateStyles <style> blocks embedded in featured content.
+UNACCEPTABLE_ELEMENTS = ('script', 'applet', 'style')
+
+
+def parse_pubdate(value):
+    """Parse an RFC 822 date, as used by RSS, into a UTC time tuple."""
+    parsed = parsedate_tz(value.strip())
+    ts = calendar.timegm(parsed[:9]) - (parsed[9] or 0)
+    return tuple(time.gmtime(ts))
+
+
+def newest_published(entries):
+    """Epoch time of the most recently published of `entries`, or 0."""
+    return max([calendar.timegm(entry.published_parsed)
+                for entry in entries] or [0])
+
+
+def read_featured_feed(stream):
+    """Yield a FeedEntry for each <item> of the RSS document read from
+    `stream`. The document is parsed incrementally, and each item is
+    discarded once it has been read, so only the current one is held in
+    memory. Unlike feedparser, the summary HTML is not sanitized or
+    otherwise touched; see `parse_summary`."""
+    for _, item in lxml.etree.iterparse(stream, events=('end',), tag='item'):
+        entry_id = item.findtext('guid') or item.findtext('link')
+        yield FeedEntry(entry_id.strip(),
+                        parse_pubdate(item.findtext('pubDate')),
+                        item.findtext('description'))
+        item.clear()
+        while item.getprevious() is not None:
+            del item.getparent()[0]
+
+
+def parse_summary(summary, base_url):
+    """Parse the HTML summary of an entry, resolving its links against
+    `base_url` and dropping the elements whose text isn't content, as
+    feedparser does."""
+    doc = lxml.html.fromstring(summary, base_url=base_url)
+    lxml.etree.strip_elements(doc, *UNACCEPTABLE_ELEMENTS, with_tail=False)
+    doc.make_links_absolute()
+    return doc
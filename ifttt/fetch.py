@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+  Wikipedia channel for IFTTT
+  ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+  Copyright 2015 Ori Livneh <ori@wikimedia.org>
+                 Stephen LaPorte <stephen.laporte@gmail.com>
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+"""
+
+import collections
+import Queue
+import threading
+import time
+import urllib2
+import urlparse
+
+DEFAULT_TIMEOUT = 30
+# A GET is hedged once it has taken longer than this percentile of the
+# recent response times of its host...
+DEFAULT_HEDGE_PERCENTILE = 95
+# ...as long as hedges stay under this share of all GETs.
+DEFAULT_HEDGE_RATE = 0.05
+# Hedges that may be sent in a burst, when the rate allows it.
+HEDGE_BURST = 10
+# Response times kept per host, and needed before its GETs are hedged.
+SAMPLE_SIZE = 200
+MIN_SAMPLES = 20
+MIN_HEDGE_DELAY = 0.05
+
+
+class Host(object):
+    """Recent response times of one host, and how its GETs fared."""
+
+    def __init__(self):
+        self.samples = collections.deque(maxlen=SAMPLE_SIZE)
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def hedge_delay(self, percentile):
+        """Seconds after which a GET to this host is hedged, or None if
+        there are too few samples to tell."""
+        samples = sorted(self.samples)
+        if len(samples) < MIN_SAMPLES:
+            return None
+        index = min(len(samples) - 1, len(samples) * percentile // 100)
+        return max(samples[index], MIN_HEDGE_DELAY)
+
+    def stats(self):
+        return {'requests': self.requests,
+                'hedges': self.hedges,
+                'hedge_wins': self.hedge_wins,
+                'samples': len(self.samples)}
+
+
+class Fetcher(object):
+    """HTTP client shared by everything that talks to MediaWiki.
+
+    GETs are assumed idempotent and may be hedged: if the response hasn't
+    arrived by the HEDGE_PERCENTILE response time of its host, a second
+    identical request is sent and whichever answers first is used. Each
+    GET earns HEDGE_RATE of a hedge, up to HEDGE_BURST, and each hedge
+    spends one, so hedging adds at most that share to upstream load."""
+
+    def __init__(self, percentile=DEFAULT_HEDGE_PERCENTILE,
+                 max_rate=DEFAULT_HEDGE_RATE):
+        self.configure(percentile, max_rate)
+
+    def configure(self, percentile=None, max_rate=None):
+        self.percentile = (DEFAULT_HEDGE_PERCENTILE if percentile is None
+                           else percentile)
+        self.max_rate = DEFAULT_HEDGE_RATE if max_rate is None else max_rate
+        self.tokens = 0.0
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    def host(self, url):
+        name = urlparse.urlparse(url).netloc
+        with self._lock:
+            host = self._hosts.get(name)
+            if host is None:
+                host = self._hosts[name] = Host()
+            host.requests += 1
+            self.tokens = min(self.tokens + self.max_rate, HEDGE_BURST)
+            return host
+
+    def spend_token(self):
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def read(self, host, request, timeout):
+        start = time.time()
+        resp = urllib2.urlopen(request, timeout=timeout)
+        try:
+            body = resp.read()
+        finally:
+            resp.close()
+        host.samples.append(time.time() - start)
+        return body
+
+    def attempt(self, host, url, timeout, results, hedge):
+        try:
+            results.put((hedge, self.read(host, url, timeout), None))
+        except Exception as e:
+            results.put((hedge, None, e))
+
+    def start(self, host, url, timeout, results, hedge=False):
+        thread = threading.Thread(target=self.attempt,
+                                  args=(host, url, timeout, results, hedge))
+        thread.daemon = True
+        thread.start()
+
+    def get(self, url, timeout=DEFAULT_TIMEOUT):
+        """GET `url` and return the body of the response."""
+        host = self.host(url)
+        delay = host.hedge_delay(self.percentile)
+        if delay is None or delay >= timeout or self.tokens < 1:
+            return self.read(host, url, timeout)
+        results = Queue.Queue()
+        self.start(host, url, timeout, results)
+        pending = 1
+        try:
+            hedge, body, error = results.get(timeout=delay)
+        except Queue.Empty:
+            if not self.spend_token():
+                hedge, body, error = results.get()
+            else:
+                host.hedges += 1
+                self.start(host, url, timeout, results, hedge=True)
+                pending = 2
+                hedge, body, error = results.get()
+        pending -= 1
+        # Use the first success, or the last error if both attempts fail
+        while error is not None and pending:
+            hedge, body, error = results.get()
+            pending -= 1
+        if error is not None:
+            raise error
+        if hedge:
+            host.hedge_wins += 1
+        return body
+
+    def post(self, url, body, headers=None, timeout=DEFAULT_TIMEOUT):
+        """POST `body` to `url` and return the body of the response.
+        POSTs are never hedged."""
+        request = urllib2.Request(url, body, headers or {})
+        return self.read(self.host(url), request, timeout)
+
+    def stats(self):
+        with self._lock:
+            hosts = self._hosts.items()
+        return dict((name, host.stats()) for name, host in hosts)
+
+
+fetcher = Fetcher()
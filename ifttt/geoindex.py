@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+  Wikipedia channel for IFTTT
+  ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+  Copyright 2015 Ori Livneh <ori@wikimedia.org>
+                 Stephen LaPorte <stephen.laporte@gmail.com>
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+"""
+
+import math
+import time
+from array import array
+
+from dal import get_geotagged_pages
+from utils import LRUCache
+
+# Cells are CELL_DEGREES of latitude by CELL_DEGREES of longitude, about
+# 11 km high. A query with the largest radius the trigger allows touches
+# a handful of them.
+CELL_DEGREES = 0.1
+CELLS_AROUND = int(round(360 / CELL_DEGREES))
+CELL_MAX_AGE = 24 * 60 * 60
+MAX_CELLS = 5000
+MAX_TITLES = 500
+# Queries spanning more columns than this, close to the poles, read their
+# bounding box directly instead of going through the grid.
+MAX_COLUMNS = 24
+EARTH_RADIUS = 6371000.0
+
+
+def distance(lat1, lon1, lat2, lon2):
+    """Great-circle distance in meters between two points, in degrees."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def cell_ranges(lat, lon, radius):
+    """The rows and the columns of the cells that a circle of `radius`
+    meters around a point overlaps."""
+    dlat = math.degrees(float(radius) / EARTH_RADIUS)
+    dlon = dlat / max(math.cos(math.radians(lat)), 0.01)
+    south = max(lat - dlat, -90.0)
+    north = min(lat + dlat, 90.0)
+    rows = range(int(math.floor(south / CELL_DEGREES)),
+                 int(math.floor(north / CELL_DEGREES)) + 1)
+    if dlon >= 180:
+        columns = range(-CELLS_AROUND // 2, CELLS_AROUND // 2)
+    else:
+        columns = [(column + CELLS_AROUND // 2) % CELLS_AROUND -
+                   CELLS_AROUND // 2
+                   for column in range(
+                       int(math.floor((lon - dlon) / CELL_DEGREES)),
+                       int(math.floor((lon + dlon) / CELL_DEGREES)) + 1)]
+    return rows, sorted(set(columns))
+
+
+def cells_near(lat, lon, radius):
+    """The (row, column) of every cell that a circle of `radius` meters
+    around a point overlaps."""
+    rows, columns = cell_ranges(lat, lon, radius)
+    return [(row, column) for row in rows for column in columns]
+
+
+def runs(values):
+    """Split sorted integers into runs of consecutive ones, as (first,
+    last) pairs."""
+    ret = []
+    for value in values:
+        if ret and ret[-1][1] == value - 1:
+            ret[-1] = (ret[-1][0], value)
+        else:
+            ret.append((value, value))
+    return ret
+
+
+class Cell(object):
+    """The geotagged articles of one cell, as parallel columns."""
+
+    __slots__ = ('titles', 'lats', 'lons', 'fetched_at')
+
+    def __init__(self, rows, fetched_at):
+        self.titles = []
+        self.lats = array('d')
+        self.lons = array('d')
+        for row in rows:
+            self.titles.append(row.page_title.replace('_', ' '))
+            self.lats.append(row.gt_lat)
+            self.lons.append(row.gt_lon)
+        self.fetched_at = fetched_at
+
+
+class GeoIndex(object):
+    """Geotagged article titles per wiki, on a grid of cells.
+
+    A cell is read from the database the first time a query touches it,
+    and again once it is older than CELL_MAX_AGE, since articles rarely
+    gain or lose coordinates. The cells a query is missing are read
+    together, with a bounding box query per run of adjacent columns.
+    Queries around nearby points touch the same cells and so share the
+    work. The least recently used cells are forgotten beyond MAX_CELLS."""
+
+    def __init__(self, max_cells=MAX_CELLS, max_age=CELL_MAX_AGE):
+        self.max_age = max_age
+        self.cells = LRUCache(max_cells)
+
+    def load(self, lang, keys, now):
+        """Read the cells `keys` from the database, and those between
+        them, returning them by (row, column)."""
+        rows = sorted(set(row for row, column in keys))
+        first_row, last_row = rows[0], rows[-1]
+        loaded = {}
+        for first, last in runs(sorted(set(column for row, column in keys))):
+            tags = dict(((row, column), [])
+                        for row in range(first_row, last_row + 1)
+                        for column in range(first, last + 1))
+            for tag in get_geotagged_pages(first_row * CELL_DEGREES,
+                                           first * CELL_DEGREES,
+                                           (last_row + 1) * CELL_DEGREES,
+                                           (last + 1) * CELL_DEGREES,
+                                           lang=lang):
+                # Clamped, since rows on an edge match either cell
+                row = int(math.floor(tag.gt_lat / CELL_DEGREES))
+                column = int(math.floor(tag.gt_lon / CELL_DEGREES))
+                tags[(min(max(row, first_row), last_row),
+                      min(max(column, first), last))].append(tag)
+            for key, cell_tags in tags.items():
+                loaded[key] = Cell(cell_tags, now)
+                self.cells.set((lang,) + key, loaded[key])
+        return loaded
+
+    def cells_near(self, lang, lat, lon, radius):
+        """The cells around a point, read from the database if they are
+        missing or too old."""
+        now = time.time()
+        rows, columns = cell_ranges(lat, lon, radius)
+        if len(columns) > MAX_COLUMNS:
+            return [Cell(get_geotagged_pages(rows[0] * CELL_DEGREES, -180.0,
+                                             (rows[-1] + 1) * CELL_DEGREES,
+                                             180.0, lang=lang), now)]
+        found = []
+        missing = []
+        for row in rows:
+            for column in columns:
+                cell = self.cells.get((lang, row, column))
+                if cell is None or cell.fetched_at + self.max_age <= now:
+                    missing.append((row, column))
+                else:
+                    found.append(cell)
+        if missing:
+            found.extend(self.load(lang, missing, now).values())
+        return found
+
+    def titles_near(self, lang, lat, lon, radius, limit=MAX_TITLES):
+        """Titles of the articles within `radius` meters of a point,
+        nearest first, `limit` at most."""
+        found = {}
+        for cell in self.cells_near(lang, lat, lon, radius):
+            for title, title_lat, title_lon in zip(cell.titles, cell.lats,
+                                                   cell.lons):
+                meters = distance(lat, lon, title_lat, title_lon)
+                if meters <= radius:
+                    found[title] = meters
+        return sorted(found, key=found.get)[:limit]
+
+
+geo_index = GeoIndex()
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+  Wikipedia channel for IFTTT
+  ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+  Copyright 2015 Ori Livneh <ori@wikimedia.org>
+                 Stephen LaPorte <stephen.laporte@gmail.com>
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+"""
+
+import atexit
+import datetime
+import json
+import logging
+import Queue
+import threading
+
+from utils import PerProcess
+
+DEFAULT_LOG_FILE = 'ifttt.log'
+DEFAULT_LOG_LEVEL = 'INFO'
+DEFAULT_QUEUE_SIZE = 10000
+BATCH_SIZE = 500
+
+# Attributes every LogRecord has; anything else was passed as `extra`.
+_RECORD_ATTRS = set(logging.LogRecord('', 0, '', 0, '', (), None).__dict__)
+_RECORD_ATTRS.add('message')
+
+
+class StructuredFormatter(logging.Formatter):
+    """Format each record as a single line of JSON, with any `extra`
+    fields (such as `trigger` and `identity`) as keys of their own."""
+
+    def format(self, record):
+        line = {'time': datetime.datetime.utcfromtimestamp(
+                    record.created).isoformat() + 'Z',
+                'level': record.levelname,
+                'logger': record.name,
+                'message': record.getMessage()}
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                line[key] = value
+        if record.exc_info:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            line['exception'] = record.exc_text
+        return json.dumps(line, default=repr)
+
+
+class SamplingFilter(logging.Filter):
+    """Let through only one in `rate` routine INFO lines per trigger.
+    Rates are looked up by trigger name in `rates`, falling back to
+    `default_rate`. Anything above INFO is never dropped."""
+
+    def __init__(self, default_rate=1, rates=None):
+        logging.Filter.__init__(self)
+        self.default_rate = default_rate
+        self.rates = rates or {}
+        self.counts = {}
+
+    def filter(self, record):
+        trigger = getattr(record, 'trigger', None)
+        if trigger is None or record.levelno != logging.INFO:
+            return True
+        rate = self.rates.get(trigger, self.default_rate)
+        if rate <= 1:
+            return True
+        count = self.counts.get(trigger, 0)
+        self.counts[trigger] = count + 1
+        return count % rate == 0
+
+
+class QueueListener(threading.Thread):
+    """Drain queued records in the background and append them to a file,
+    one batch per write."""
+
+    def __init__(self, queue, filename, formatter):
+        threading.Thread.__init__(self, name='log-writer')
+        self.daemon = True
+        self.queue = queue
+        self.filename = filename
+        self.formatter = formatter
+
+    def run(self):
+        with open(self.filename, 'a') as stream:
+            while True:
+                records = [self.queue.get()]
+                while len(records) < BATCH_SIZE:
+                    try:
+                        records.append(self.queue.get_nowait())
+                    except Queue.Empty:
+                        break
+                lines = []
+                for record in records:
+                    if record is None:
+                        continue
+                    try:
+                        lines.append(self.formatter.format(record))
+                    except Exception:
+                        pass
+                if lines:
+                    stream.write('\n'.join(lines) + '\n')
+                    stream.flush()
+                if None in records:
+                    return
+
+
+class QueueHandler(logging.Handler):
+    """Hand records off to a QueueListener instead of writing them on
+    the request path. When the queue is full, records are
+    dropped and counted rather than blocking the caller."""
+
+    def __init__(self, filename, maxsize=DEFAULT_QUEUE_SIZE):
+        logging.Handler.__init__(self)
+        self.filename = filename
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._listener = PerProcess(self.start)
+
+    def start(self):
+        queue = Queue.Queue(self.maxsize)
+        listener = QueueListener(queue, self.filename, self.formatter)
+        listener.start()
+        return queue, listener
+
+    def stop(self):
+        """Flush what is queued and stop the listener."""
+        started = self._listener.peek()
+        if started is None:
+            return
+        queue, listener = started
+        queue.put(None)
+        listener.join(5)
+        self._listener.reset()
+
+    def prepare(self, record):
+        # Render the message now, while its arguments are still intact,
+        # and drop references that can't safely cross threads.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self.formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        queue, listener = self._listener.get()
+        try:
+            queue.put_nowait(self.prepare(record))
+        except Queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(config):
+    """Route all logging through a QueueHandler, as configured by
+    LOG_FILE, LOG_LEVEL, LOG_SAMPLE_RATE and LOG_SAMPLE_RATES."""
+    handler = QueueHandler(config.get('LOG_FILE', DEFAULT_LOG_FILE))
+    handler.setFormatter(StructuredFormatter())
+    handler.addFilter(SamplingFilter(config.get('LOG_SAMPLE_RATE', 1),
+                                     config.get('LOG_SAMPLE_RATES')))
+    root = logging.getLogger()
+    for old_handler in root.handlers[:]:
+        if isinstance(old_handler, QueueHandler):
+            root.removeHandler(old_handler)
+    root.addHandler(handler)
+    root.setLevel(config.get('LOG_LEVEL', DEFAULT_LOG_LEVEL))
+    atexit.register(handler.stop)
+    return handler
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+  Wikipedia channel for IFTTT
+  ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+  Copyright 2015 Ori Livneh <ori@wikimedia.org>
+                 Stephen LaPorte <stephen.laporte@gmail.com>
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+"""
+
+import hashlib
+import logging
+import threading
+import time
+
+from caching import cache
+from utils import LRUCache, PerProcess, start_thread
+
+DAY = 24 * 60 * 60
+DEFAULT_TTL = 5 * 60
+# Feeds are regenerated a little after midnight, so don't refetch on the
+# dot.
+DEFAULT_ROLLOVER_DELAY = 2 * 60
+ADAPTIVE_MIN_TTL = 30
+ADAPTIVE_MAX_TTL = 60 * 60
+# Cache for this fraction of the typical time between changes of a key.
+ADAPTIVE_FRACTION = 0.5
+# Weight of the newest interval in the running estimate.
+ADAPTIVE_SMOOTHING = 0.5
+ADAPTIVE_MAX_KEYS = 10000
+
+log = logging.getLogger(__name__)
+
+
+def cached(key, fetch, policy):
+    """Return the value cached under `key`, calling `fetch` and caching its
+    result for as long as `policy` says if there is none."""
+    value = cache.get(key)
+    if value is None:
+        value = fetch()
+        cache.set(key, value, timeout=policy.timeout(key, value))
+        policy.fetched(key, fetch)
+    return value
+
+
+class CachePolicy(object):
+    """Decides how long each freshly fetched value is cached. By default,
+    for DEFAULT_TTL seconds."""
+
+    def timeout(self, key, value):
+        return DEFAULT_TTL
+
+    def fetched(self, key, fetch):
+        """Called after `key` was (re)fetched with `fetch`."""
+        pass
+
+
+class FixedTTL(CachePolicy):
+    """Cache everything for the same number of seconds."""
+
+    def __init__(self, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+
+    def timeout(self, key, value):
+        return self.ttl
+
+
+class DailyRollover(CachePolicy):
+    """For content that changes once a day at a fixed UTC time, such as
+    the featured feeds. Values are cached until `delay` seconds after the
+    next UTC midnight, when a background thread fetches every key seen
+    during the day again, so the first request of the day finds it warm.
+
+    If `newest` is given, it is called with each value and returns the
+    epoch time of the newest thing in it. A value with nothing dated
+    today, such as a feed fetched before upstream rolled over, is only
+    cached for `stale_ttl` seconds."""
+
+    def __init__(self, delay=DEFAULT_ROLLOVER_DELAY, prewarm=True,
+                 newest=None, stale_ttl=DEFAULT_TTL):
+        self.delay = delay
+        self.prewarm = prewarm
+        self.newest = newest
+        self.stale_ttl = stale_ttl
+        self.fetchers = {}
+        self._lock = threading.Lock()
+        self._thread = PerProcess(lambda: start_thread(self.run,
+                                                       'cache-prewarm'))
+
+    def next_rollover(self, now=None):
+        if now is None:
+            now = time.time()
+        return (now - self.delay) // DAY * DAY + DAY + self.delay
+
+    def timeout(self, key, value):
+        now = time.time()
+        if self.newest is not None and self.newest(value) < now // DAY * DAY:
+            return self.stale_ttl
+        return max(1, int(self.next_rollover(now) - now))
+
+    def fetched(self, key, fetch):
+        if not self.prewarm:
+            return
+        with self._lock:
+            self.fetchers[key] = fetch
+        self._thread.get()
+
+    def run(self):
+        while True:
+            time.sleep(max(0, self.next_rollover() - time.time()))
+            with self._lock:
+                fetchers = self.fetchers
+                self.fetchers = {}
+            warmed = 0
+            for key, fetch in fetchers.items():
+                try:
+                    value = fetch()
+                except Exception:
+                    log.warning('Could not prewarm %s', key, exc_info=True)
+                    continue
+                cache.set(key, value, timeout=self.timeout(key, value))
+                with self._lock:
+                    self.fetchers.setdefault(key, fetch)
+                warmed += 1
+            log.info('Prewarmed %d of %d cache keys', warmed, len(fetchers))
+
+
+class AdaptiveTTL(CachePolicy):
+    """Cache each key for a fraction of the time its value usually goes
+    unchanged, so that quiet keys are kept longer and busy ones refetched
+    sooner. The estimate is a running average of the intervals between
+    observed changes, stretched while a key stays the same."""
+
+    def __init__(self, min_ttl=ADAPTIVE_MIN_TTL, max_ttl=ADAPTIVE_MAX_TTL,
+                 initial_ttl=DEFAULT_TTL, max_keys=ADAPTIVE_MAX_KEYS):
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.initial_ttl = initial_ttl
+        # key -> (digest of the last value, when it changed, interval)
+        self.history = LRUCache(max_keys)
+
+    def observe(self, key, value, now=None):
+        """Record the latest value of `key`, returning the estimated
+        number of seconds between its changes."""
+        if now is None:
+            now = time.time()
+        digest = hashlib.sha1(repr(value)).digest()
+        seen = self.history.get(key)
+        if seen is None:
+            interval = self.initial_ttl / ADAPTIVE_FRACTION
+            self.history.set(key, (digest, now, interval))
+            return interval
+        last_digest, changed_at, interval = seen
+        if digest != last_digest:
+            interval += ADAPTIVE_SMOOTHING * (now - changed_at - interval)
+            changed_at = now
+        else:
+            interval = max(interval, now - changed_at)
+        self.history.set(key, (digest, changed_at, interval))
+        return interval
+
+    def timeout(self, key, value):
+        ttl = int(self.observe(key, value) * ADAPTIVE_FRACTION)
+        return min(self.max_ttl, max(self.min_ttl, ttl))
@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+"""
+  Wikipedia channel for IFTTT
+  ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+  Copyright 2015 Ori Livneh <ori@wikimedia.org>
+                 Stephen LaPorte <stephen.laporte@gmail.com>
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+"""
+
+import fcntl
+import json
+import logging
+import os
+import Queue
+import threading
+import time
+import uuid
+
+from admission import admission_control
+from fetch import fetcher
+from utils import PerProcess, start_thread
+
+# A group of identities is checked this often while it keeps changing,
+# and backs off by doubling up to the maximum while it is quiet.
+DEFAULT_MIN_INTERVAL = 60
+DEFAULT_MAX_INTERVAL = 15 * 60
+# Identities that IFTTT hasn't polled for this long are forgotten.
+IDENTITY_EXPIRATION = 24 * 60 * 60
+MAX_IDENTITIES = 100000
+# IFTTT accepts up to this many notifications per request.
+NOTIFICATION_BATCH_SIZE = 1000
+TICK = 5
+# Only the worker holding a lock on REALTIME_LOCK_FILE checks groups and
+# sends notifications. Every worker queues the registrations it sees in
+# memory and appends them to REALTIME_SPOOL_FILE once per tick for that
+# worker to pick up. Registrations beyond either limit are dropped; IFTTT
+# polls again soon enough to register them anew.
+MAX_QUEUED = 10000
+DEFAULT_MAX_SPOOL_BYTES = 16 * 1024 * 1024
+_cur_dir = os.path.dirname(__file__)
+DEFAULT_LOCK_FILE = os.path.join(_cur_dir, '../cache/realtime.lock')
+DEFAULT_SPOOL_FILE = os.path.join(_cur_dir, '../cache/realtime.spool')
+
+log = logging.getLogger(__name__)
+
+
+class HTTPSink(object):
+    """Send notifications to IFTTT's Realtime API."""
+
+    def __init__(self, url, channel_key):
+        self.url = url
+        self.channel_key = channel_key
+
+    def send(self, identities):
+        body = json.dumps({'data': [{'trigger_identity': identity}
+                                    for identity in identities]})
+        fetcher.post(self.url, body, {
+            'Content-Type': 'application/json',
+            'IFTTT-Channel-Key': self.channel_key,
+            'X-Request-ID': str(uuid.uuid4())}, timeout=10)
+
+
+class LocalSink(object):
+    """Stand-in for HTTPSink that keeps what would have been sent, for
+    tests and for running without talking to IFTTT."""
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, identities):
+        self.sent.append(list(identities))
+
+
+class Group(object):
+    """Identities of the same trigger with the same fields and limit,
+    which see the same items, and the item ids they were last shown."""
+
+    def __init__(self, view_class, fields, limit, interval):
+        self.view_class = view_class
+        self.fields = fields
+        self.limit = limit
+        self.identities = set()
+        self.seen = set()
+        self.interval = interval
+        self.next_check = time.time() + interval
+
+
+class RealtimeNotifier(object):
+    """Tell IFTTT when trigger identities have new items, so that it can
+    poll the identities that changed promptly rather than all of them on
+    a schedule.
+
+    Identities are registered as IFTTT polls them. A background thread
+    reruns the trigger of each group of identically configured identities
+    when it is due, and notifies every identity of a group whose items
+    include new ones. Groups that change are checked every `min_interval`
+    seconds; quiet ones back off to `max_interval`.
+
+    Every worker has the thread, but only the one that holds the lock
+    file runs the checks, so each group is checked once per instance.
+    Registrations are queued in memory, and each worker's thread appends
+    them to a spool file in one write per tick, which the worker running
+    the checks then drains. If it exits, another worker takes the lock
+    over."""
+
+    def __init__(self):
+        self.sink = None
+        self.app = None
+        self.view_classes = {}
+        self.min_interval = DEFAULT_MIN_INTERVAL
+        self.max_interval = DEFAULT_MAX_INTERVAL
+        self.lock_path = DEFAULT_LOCK_FILE
+        self.spool_path = DEFAULT_SPOOL_FILE
+        self.max_spool_bytes = DEFAULT_MAX_SPOOL_BYTES
+        self.dropped = 0
+        self._queue = Queue.Queue(MAX_QUEUED)
+        self._lock = threading.Lock()
+        self._tick_lock = threading.Lock()
+        self._lock_file = None
+        self._groups = {}
+        # identity -> (group key, when it was last polled)
+        self._identities = {}
+        self._thread = PerProcess(lambda: start_thread(self.run, 'realtime'))
+
+    def configure(self, app, view_classes=(), sink=None):
+        """Enable notifications for `view_classes`, sent to `sink` or else
+        to REALTIME_URL. Without either, notifications stay disabled."""
+        url = app.config.get('REALTIME_URL')
+        if sink is None and url:
+            sink = HTTPSink(url, app.config.get('CHANNEL_KEY'))
+        self.sink = sink
+        self.app = app
+        self.view_classes = dict((view_class.__name__, view_class)
+                                 for view_class in view_classes)
+        self.min_interval = app.config.get('REALTIME_MIN_INTERVAL',
+                                           DEFAULT_MIN_INTERVAL)
+        self.max_interval = app.config.get('REALTIME_MAX_INTERVAL',
+                                           DEFAULT_MAX_INTERVAL)
+        self.lock_path = app.config.get('REALTIME_LOCK_FILE',
+                                        DEFAULT_LOCK_FILE)
+        self.spool_path = app.config.get('REALTIME_SPOOL_FILE',
+                                         DEFAULT_SPOOL_FILE)
+        self.max_spool_bytes = app.config.get('REALTIME_MAX_SPOOL_BYTES',
+                                              DEFAULT_MAX_SPOOL_BYTES)
+
+    def register(self, identity, view_class, fields, limit, data):
+        """Note that IFTTT polled `identity` and was shown `data`."""
+        if self.sink is None or not identity:
+            return
+        self.enqueue({'op': 'register',
+                      'identity': identity,
+                      'trigger': view_class.__name__,
+                      'fields': fields,
+                      'limit': limit,
+                      'seen': [item['meta']['id'] for item in data],
+                      'polled_at': time.time()})
+
+    def forget(self, identity):
+        """Stop notifying `identity`, e.g. when its applet is removed."""
+        if self.sink is None or not identity:
+            return
+        self.enqueue({'op': 'forget', 'identity': identity})
+
+    def enqueue(self, request):
+        """Queue `request` for this worker's thread to spool, without
+        touching the disk on the request path."""
+        try:
+            self._queue.put_nowait(request)
+        except Queue.Full:
+            self.dropped += 1
+        self._thread.get()
+
+    def spool(self):
+        """Append the queued requests to the spool in one write, for the
+        worker that runs the checks to pick up."""
+        requests = []
+        while True:
+            try:
+                requests.append(self._queue.get_nowait())
+            except Queue.Empty:
+                break
+        if not requests:
+            return 0
+        data = ''.join(json.dumps(request) + '\n' for request in requests)
+        directory = os.path.dirname(self.spool_path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(self.spool_path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            size = os.fstat(f.fileno()).st_size
+            if size + len(data) > self.max_spool_bytes:
+                self.dropped += len(requests)
+                return 0
+            f.write(data)
+        return len(requests)
+
+    def drain(self):
+        """Apply the spooled requests of every worker."""
+        try:
+            with open(self.spool_path, 'r+') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                lines = f.readlines()
+                f.seek(0)
+                f.truncate()
+        except IOError:
+            return 0
+        for line in lines:
+            try:
+                request = json.loads(line)
+                if request['op'] == 'register':
+                    self.apply_register(request)
+                else:
+                    self.apply_forget(request['identity'])
+            except (ValueError, KeyError, TypeError):
+                log.warning('Could not apply realtime request %r', line,
+                            exc_info=True)
+        return len(lines)
+
+    def apply_register(self, request):
+        view_class = self.view_classes.get(request['trigger'])
+        if view_class is None:
+            return
+        identity = request['identity']
+        fields = request['fields']
+        key = (request['trigger'], repr(sorted(fields.items())),
+               request['limit'])
+        with self._lock:
+            old = self._identities.get(identity)
+            if old is not None and old[0] != key:
+                self._leave(identity, old[0])
+            group = self._groups.get(key)
+            if group is None:
+                group = self._groups[key] = Group(view_class, dict(fields),
+                                                  request['limit'],
+                                                  self.min_interval)
+            group.identities.add(identity)
+            group.seen.update(request['seen'])
+            self._identities[identity] = (key, request['polled_at'])
+            if len(self._identities) > MAX_IDENTITIES:
+                self.expire(time.time())
+
+    def apply_forget(self, identity):
+        with self._lock:
+            old = self._identities.pop(identity, None)
+            if old is not None:
+                self._leave(identity, old[0])
+            return old is not None
+
+    def _leave(self, identity, key):
+        group = self._groups.get(key)
+        if group is not None:
+            group.identities.discard(identity)
+            if not group.identities:
+                del self._groups[key]
+
+    def expire(self, now):
+        for identity, (key, polled_at) in self._identities.items():
+            if polled_at + IDENTITY_EXPIRATION < now:
+                del self._identities[identity]
+                self._leave(identity, key)
+
+    def check(self, group):
+        """Rerun the trigger of `group`, returning whether it has items
+        that weren't seen before. Checks never wait for a trigger that
+        is busy serving IFTTT; they are retried later instead."""
+        gate = admission_control.gate(group.view_class.__name__)
+        if not gate.enter(wait=0):
+            return False
+        try:
+            view = group.view_class()
+            view.fields = dict(group.fields)
+            view.limit = group.limit
+            view.params = {}
+            data = view.get_data()[:group.limit]
+        finally:
+            gate.leave()
+        ids = set(item['meta']['id'] for item in data)
+        with self._lock:
+            changed = bool(ids - group.seen)
+            group.seen = ids
+        return changed
+
+    def run_once(self, now=None):
+        """Check the groups that are due and send the notifications."""
+        if now is None:
+            now = time.time()
+        with self._lock:
+            self.expire(now)
+            due = [group for group in self._groups.values()
+                   if group.next_check <= now]
+        notify = []
+        for group in due:
+            try:
+                with self.app.app_context():
+                    changed = self.check(group)
+            except Exception:
+                log.warning('Could not check %s', group.view_class.__name__,
+                            exc_info=True)
+                changed = False
+            if changed:
+                group.interval = self.min_interval
+                notify.extend(group.identities)
+            else:
+                group.interval = min(group.interval * 2, self.max_interval)
+            group.next_check = now + group.interval
+        for i in range(0, len(notify), NOTIFICATION_BATCH_SIZE):
+            try:
+                self.sink.send(notify[i:i + NOTIFICATION_BATCH_SIZE])
+            except Exception:
+                log.warning('Could not send realtime notifications',
+                            exc_info=True)
+        return notify
+
+    def claim(self):
+        """Try to become the worker that runs the checks."""
+        if self._lock_file is None:
+            directory = os.path.dirname(self.lock_path)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            f = open(self.lock_path, 'a')
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                f.close()
+                return False
+            self._lock_file = f
+        return True
+
+    def tick(self, now=None):
+        """Spool the queued requests, then run the checks that are due if
+        this is the worker that runs them. Returns the identities that
+        were notified."""
+        with self._tick_lock:
+            self.spool()
+            if not self.claim():
+                return []
+            self.drain()
+            return self.run_once(now)
+
+    def run(self):
+        while True:
+            time.sleep(TICK)
+            try:
+                self.tick()
+            except Exception:
+                log.warning('Realtime tick failed', exc_info=True)
+
+    def stats(self):
+        with self._lock:
+            return {'enabled': self.sink is not None,
+                    'scheduler': self._lock_file is not None,
+                    'identities': len(self._identities),
+                    'groups': len(self._groups),
+                    'queued': self._queue.qsize(),
+                    'dropped': self.dropped}
+
+
+notifier = RealtimeNotifier()
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+  Wikipedia channel for IFTTT
+  ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+  Copyright 2015 Ori Livneh <ori@wikimedia.org>
+                 Stephen LaPorte <stephen.laporte@gmail.com>
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+"""
+
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Below this many timestamps, building NumPy arrays costs more than it saves.
+VECTORIZE_THRESHOLD = 256
+
+
+def days_from_civil(year, month, day):
+    """Number of days between 1970-01-01 and a proleptic Gregorian date.
+    Plain integer arithmetic, so it works element-wise on NumPy arrays
+    just as well as on ints."""
+    year = year - (month <= 2)
+    era = year // 400
+    yoe = year - era * 400
+    doy = (153 * ((month + 9) % 12) + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+def civil_to_epoch(year, month, day, hour=0, minute=0, second=0):
+    """Convert a UTC calendar time to seconds since epoch."""
+    days = days_from_civil(year, month, day)
+    return ((days * 24 + hour) * 60 + minute) * 60 + second
+
+
+def mw_to_epoch(ts):
+    """Convert a 14-digit MediaWiki timestamp (YYYYMMDDHHMMSS, UTC) to an
+    integer number of seconds since epoch."""
+    if len(ts) != 14:
+        raise ValueError('not a MediaWiki timestamp: %r' % ts)
+    return civil_to_epoch(int(ts[0:4]), int(ts[4:6]), int(ts[6:8]),
+                          int(ts[8:10]), int(ts[10:12]), int(ts[12:14]))
+
+
+def mw_to_epoch_many(timestamps):
+    """Convert a column of 14-digit MediaWiki timestamps at once. Large
+    columns are converted with NumPy when it is installed."""
+    if numpy is None or len(timestamps) < VECTORIZE_THRESHOLD:
+        return [mw_to_epoch(ts) for ts in timestamps]
+    # Casting to S14 would silently cut longer values short
+    for ts in timestamps:
+        if len(ts) != 14:
+            raise ValueError('not a MediaWiki timestamp: %r' % ts)
+    digits = numpy.array(timestamps, dtype='S14')
+    digits = digits.view(numpy.uint8).reshape(-1, 14).astype(numpy.int64)
+    digits -= ord('0')
+
+    def field(start, stop):
+        ret = numpy.zeros(len(digits), dtype=numpy.int64)
+        for i in range(start, stop):
+            ret = ret * 10 + digits[:, i]
+        return ret
+
+    epochs = civil_to_epoch(field(0, 4), field(4, 6), field(6, 8),
+                            field(8, 10), field(10, 12), field(12, 14))
+    return epochs.tolist()
+
+
+def mw_to_iso8601(ts):
+    """Make a W3-style ISO 8601 UTC timestamp from a MediaWiki one."""
+    if len(ts) != 14:
+        raise ValueError('not a MediaWiki timestamp: %r' % ts)
+    return '%s-%s-%sT%s:%s:%sZ' % (ts[0:4], ts[4:6], ts[6:8],
+                                   ts[8:10], ts[10:12], ts[12:14])
+
+
+def iso8601_to_epoch(iso_time):
+    """Convert a YYYY-MM-DDTHH:MM:SSZ timestamp to seconds since epoch."""
+    if len(iso_time) != 20 or iso_time[19] != 'Z':
+        raise ValueError('not an ISO 8601 UTC timestamp: %r' % iso_time)
+    return civil_to_epoch(int(iso_time[0:4]), int(iso_time[5:7]),
+                          int(iso_time[8:10]), int(iso_time[11:13]),
+                          int(iso_time[14:16]), int(iso_time[17:19]))
+
+
+def epoch_to_iso8601(ts):
+    """Make a W3-style ISO 8601 UTC timestamp from seconds since epoch."""
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(ts))
+
+
+def datetime_to_iso8601(dt):
+    """Make a W3-style ISO 8601 timestamp from a naive UTC datetime."""
+    return dt.isoformat() + 'Z'
+
+
+def datetime_to_epoch(dt):
+    """Convert a naive UTC datetime to seconds since epoch."""
+    return civil_to_epoch(dt.year, dt.month, dt.day,
+                          dt.hour, dt.minute, dt.second)
+
+
+def struct_to_iso8601_date(struct_time):
+    """Make an ISO 8601 date from a UTC struct_time."""
+    return '%04d-%02d-%02d' % tuple(struct_time[:3])
+
+
+def struct_to_epoch(struct_time):
+    """Convert a UTC struct_time to seconds since epoch."""
+    return civil_to_epoch(*struct_time[:6])
@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+"""
+  Wikipedia channel for IFTTT
+  ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+  Copyright 2015 Ori Livneh <ori@wikimedia.org>
+                 Stephen LaPorte <stephen.laporte@gmail.com>
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+"""
+
+import bisect
+import collections
+import heapq
+import itertools
+import logging
+import threading
+import time
+from array import array
+
+from dal import get_changes_since
+from timestamps import mw_to_epoch, epoch_to_iso8601
+from utils import PerProcess, start_thread
+
+HOUR = 60 * 60
+# Longest window that can be asked for, and how long edits are kept.
+MAX_HOURS = 24
+# A page's score halves for every this many seconds without edits.
+SCORE_HALF_LIFE = 2 * HOUR
+# Number of highest scoring pages kept ready for queries, per wiki.
+TOP_K = 500
+# Pages and editors of a page tracked at most, per wiki. When there are
+# more, the lowest scoring pages are forgotten.
+MAX_PAGES = 20000
+MAX_EDITORS = 100
+DEFAULT_POLL_INTERVAL = 15
+IDLE_EXPIRATION = 24 * 60 * 60
+# Changes applied to a wiki per turn of its lock, while polling.
+REFRESH_BATCH_SIZE = 1000
+TICK = 1
+
+log = logging.getLogger(__name__)
+
+# A trending page, as reported for a window of a given number of hours.
+TrendingPage = collections.namedtuple('TrendingPage', ['title',
+                                                       'updated',
+                                                       'start',
+                                                       'thumbnail',
+                                                       'bias',
+                                                       'tags',
+                                                       'trendiness',
+                                                       'edits',
+                                                       'editors'])
+
+
+def decay(score, seconds):
+    return score * 0.5 ** (float(seconds) / SCORE_HALF_LIFE)
+
+
+class PageStats(object):
+    """Edit counters of one page: edits per hour, the last edit and edit
+    count of each editor, and an exponentially decayed edit score."""
+
+    __slots__ = ('title', 'first', 'last', 'hours', 'editors',
+                 'score', 'score_at')
+
+    def __init__(self, title):
+        self.title = title
+        self.first = None
+        self.last = 0
+        self.hours = {}
+        self.editors = {}
+        self.score = 0.0
+        self.score_at = 0
+
+    def add(self, ts, user):
+        if self.first is None or ts < self.first:
+            self.first = ts
+        self.last = max(self.last, ts)
+        hour = ts // HOUR
+        self.hours[hour] = self.hours.get(hour, 0) + 1
+        if user in self.editors:
+            last, count = self.editors[user]
+            self.editors[user] = (max(last, ts), count + 1)
+        elif len(self.editors) < MAX_EDITORS:
+            self.editors[user] = (ts, 1)
+        if ts >= self.score_at:
+            self.score = decay(self.score, ts - self.score_at) + 1
+            self.score_at = ts
+        else:
+            self.score += decay(1, self.score_at - ts)
+
+    def score_at_time(self, now):
+        return decay(self.score, max(0, now - self.score_at))
+
+    def prune(self, cutoff):
+        """Forget edits made before `cutoff`. Returns False if none are
+        left."""
+        min_hour = cutoff // HOUR
+        for hour in [hour for hour in self.hours if hour < min_hour]:
+            del self.hours[hour]
+        for user, (last, count) in self.editors.items():
+            if last < cutoff:
+                del self.editors[user]
+        if self.hours:
+            self.first = max(self.first, min(self.hours) * HOUR)
+        return bool(self.hours)
+
+    def edits(self, since):
+        min_hour = since // HOUR
+        return sum(count for hour, count in self.hours.iteritems()
+                   if hour >= min_hour)
+
+    def editor_count(self, since):
+        return sum(1 for last, count in self.editors.itervalues()
+                   if last >= since)
+
+    def bias(self):
+        """Share of the edits made by the most active editor."""
+        counts = [count for last, count in self.editors.itervalues()]
+        return float(max(counts)) / sum(counts) if counts else 0.0
+
+
+class WikiTrends(object):
+    """Trending state of one wiki, fed with changes from `source`."""
+
+    def __init__(self, source):
+        self.source = source
+        self.pages = {}
+        self.top = []
+        self.indexes = {}
+        self.polled_at = 0
+        self.used_at = 0
+        self.ready = False
+        self.lock = threading.Lock()
+
+    def add(self, change):
+        title = change.rc_title.replace('_', ' ')
+        page = self.pages.get(title)
+        if page is None:
+            page = self.pages[title] = PageStats(title)
+        page.add(mw_to_epoch(change.rc_timestamp), change.rc_user_text)
+
+    def trim(self, now, size):
+        if len(self.pages) > size:
+            keep = heapq.nlargest(size, self.pages.itervalues(),
+                                  key=lambda page: page.score_at_time(now))
+            self.pages = dict((page.title, page) for page in keep)
+
+    def refresh(self, now):
+        """Poll `source` and apply its changes. The lock is only taken to
+        apply each batch, so queries are answered from the previous top
+        pages while the source is read."""
+        changes = self.source.poll()
+        while True:
+            batch = list(itertools.islice(changes, REFRESH_BATCH_SIZE))
+            with self.lock:
+                for change in batch:
+                    self.add(change)
+                # Don't let a large backlog blow the memory bound
+                if len(self.pages) > 2 * MAX_PAGES:
+                    self.trim(now, MAX_PAGES)
+            if len(batch) < REFRESH_BATCH_SIZE:
+                break
+        cutoff = now - MAX_HOURS * HOUR
+        with self.lock:
+            for title, page in self.pages.items():
+                if not page.prune(cutoff):
+                    del self.pages[title]
+            self.trim(now, MAX_PAGES)
+            self.top = heapq.nlargest(TOP_K, self.pages.itervalues(),
+                                      key=lambda page: page.score_at_time(now))
+            self.indexes = {}
+            self.ready = True
+
+    def trending(self, hours, now):
+        """The top pages that were edited in the last `hours`, highest
+        scoring first."""
+        since = now - hours * HOUR
+        return [TrendingPage(page.title,
+                             epoch_to_iso8601(page.last),
+                             epoch_to_iso8601(max(page.first, since)),
+                             None,
+                             page.bias(),
+                             [],
+                             page.score_at_time(now),
+                             page.edits(since),
+                             page.editor_count(since))
+                for page in self.top if page.last >= since]
+
+
+class Column(object):
+    """One numeric column of a TrendingIndex, sorted, with the position
+    of each value in the index."""
+
+    def __init__(self, values):
+        order = sorted(range(len(values)), key=values.__getitem__)
+        self.keys = array('d', [values[i] for i in order])
+        self.positions = array('l', order)
+
+    def at_least(self, value):
+        """Positions of the rows whose value is at least `value`."""
+        return self.positions[bisect.bisect_left(self.keys, value):]
+
+
+class TrendingIndex(object):
+    """Parsed trending items of one window, highest scoring first, with
+    sorted edits, editors and score columns and a lowercase title index,
+    so that threshold queries are answered by bisecting the columns and
+    intersecting the results rather than by scanning every item."""
+
+    def __init__(self, items):
+        self.items = items
+        self.edits = Column([item['edits'] for item in items])
+        self.editors = Column([item['editors'] for item in items])
+        self.score = Column([item['score'] for item in items])
+        # All titles in one string, with the offset each one starts at
+        titles = [item['title'].lower() for item in items]
+        self.offsets = array('l')
+        offset = 0
+        for title in titles:
+            self.offsets.append(offset)
+            offset += len(title) + 1
+        self.titles = '\n'.join(titles)
+
+    def containing(self, text):
+        """Positions of the items whose title contains `text`."""
+        text = text.lower()
+        found = set()
+        if '\n' in text:
+            # Titles never contain one; it could only match between them
+            return found
+        start = self.titles.find(text)
+        while start != -1:
+            found.add(bisect.bisect_right(self.offsets, start) - 1)
+            start = self.titles.find(text, start + 1)
+        return found
+
+    def query(self, min_edits=0, min_editors=0, min_score=0,
+              title_contains=None):
+        """The items meeting all the given thresholds, in index order."""
+        candidates = [self.edits.at_least(min_edits),
+                      self.editors.at_least(min_editors),
+                      self.score.at_least(min_score)]
+        if title_contains:
+            candidates.append(self.containing(title_contains))
+        candidates.sort(key=len)
+        matches = set(candidates[0])
+        for positions in candidates[1:]:
+            if not matches:
+                break
+            matches.intersection_update(positions)
+        return [self.items[i] for i in sorted(matches)]
+
+
+class RecentChangesSource(object):
+    """Tails the recentchanges table of a wiki. The first poll reads the
+    last MAX_HOURS of edits, later ones only the edits since."""
+
+    def __init__(self, lang):
+        self.lang = lang
+        self.watermark = 0
+
+    def poll(self):
+        for change in get_changes_since(self.watermark, self.lang, MAX_HOURS):
+            self.watermark = max(self.watermark, change.rc_id)
+            yield change
+
+
+class LocalSource(object):
+    """Stand-in for RecentChangesSource that replays changes pushed to it,
+    for tests and for running without database access."""
+
+    def __init__(self, lang, changes=()):
+        self.lang = lang
+        self.changes = collections.deque(changes)
+
+    def push(self, change):
+        self.changes.append(change)
+
+    def poll(self):
+        while self.changes:
+            yield self.changes.popleft()
+
+
+class TrendingEngine(object):
+    """Computes trending pages in process, for any wiki, from its stream
+    of recent changes. Once a wiki has been asked about, a background
+    thread polls it every TRENDING_POLL_INTERVAL seconds, until it hasn't
+    been asked about for a day. The first poll reads a day of edits; the
+    wiki has no trending pages until it is done."""
+
+    def __init__(self, source_class=RecentChangesSource):
+        self.source_class = source_class
+        self.app = None
+        self.poll_interval = DEFAULT_POLL_INTERVAL
+        self._lock = threading.Lock()
+        self._wikis = {}
+        self._thread = PerProcess(lambda: start_thread(self.run, 'trending'))
+
+    def configure(self, app):
+        self.app = app
+        self.poll_interval = app.config.get('TRENDING_POLL_INTERVAL',
+                                            DEFAULT_POLL_INTERVAL)
+
+    def wiki(self, lang):
+        now = time.time()
+        with self._lock:
+            wiki = self._wikis.get(lang)
+            if wiki is None:
+                wiki = self._wikis[lang] = WikiTrends(self.source_class(lang))
+            wiki.used_at = now
+            self.expire(now)
+        self._thread.get()
+        return wiki
+
+    def refresh_due(self, now=None):
+        """Poll the wikis that are due. Returns how many were polled."""
+        if now is None:
+            now = time.time()
+        with self._lock:
+            self.expire(now)
+            due = [wiki for wiki in self._wikis.values()
+                   if wiki.polled_at + self.poll_interval <= now]
+        for wiki in due:
+            try:
+                with self.app.app_context():
+                    wiki.refresh(now)
+            except Exception:
+                log.warning('Could not poll recent changes of %s',
+                            wiki.source.lang, exc_info=True)
+            wiki.polled_at = now
+        return len(due)
+
+    def run(self):
+        while True:
+            self.refresh_due()
+            time.sleep(TICK)
+
+    def trending(self, lang, hours):
+        wiki = self.wiki(lang)
+        now = time.time()
+        with wiki.lock:
+            return wiki.trending(hours, now)
+
+    def index(self, lang, hours, parse):
+        """A TrendingIndex of the pages trending in the last `hours`, as
+        items made by `parse`. Each window is parsed and indexed once per
+        poll, and shared by every query until the next one."""
+        wiki = self.wiki(lang)
+        now = time.time()
+        with wiki.lock:
+            if not wiki.ready:
+                return TrendingIndex([])
+            index = wiki.indexes.get(hours)
+            if index is None:
+                index = wiki.indexes[hours] = TrendingIndex(
+                    map(parse, wiki.trending(hours, now)))
+            return index
+
+    def expire(self, now):
+        for lang, wiki in self._wikis.items():
+            if wiki.used_at + IDLE_EXPIRATION < now:
+                del self._wikis[lang]
+
+    def stats(self):
+        with self._lock:
+            return dict((lang, {'pages': len(wiki.pages),
+                                'top': len(wiki.top),
+                                'ready': wiki.ready})
+                        for lang, wiki in self._wikis.items())
+
+
+trending_engine = TrendingEngine()
@@ -1,5 +1,3 @@
-
-
 # -*- coding: utf-8 -*-
 """
   Wikipedia channel for IFTTT
@@ -23,12 +21,13 @@
 
 """
 
-import os
 import datetime
+import hashlib
+from collections import namedtuple
 import operator
-import urllib2
+import StringIO
+import time
 import json
-import lxml.html
 import logging
 
 import flask
@@ -36,42 +35,78 @@ import flask.views
 
 from flask import g, render_template, make_response, request
 
-import feedparser
-import werkzeug.contrib.cache
-
 from urllib import urlencode
 
 from dal import (get_hashtags, 
                   get_all_hashtags, 
-                  get_category_members,
-                  get_category_member_revisions,
-                  get_article_list_revisions)
+                  get_recent_changes,
+                  get_article_list_revisions,
+                  DEFAULT_HOURS)
+
+from catindex import category_index
+
+from caching import (cache,
+                     make_key,
+                     FEEDS,
+                     API,
+                     IMAGES,
+                     DAL,
+                     RESPONSES)
 
 from utils import (select,
                     url_to_uuid5,
+                    diff_url,
                     utc_to_epoch,
                     utc_to_iso8601,
                     iso8601_to_epoch,
                     find_hashtags,
-                    snake_case)
+                    snake_case,
+                    gzip_bytes)
+
+from encoders import encode_item, encode_data, json_response
+
+from policies import cached, FixedTTL, DailyRollover, AdaptiveTTL
+
+from feeds import (newest_published,
+                   read_featured_feed,
+                   parse_summary)
+
+from trending import trending_engine, MAX_HOURS
+
+from geoindex import geo_index
+
+from realtime import notifier
+
+from admission import admission_control
+
+from fetch import fetcher
+
+from warmup import poll_history
+
+from timestamps import (mw_to_iso8601,
+                        mw_to_epoch_many,
+                        datetime_to_iso8601,
+                        datetime_to_epoch)
 
-LOG_FILE = 'ifttt.log'
 CACHE_EXPIRATION = 5 * 60
 LONG_CACHE_EXPIRATION = 12 * 60 * 60
 DEFAULT_LANG = 'en'
 TEST_FIELDS = ['test', 'Coffee', 'ClueBot', 'All stub articles'] 
 # test properties currently mixed  with trigger default values
 DEFAULT_RESP_LIMIT = 50  # IFTTT spec
+FEED_MAX_AGE = 60
 MAXRADIUS = 10000  # Wikipedia's max geosearch radius
 
-_cur_dir = os.path.dirname(__file__)
-_cache_dir = os.path.join(_cur_dir, '../cache')
-cache = werkzeug.contrib.cache.SimpleCache()
+log = logging.getLogger(__name__)
 
-logging.basicConfig(filename=LOG_FILE,
-                    format='%(asctime)s - %(message)s',
-                    datefmt='%m/%d/%Y %I:%M:%S %p',
-                    level=logging.DEBUG)
+# Upstream results are cached as compact records holding only the fields
+# the triggers read, rather than as the full feed or API response.
+NewPage = namedtuple('NewPage', ['timestamp', 'title', 'user', 'newlen',
+                                 'oldlen', 'comment'])
+PageRevision = namedtuple('PageRevision', ['revid', 'parentid', 'timestamp',
+                                           'user', 'size', 'comment'])
+Contribution = namedtuple('Contribution', ['revid', 'parentid', 'timestamp',
+                                           'title', 'size', 'comment'])
 
 # From https://www.mediawiki.org/wiki/Manual:Namespace
 NAMESPACE_MAP = {
@@ -110,10 +145,11 @@ NAMESPACE_MAP = {
 DEFAULT_IMAGE = 'https://upload.wikimedia.org/wikipedia/commons/thumb/5/5a/Wikipedia%27s_W.svg/500px-Wikipedia%27s_W.svg.png'
 
 def add_images(get_data):
-    def with_images(*args, **kwargs):
-        data = get_data(*args, **kwargs)
+    def with_images(self, *args, **kwargs):
+        data = get_data(self, *args, **kwargs)
         titles = [item['title'] for item in data]
-        images = get_page_image(titles)
+        images = get_page_image(titles,
+                                lang=self.fields.get('lang') or DEFAULT_LANG)
         for i, res in enumerate(data):
             title = res['title']
             data[i]['media_url'] = images.get(title)
@@ -124,7 +160,21 @@ def add_images(get_data):
         
 
 def get_page_image(page_titles, lang=DEFAULT_LANG, timeout=LONG_CACHE_EXPIRATION):
+    """Look up the page image of each title, with or without underscores.
+    Returns a dict keyed by the titles as they were given."""
     page_images = {}
+    # Titles are cached and looked up with spaces
+    missing = {}
+    for title in page_titles:
+        name = title.replace('_', ' ')
+        image_url = cache.get(make_key(IMAGES, lang, name))
+        if image_url is None:
+            missing.setdefault(name, []).append(title)
+        else:
+            # Pages without an image are cached as ''
+            page_images[title] = image_url or None
+    if not missing:
+        return page_images
     base_url = 'https://%s.wikipedia.org/w/api.php'
     formatted_url = base_url % lang
     params = {'action': 'query',
@@ -132,28 +182,77 @@ def get_page_image(page_titles, lang=DEFAULT_LANG, timeout=LONG_CACHE_EXPIRATION
               'pithumbsize': 500,
               'format': 'json',
               'pilimit': 50,
-              'titles': '|'.join([title.replace(' ', '_') for title in page_titles])}
+              'titles': '|'.join(missing).replace(' ', '_')}
     params = urlencode(params)
     url = '%s?%s' % (formatted_url, params)
-    resp = json.load(urllib2.urlopen(url))
-    pages = resp.get('query', {}).get('pages', {})
-    if not pages:
-        return None
-    for page_id in pages.keys():
-        page_title = pages[page_id]['title']
-        image_url = pages[page_id].get('thumbnail', {}).get('source')
-        page_images[page_title] = image_url
+    resp = json.loads(fetcher.get(url))
+    query = resp.get('query', {})
+    # The API answers with its own normal form of titles, e.g. with the
+    # first letter capitalized, and lists the ones it changed
+    renamed = dict((norm['to'], norm['from'].replace('_', ' '))
+                   for norm in query.get('normalized', []))
+    for page in query.get('pages', {}).values():
+        name = renamed.get(page['title'], page['title'])
+        image_url = page.get('thumbnail', {}).get('source')
+        cache.set(make_key(IMAGES, lang, name), image_url or '',
+                  timeout=timeout)
+        for title in missing.get(name, ()):
+            page_images[title] = image_url
     return page_images
 
 
+def project_result(record, result):
+    """Keep only the fields of `record` from an API result."""
+    return record._make(result.get(field) for field in record._fields)
+
+
+class RenderedFeed(object):
+    """An RSS feed rendered once and served as bytes until its items
+    change. The gzipped body is kept next to the plain one."""
+
+    def __init__(self, body, etag):
+        self.body = body
+        self.gzipped = gzip_bytes(body)
+        self.etag = etag
+        self.last_modified = datetime.datetime.utcnow().replace(microsecond=0)
+        self.checked_at = 0
+
+    def make_response(self, request):
+        # 'gzip' is in accept_encodings even when refused with q=0
+        if request.accept_encodings.best_match(['gzip', 'identity']) == 'gzip':
+            response = make_response(self.gzipped)
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = make_response(self.body)
+        response.headers['Content-Type'] = 'application/xml'
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.set_etag(self.etag)
+        response.last_modified = self.last_modified
+        response.cache_control.public = True
+        response.cache_control.max_age = FEED_MAX_AGE
+        return response.make_conditional(request)
+
+
 class BaseTriggerView(flask.views.MethodView):
 
     default_fields = {}
     optional_fields = []
+    # How long upstream results fetched for this trigger are cached
+    cache_policy = FixedTTL(CACHE_EXPIRATION)
 
     def get_data(self):
         pass
 
+    def item_key(self, item):
+        """Key under which the encoded JSON of `item` may be reused. The
+        key has to change whenever the item would encode differently;
+        return None for items that can't be keyed that cheaply."""
+        return (self.__class__.__name__,
+                repr(sorted(self.fields.items())),
+                item['meta']['id'],
+                item['meta']['timestamp'],
+                item.get('media_url'))
+
     def post(self):
         """Handle POST requests."""
         self.fields = {}
@@ -170,10 +269,30 @@ class BaseTriggerView(flask.views.MethodView):
             elif field not in self.fields:
                 flask.abort(400)
 
-        logging.info('%s: %s' % (self.__class__.__name__, trigger_identity))
-        data = self.get_data()
+        log.info('%s: %s', self.__class__.__name__, trigger_identity,
+                 extra={'trigger': self.__class__.__name__,
+                        'identity': trigger_identity})
+        poll_history.record(self.__class__.__name__, self.fields, self.limit)
+        # The last answer is kept to be served again if we are overloaded
+        key = make_key(RESPONSES, 'json', self.__class__.__name__,
+                       repr(sorted(self.fields.items())), str(self.limit))
+        gate = admission_control.gate(self.__class__.__name__)
+        if not gate.enter():
+            body = cache.get(key)
+            if body is None:
+                flask.abort(503)
+            return json_response(body)
+        try:
+            data = self.get_data()
+        finally:
+            gate.leave()
         data = data[:self.limit]
-        return flask.jsonify(data=data)
+        notifier.register(trigger_identity, self.__class__, self.fields,
+                          self.limit, data)
+        fragments = [encode_item(item, self.item_key(item)) for item in data]
+        body = encode_data(fragments)
+        cache.set(key, body, timeout=LONG_CACHE_EXPIRATION)
+        return json_response(body)
 
     def get(self):
         """Handle GET requests."""
@@ -198,31 +317,54 @@ class BaseTriggerView(flask.views.MethodView):
                     self.fields[field] = ''
                 else:
                     flask.abort(400)
-        logging.info('%s: %s' % (self.__class__.__name__, trigger_identity))
-        data = self.get_data()
-        data = data[:self.limit]
-        
-        feeds = render_template(feed_filename + '.xml', data=data)
-        response = make_response(feeds)
-        response.headers["Content-Type"] = "application/xml"
-        return response
+        log.info('%s: %s', self.__class__.__name__, trigger_identity,
+                 extra={'trigger': self.__class__.__name__,
+                        'identity': trigger_identity})
+        key = make_key(RESPONSES, 'rss', self.__class__.__name__,
+                       repr(sorted(self.fields.items())), str(self.limit))
+        feed = cache.get(key)
+        if feed is None or feed.checked_at + FEED_MAX_AGE <= time.time():
+            gate = admission_control.gate(self.__class__.__name__)
+            if not gate.enter():
+                if feed is None:
+                    flask.abort(503)
+                return feed.make_response(request)
+            try:
+                data = self.get_data()
+            finally:
+                gate.leave()
+            data = data[:self.limit]
+            fragments = [encode_item(item, self.item_key(item))
+                         for item in data]
+            etag = hashlib.sha1(encode_data(fragments)).hexdigest()
+            if feed is None or feed.etag != etag:
+                feeds = render_template(feed_filename + '.xml', data=data)
+                feed = RenderedFeed(feeds.encode('utf-8'), etag)
+            feed.checked_at = time.time()
+            cache.set(key, feed, timeout=LONG_CACHE_EXPIRATION)
+        return feed.make_response(request)
 
 class BaseFeaturedFeedTriggerView(BaseTriggerView):
     """Generic view for IFTTT Triggers based on FeaturedFeeds."""
 
     _base_url = 'https://{0.wiki}/w/api.php?action=featuredfeed&feed={0.feed}'
+    # Featured content changes once a day, at midnight UTC
+    cache_policy = DailyRollover(newest=newest_published)
 
     def get_feed(self):
-        """Fetch and parse the feature feed for this class."""
+        """Fetch and parse the feature feed for this class, as a list of
+        FeedEntry records."""
         url = self._base_url.format(self)
-        feed = cache.get(url)
-        if not feed:
-            feed = feedparser.parse(urllib2.urlopen(url))
-            cache.set(url, feed, timeout=CACHE_EXPIRATION)
-        return feed
-
-    def parse_entry(self, entry):
-        """Parse a single feed entry into an IFTTT trigger item."""
+        return cached(make_key(FEEDS, url), lambda: self.fetch_feed(url),
+                      self.cache_policy)
+
+    def fetch_feed(self, url):
+        body = fetcher.get(url)
+        return list(read_featured_feed(StringIO.StringIO(body)))
+
+    def parse_entry(self, entry, summary):
+        """Parse a single feed entry, and its parsed `summary`, into an
+        IFTTT trigger item."""
         # Not sure why, but sometimes we get http entry IDs. If we
         # don't have consistency between https/http, we get mutliple
         # unique UUIDs for the same entry.
@@ -237,26 +379,49 @@ class BaseFeaturedFeedTriggerView(BaseTriggerView):
 
     def get_data(self):
         """Get the set of items for this trigger."""
-        feed = self.get_feed()
-        feed.entries.sort(key=operator.attrgetter('published_parsed'),
-                          reverse=True)
-        return map(self.parse_entry, feed.entries)
+        url = self._base_url.format(self)
+        entries = sorted(self.get_feed(),
+                         key=operator.attrgetter('published_parsed'),
+                         reverse=True)
+        return [self.parse_entry(entry, parse_summary(entry.summary, url))
+                for entry in entries]
 
 class BaseAPIQueryTriggerView(BaseTriggerView):
-    """Generic view for IFTT Triggers based on API MediaWiki Queries."""
+    """Generic view for IFTT Triggers based on API MediaWiki Queries.
+
+    Subclasses that declare a `record` type and the `result_path` to the
+    list of results in the API response get back (and cache) just those
+    records. Without a `record`, the whole response is used."""
 
     _base_url = 'http://{0.wiki}/w/api.php'
+    record = None
+    result_path = ()
+    cache_policy = AdaptiveTTL()
 
     def get_query(self):
         formatted_url = self._base_url.format(self)
         params = urlencode(self.query_params)
         url = '%s?%s' % (formatted_url, params)
-        resp = cache.get(url)
-        if not resp:
-            resp = json.load(urllib2.urlopen(url))
-            cache.set(url, resp, timeout=CACHE_EXPIRATION)
+        return cached(make_key(API, url),
+                      lambda: self.project(json.loads(fetcher.get(url))),
+                      self.cache_policy)
+
+    def extract(self, resp):
+        """Find the list of results in an API response."""
+        for step in self.result_path:
+            resp = resp[step]
         return resp
 
+    def project(self, resp):
+        """Reduce an API response to the records this trigger reads."""
+        if self.record is None:
+            return resp
+        try:
+            results = self.extract(resp)
+        except KeyError:
+            return []
+        return [project_result(self.record, result) for result in results]
+
     def parse_result(self, result):
         meta_id = url_to_uuid5(result['url'])
         created_at = result['date']
@@ -275,10 +440,9 @@ class PictureOfTheDay(BaseFeaturedFeedTriggerView):
     feed = 'potd'
     wiki = 'commons.wikimedia.org'
 
-    def parse_entry(self, entry):
+    def parse_entry(self, entry, summary):
         """Scrape each PotD entry for its description and URL."""
-        item = super(PictureOfTheDay, self).parse_entry(entry)
-        summary = lxml.html.fromstring(entry.summary)
+        item = super(PictureOfTheDay, self).parse_entry(entry, summary)
         image_node = select(summary, 'a.image img')
         file_page_node = select(summary, 'a.image')
         thumb_url = image_node.get('src')
@@ -304,10 +468,9 @@ class ArticleOfTheDay(BaseFeaturedFeedTriggerView):
         self.wiki = '%s.wikipedia.org' % self.fields['lang']
         return super(ArticleOfTheDay, self).get_data()
 
-    def parse_entry(self, entry):
+    def parse_entry(self, entry, summary):
         """Scrape each AotD entry for its URL and title."""
-        item = super(ArticleOfTheDay, self).parse_entry(entry)
-        summary = lxml.html.fromstring(entry.summary)
+        item = super(ArticleOfTheDay, self).parse_entry(entry, summary)
         try:
             item['summary'] = select(summary, 'p:first-of-type').text_content()
         except IndexError:
@@ -341,13 +504,12 @@ class WordOfTheDay(BaseFeaturedFeedTriggerView):
         self.wiki = '%s.wiktionary.org' % self.fields['lang']
         return super(WordOfTheDay, self).get_data()
 
-    def parse_entry(self, entry):
+    def parse_entry(self, entry, summary):
         """Scrape each WotD entry for the word, article URL, part of speech,
         and definition."""
-        item = super(WordOfTheDay, self).parse_entry(entry)
-        summary = lxml.html.fromstring(entry.summary)
-        div = summary.get_element_by_id('WOTD-rss-description')
-        anchor = summary.get_element_by_id('WOTD-rss-title').getparent()
+        item = super(WordOfTheDay, self).parse_entry(entry, summary)
+        div = select(summary, '#WOTD-rss-description')
+        anchor = select(summary, '#WOTD-rss-title').getparent()
         item['word'] = anchor.get('title')
         item['url'] = anchor.get('href')
         item['part_of_speech'] = anchor.getparent().getnext().text_content()
@@ -357,56 +519,53 @@ class WordOfTheDay(BaseFeaturedFeedTriggerView):
 class TrendingTopics(BaseTriggerView):
     """Trigger for Wikipedia trending"""
 
-    url = 'https://wikipedia-trending.wmflabs.org'
     default_fields = {'hrs': '24', 'edits': 20, 'editors': 6, 'score': 0.00001,
-        'title_contains': False }
-    optional_fields = [ 'hrs', 'edits', 'editors', 'score', 'title_contains' ]
-
-    def query(self, path):
-        url = '%s%s' % (self.url, path)
-        resp = cache.get(url)
-        if not resp:
-            resp = json.load(urllib2.urlopen(url))
-            cache.set(url, resp, timeout=60)
-        return resp
+        'title_contains': False, 'lang': DEFAULT_LANG }
+    optional_fields = [ 'hrs', 'edits', 'editors', 'score', 'title_contains',
+        'lang' ]
+
+    def item_key(self, item):
+        # Trendiness decays between updates of a page, so the same page
+        # encodes differently from one request to the next.
+        return None
 
     def get_data(self):
-        resp = self.query('/api/trending/enwiki/%s'%self.fields['hrs'])
-        return filter(self.only_trending, map(self.parse_result, resp['pages']))
-
-    def only_trending(self, page):
-        min_edits = self.fields['edits']
-        min_editors = self.fields['editors']
-        min_score = self.fields['score']
-        title_contains = self.fields['title_contains']
-        title_match = True
-        if title_contains:
-            if title_contains.lower() in page['title'].lower():
-                title_match = True
-            else:
-                title_match = False
-
-        return page['edits'] >= min_edits and page['editors'] >= min_editors and \
-            page['score'] >= min_score and title_match
+        self.lang = self.fields['lang'] or DEFAULT_LANG
+        try:
+            hours = min(max(int(self.fields['hrs'] or MAX_HOURS), 1),
+                        MAX_HOURS)
+            thresholds = (float(self.fields['edits'] or 0),
+                          float(self.fields['editors'] or 0),
+                          float(self.fields['score'] or 0))
+        except (TypeError, ValueError):
+            flask.abort(400)
+        title_contains = self.fields['title_contains'] or None
+        index = trending_engine.index(self.lang, hours, self.parse_result)
+        items = index.query(*thresholds, title_contains=title_contains)
+        # Items are shared with other requests until the next poll, and
+        # come highest scoring first, so only the ones we will return
+        # need a (copied) item with a thumbnail.
+        items = [dict(item) for item in items[:self.limit]]
+        images = get_page_image([item['title'] for item in items],
+                                lang=self.lang)
+        for item in items:
+            item['thumbURL'] = images.get(item['title']) or DEFAULT_IMAGE
+        return items
 
     def parse_result(self, page):
-        url = "https://en.wikipedia.org/wiki/%s?referrer=ifttt-trending"%page['title'].replace(' ', '_')
-        updated = page['updated'][0:19] + 'Z'
-        try:
-            thumbUrl = page['thumbnail']['source']
-        except KeyError:
-            thumbUrl = DEFAULT_IMAGE
+        url = "https://%s.wikipedia.org/wiki/%s?referrer=ifttt-trending"%(self.lang, page.title.replace(' ', '_'))
+        updated = page.updated
         return {
-            'thumbURL': thumbUrl,
-            'bias': page['bias'],
-            'tags': page['tags'],
-            'title': page['title'],
+            'thumbURL': page.thumbnail or DEFAULT_IMAGE,
+            'bias': page.bias,
+            'tags': page.tags,
+            'title': page.title,
             'url': url,
-            'score': page['trendiness'],
+            'score': page.trendiness,
             'date': updated,
-            'since': page['start'][0:19] + 'Z',
-            'edits': page['edits'],
-            'editors': len(page['contributors']),
+            'since': page.start,
+            'edits': page.edits,
+            'editors': page.editors,
             'meta': {'id': url_to_uuid5(url),
                  'timestamp': iso8601_to_epoch(updated)},
         }
@@ -422,24 +581,21 @@ class NewArticle(BaseAPIQueryTriggerView):
                     'rcnamespace': 0,
                     'rcprop': 'title|ids|timestamp|user|sizes|comment',
                     'format': 'json'}
+    record = NewPage
+    result_path = ('query', 'recentchanges')
 
     def get_data(self):
         self.wiki = '%s.wikipedia.org' % self.fields['lang']
-        api_resp = self.get_query()
-        try:
-            pages = api_resp['query']['recentchanges']
-        except KeyError:
-            return []
-        return map(self.parse_result, pages)
+        return map(self.parse_result, self.get_query())
 
     def parse_result(self, rev):
-        ret = {'date': rev['timestamp'],
+        ret = {'date': rev.timestamp,
                'url': 'https://%s/wiki/%s' %
-                      (self.wiki, rev['title'].replace(' ', '_')),
-               'user': rev['user'],
-               'size': rev['newlen'] - rev['oldlen'],
-               'comment': rev['comment'],
-               'title': rev['title']}
+                      (self.wiki, rev.title.replace(' ', '_')),
+               'user': rev.user,
+               'size': rev.newlen - rev.oldlen,
+               'comment': rev.comment,
+               'title': rev.title}
         ret.update(super(NewArticle, self).parse_result(ret))
         return ret
 
@@ -460,28 +616,28 @@ class NewHashtag(BaseTriggerView):
             res = get_all_hashtags(lang=self.lang, limit=self.limit)
         else:
             res = get_hashtags(self.tag, lang=self.lang, limit=self.limit)
-        res.sort(key=lambda rev: rev['rc_timestamp'], reverse=True) 
-        return filter(self.validate_tags, map(self.parse_result, res))
-
-    def parse_result(self, rev):
-        date = datetime.datetime.strptime(rev['rc_timestamp'], '%Y%m%d%H%M%S')
-        date = date.isoformat() + 'Z'
-        tags = find_hashtags(rev['rc_comment'])
+        res.sort(key=lambda rev: rev.rc_timestamp, reverse=True) 
+        timestamps = mw_to_epoch_many([rev.rc_timestamp for rev in res])
+        return filter(self.validate_tags,
+                      map(self.parse_result, res, timestamps))
+
+    def parse_result(self, rev, ts):
+        date = mw_to_iso8601(rev.rc_timestamp)
+        tags = find_hashtags(rev.rc_comment)
         ret = {'raw_tags': tags,
                'input_hashtag': self.tag,
                'return_hashtags': ' '.join(tags),
                'date': date,
-               'url': 'https://%s/w/index.php?diff=%s&oldid=%s' %
-                      (self.wiki,
-                       int(rev['rc_this_oldid']),
-                       int(rev['rc_last_oldid'])),
-               'user': rev['rc_user_text'],
-               'size': rev['rc_new_len'] - rev['rc_old_len'],
-               'comment': rev['rc_comment'],
-               'title': rev['rc_title']}
+               'url': diff_url(self.wiki,
+                               int(rev.rc_this_oldid),
+                               int(rev.rc_last_oldid)),
+               'user': rev.rc_user_text,
+               'size': rev.rc_new_len - rev.rc_old_len,
+               'comment': rev.rc_comment,
+               'title': rev.rc_title}
         ret['created_at'] = date
         ret['meta'] = {'id': url_to_uuid5(ret['url']),
-                       'timestamp': iso8601_to_epoch(date)}
+                       'timestamp': ts}
         return ret
 
     def validate_tags(self, rev):
@@ -495,42 +651,42 @@ class NewHashtag(BaseTriggerView):
 class NewCategoryMember(BaseTriggerView):
     """Trigger each time a new article appears in a category"""
     default_fields = {'lang': DEFAULT_LANG, 'category': 'All stub articles'}
+    cache_policy = AdaptiveTTL()
     
     @add_images
     def get_data(self):
         self.lang = self.fields['lang']
         self.category = self.fields['category']
         self.wiki = '%s.wikipedia.org' % self.fields['lang']
-        cache_name = 'cat-%s-%s-%s' % (self.category, self.lang, self.limit)
-        res = cache.get(cache_name)
-        if not res:
-            res = get_category_members(self.category, lang=self.lang)
-            cache.set(cache_name,
-                      res,
-                      timeout=CACHE_EXPIRATION)
-        res.sort(key=lambda rev: rev['cl_timestamp'], reverse=True)
+        cache_name = make_key(DAL, 'members', self.category,
+                              self.lang, str(self.limit))
+        res = cached(cache_name,
+                     lambda: category_index.new_members(
+                         self.category, self.lang,
+                         hours=DEFAULT_HOURS)[:self.limit],
+                     self.cache_policy)
+        res.sort(key=lambda link: link.cl_timestamp, reverse=True)
         return map(self.parse_result, res)
 
-    def parse_result(self, rev):
-        date = rev['cl_timestamp']
-        date = date.isoformat() + 'Z'
-        namespace = NAMESPACE_MAP.get(rev['rc_namespace'])
-        if namespace and rev['rc_namespace'] > 0:
-            title = namespace + ':' + rev['rc_title']
+    def parse_result(self, link):
+        date = datetime_to_iso8601(link.cl_timestamp)
+        namespace = NAMESPACE_MAP.get(link.page_namespace)
+        if namespace and link.page_namespace > 0:
+            title = namespace + ':' + link.page_title
         else:
-            title = rev['rc_title']
+            title = link.page_title
         if namespace is not None:
             url = 'https://%s/wiki/%s' % (self.wiki, title.replace(' ', '_'))
         else:
             # Use curid because we don't know the namespace
-            url = 'https://%s/w/index.php?curid=%s' % (self.wiki, rev['rc_cur_id'])
+            url = 'https://%s/w/index.php?curid=%s' % (self.wiki, link.page_id)
         ret = {'date': date,
                'url': url,
                'title': title.replace('_', ' '),
                'category' : self.category}
         ret['created_at'] = date
         ret['meta'] = {'id': url_to_uuid5(ret['url']),
-                       'timestamp': iso8601_to_epoch(date)}
+                       'timestamp': datetime_to_epoch(link.cl_timestamp)}
         return ret
 
 
@@ -538,41 +694,39 @@ class CategoryMemberRevisions(BaseTriggerView):
     """Trigger for revisions to articles within a specified category."""
 
     default_fields = {'lang': DEFAULT_LANG, 'category': 'All stub articles'}
+    cache_policy = AdaptiveTTL()
     
     @add_images
     def get_data(self):
         self.lang = self.fields['lang']
         self.category = self.fields['category']
         self.wiki = '%s.wikipedia.org' % self.fields['lang']
-        cache_name = 'cat-revs-%s-%s-%s' % (self.category, self.lang, self.limit)
-        res = cache.get(cache_name)
-        if not res:
-            res = get_category_member_revisions(self.category, lang=self.lang)
-            cache.set(cache_name,
-                      res,
-                      timeout=CACHE_EXPIRATION)
-        res.sort(key=lambda rev: rev['rc_timestamp'], reverse=True)
-        return map(self.parse_result, res)
-
-    def parse_result(self, rev):
-        date = datetime.datetime.strptime(rev['rc_timestamp'], '%Y%m%d%H%M%S')
-        date = date.isoformat() + 'Z'
-        if not rev['rc_new_len']:
-            rev['rc_new_len'] = 0
-        if not rev['rc_old_len']:
-            rev['rc_old_len'] = 0
+        cache_name = make_key(DAL, 'revs', self.category,
+                              self.lang, str(self.limit))
+        res = cached(cache_name,
+                     lambda: category_index.filter_revisions(
+                         self.category, self.lang,
+                         get_recent_changes(lang=self.lang))[:self.limit],
+                     self.cache_policy)
+        res.sort(key=lambda rev: rev.rc_timestamp, reverse=True)
+        timestamps = mw_to_epoch_many([rev.rc_timestamp for rev in res])
+        return map(self.parse_result, res, timestamps)
+
+    def parse_result(self, rev, ts):
+        date = mw_to_iso8601(rev.rc_timestamp)
+        new_len = rev.rc_new_len or 0
+        old_len = rev.rc_old_len or 0
         ret = {'date': date,
-               'url': 'https://%s/w/index.php?diff=%s&oldid=%s' %
-                      (self.wiki,
-                       int(rev['rc_this_oldid']),
-                       int(rev['rc_last_oldid'])),
-               'user': rev['rc_user_text'],
-               'size': rev['rc_new_len'] - rev['rc_old_len'],
-               'comment': rev['rc_comment'],
-               'title': rev['rc_title'].replace('_', ' ')}
+               'url': diff_url(self.wiki,
+                               int(rev.rc_this_oldid),
+                               int(rev.rc_last_oldid)),
+               'user': rev.rc_user_text,
+               'size': new_len - old_len,
+               'comment': rev.rc_comment,
+               'title': rev.rc_title.replace('_', ' ')}
         ret['created_at'] = date
         ret['meta'] = {'id': url_to_uuid5(ret['url']),
-                       'timestamp': iso8601_to_epoch(date)}
+                       'timestamp': ts}
         return ret
 
 
@@ -586,81 +740,74 @@ class ArticleRevisions(BaseAPIQueryTriggerView):
                     'rvlimit': 50,
                     'rvprop': 'ids|timestamp|user|size|comment',
                     'format': 'json'}
+    record = PageRevision
 
     def get_query(self):
         self.wiki = '%s.wikipedia.org' % self.fields['lang']
-        self.query_params['titles'] = self.fields['title']
+        # Copied, since the class's params are shared by request threads
+        self.query_params = dict(self.query_params,
+                                 titles=self.fields['title'])
         return super(ArticleRevisions, self).get_query()
 
+    def extract(self, resp):
+        pages = resp['query']['pages']
+        return pages[pages.keys()[0]]['revisions']
+
     @add_images
     def get_data(self):
-        api_resp = self.get_query()
-        try:
-            page_id = api_resp['query']['pages'].keys()[0]
-            revisions = api_resp['query']['pages'][page_id]['revisions']
-        except KeyError:
-            return []
-        return map(self.parse_result, revisions)
+        return map(self.parse_result, self.get_query())
 
     def parse_result(self, revision):
-        ret = {'date': revision['timestamp'],
-               'url': 'https://%s/w/index.php?diff=%s&oldid=%s' %
-                      (self.wiki, revision['revid'], revision['parentid']),
-               'user': revision['user'],
-               'size': revision['size'],
-               'comment': revision['comment'],
+        ret = {'date': revision.timestamp,
+               'url': diff_url(self.wiki,
+                               revision.revid,
+                               revision.parentid),
+               'user': revision.user,
+               'size': revision.size,
+               'comment': revision.comment,
                'title': self.fields['title']}
         ret.update(super(ArticleRevisions, self).parse_result(ret))
         return ret
 
 
-class GeoRevisions(BaseAPIQueryTriggerView):
+class GeoRevisions(BaseTriggerView):
     """Trigger for revisions in a geographic area"""
 
     default_fields = {'lang': DEFAULT_LANG, 
                       'location': {'lat': 37.34347580224911,
                                    'lng': -121.89543345662234,
                                    'radius': 10000}}
-    query_params = {'action': 'query',
-                    'list': 'geosearch',
-                    'gslimit': 500,
-                    'format': 'json'}
 
-    def get_query(self):
+    @add_images
+    def get_data(self):
         self.lang = self.fields['lang']
-        lat = self.fields['location']['lat']
-        lon = self.fields['location']['lng']
-        if self.fields['location']['radius'] < MAXRADIUS:
-            radius = self.fields['location']['radius']
-        else:
-            radius = MAXRADIUS
         self.wiki = '%s.wikipedia.org' % self.fields['lang']
-        self.query_params['gscoord'] = '%s|%s' % (lat, lon)
-        self.query_params['gsradius'] = radius
-        return super(GeoRevisions, self).get_query()
-
-    def get_data(self):
-        api_resp = self.get_query()
-        titles = [article['title'] for article in api_resp['query']['geosearch']]
-        cache_name = str(titles)
-        revisions = get_article_list_revisions(titles)
-        return [self.parse_result(rev) for rev in revisions]
+        try:
+            lat = float(self.fields['location']['lat'])
+            lon = float(self.fields['location']['lng'])
+            radius = min(float(self.fields['location']['radius']), MAXRADIUS)
+        except (KeyError, TypeError, ValueError):
+            flask.abort(400)
+        titles = geo_index.titles_near(self.lang, lat, lon, radius)
+        if not titles:
+            return []
+        revisions = get_article_list_revisions(titles, lang=self.lang)
+        timestamps = mw_to_epoch_many([rev.rc_timestamp for rev in revisions])
+        return map(self.parse_result, revisions, timestamps)
 
-    def parse_result(self, rev):
-        date = datetime.datetime.strptime(rev['rc_timestamp'], '%Y%m%d%H%M%S')
-        date = date.isoformat() + 'Z'
+    def parse_result(self, rev, ts):
+        date = mw_to_iso8601(rev.rc_timestamp)
         ret = {'date': date,
-               'url': 'https://%s/w/index.php?diff=%s&oldid=%s' %
-                      (self.wiki,
-                       int(rev['rc_this_oldid']),
-                       int(rev['rc_last_oldid'])),
-               'user': rev['rc_user_text'],
-               'size': rev['rc_new_len'] - rev['rc_old_len'],
-               'comment': rev['rc_comment'],
-               'title': rev['rc_title']}
+               'url': diff_url(self.wiki,
+                               int(rev.rc_this_oldid),
+                               int(rev.rc_last_oldid)),
+               'user': rev.rc_user_text,
+               'size': (rev.rc_new_len or 0) - (rev.rc_old_len or 0),
+               'comment': rev.rc_comment,
+               'title': rev.rc_title.replace('_', ' ')}
         ret['created_at'] = date
         ret['meta'] = {'id': url_to_uuid5(ret['url']),
-                       'timestamp': iso8601_to_epoch(date)}
+                       'timestamp': ts}
         return ret
 
 
@@ -674,29 +821,28 @@ class UserRevisions(BaseAPIQueryTriggerView):
                     'uclimit': 50,
                     'ucprop': 'ids|timestamp|title|size|comment',
                     'format': 'json'}
+    record = Contribution
+    result_path = ('query', 'usercontribs')
 
     def get_query(self):
         self.wiki = '%s.wikipedia.org' % self.fields['lang']
-        self.query_params['ucuser'] = self.fields['user']
+        self.query_params = dict(self.query_params,
+                                 ucuser=self.fields['user'])
         return super(UserRevisions, self).get_query()
 
     @add_images
     def get_data(self):
-        api_resp = self.get_query()
-        try:
-            revisions = api_resp['query']['usercontribs']
-        except KeyError:
-            return []
-        return map(self.parse_result, revisions)
+        return map(self.parse_result, self.get_query())
 
     def parse_result(self, contrib):
-        ret = {'date': contrib['timestamp'],
-               'url': 'https://%s/w/index.php?diff=%s&oldid=%s' %
-                      (self.wiki, contrib['revid'], contrib['parentid']),
+        ret = {'date': contrib.timestamp,
+               'url': diff_url(self.wiki,
+                               contrib.revid,
+                               contrib.parentid),
                'user': self.fields['user'],
-               'size': contrib['size'],
-               'comment': contrib['comment'],
-               'title': contrib['title']}
+               'size': contrib.size,
+               'comment': contrib.comment,
+               'title': contrib.title}
         ret.update(super(UserRevisions, self).parse_result(ret))
         return ret
 
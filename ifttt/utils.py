@@ -20,11 +20,25 @@
 
 """
 
-import datetime
+import collections
+import functools
+import gzip
+import os
 import re
-import time
+import threading
 import uuid
 import socket
+import StringIO
+
+import lxml.etree
+from cssselect import HTMLTranslator
+
+import timestamps
+
+DEFAULT_MEMO_SIZE = 10000
+SELECTOR_CACHE_SIZE = 256
+
+_translator = HTMLTranslator()
 
 
 def snake_case(s):
@@ -33,44 +47,176 @@ def snake_case(s):
     return re.sub('([a-z0-9])([A-Z])', r'\1_\2', s).lower()
 
 
+class LRUCache(object):
+    """A bounded, thread-safe mapping that forgets its least recently used
+    entries first and counts its hits and misses."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def resize(self, maxsize):
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+    def stats(self):
+        return {'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hit_rate()}
+
+
+class PerProcess(object):
+    """A value made by `factory` the first time it is asked for in each
+    process. Threads don't survive a fork, so background threads, and the
+    queues and pools that need them, have to be made in each forked
+    worker rather than once when the app is loaded."""
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._pid = None
+        self._value = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._value = self.factory()
+                    self._pid = os.getpid()
+        return self._value
+
+    def peek(self):
+        """The value of this process, or None if it hasn't been made."""
+        return self._value if self._pid == os.getpid() else None
+
+    def reset(self):
+        with self._lock:
+            self._pid = None
+            self._value = None
+
+
+def start_thread(target, name):
+    """Start `target` on a daemon thread, and return the thread."""
+    thread = threading.Thread(target=target, name=name)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def memoize(maxsize=DEFAULT_MEMO_SIZE):
+    """Decorator that remembers the results of a function of hashable
+    arguments in an LRUCache, exposed as the function's `cache`."""
+    def decorator(fn):
+        cache = LRUCache(maxsize)
+        missing = object()
+
+        @functools.wraps(fn)
+        def memoized(*args):
+            ret = cache.get(args, missing)
+            if ret is missing:
+                ret = fn(*args)
+                cache.set(args, ret)
+            return ret
+        memoized.cache = cache
+        return memoized
+    return decorator
+
+
+@memoize(SELECTOR_CACHE_SIZE)
+def compile_selector(selector):
+    """Translate a CSS selector to XPath and compile it, once per
+    selector. This is what element#cssselect does on every call."""
+    return lxml.etree.XPath(_translator.css_to_xpath(selector))
+
+
 def select(element, selector):
-    """Syntactic sugar for element#cssselect that grabs the first match."""
-    matches = element.cssselect(selector)
-    return matches[0]
+    """Return the first element matching a CSS selector. Raises
+    IndexError if nothing matches."""
+    return compile_selector(selector)(element)[0]
 
 
+def select_all(element, selector):
+    """Return all elements matching a CSS selector."""
+    return compile_selector(selector)(element)
+
+
+@memoize()
 def url_to_uuid5(url):
     """Generate a UUID5 for a given URL."""
     return str(uuid.uuid5(uuid.NAMESPACE_URL, url.encode('utf-8')))
 
 
+@memoize()
+def diff_url(wiki, revid, parentid):
+    """Build the URL of the diff introduced by revision `revid`."""
+    return 'https://%s/w/index.php?diff=%s&oldid=%s' % (wiki, revid, parentid)
+
+
 def utc_to_iso8601(struct_time):
-    """Make a W3-style ISO 8601 UTC timestamp from a struct_time object."""
-    struct_time = datetime.datetime.utcfromtimestamp(time.mktime(struct_time))
-    return struct_time.date().isoformat()
+    """Make a W3-style ISO 8601 UTC date from a struct_time object."""
+    return timestamps.struct_to_iso8601_date(struct_time)
 
 
 def utc_to_epoch(struct_time):
     """Convert a struct_time to an integer number of seconds since epoch."""
-    return int(time.mktime(struct_time))
+    return timestamps.struct_to_epoch(struct_time)
 
 
 def iso8601_to_epoch(iso_time):
-    dt = datetime.datetime.strptime(iso_time, '%Y-%m-%dT%H:%M:%SZ')
-    epoch = datetime.datetime.utcfromtimestamp(0)
-    return int((dt - epoch).total_seconds())
+    return timestamps.iso8601_to_epoch(iso_time)
+
+
+def gzip_bytes(data, compresslevel=6):
+    """Gzip `data` in memory."""
+    buf = StringIO.StringIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb',
+                       compresslevel=compresslevel) as f:
+        f.write(data)
+    return buf.getvalue()
 
 
 def is_valid_ip(address):
     try:
         socket.inet_aton(address)
         return True
-    except socket.error:
+    except (socket.error, UnicodeError):
         pass
     try:
         socket.inet_pton(socket.AF_INET6, address)
         return True
-    except socket.error:
+    except (socket.error, UnicodeError):
         pass
     return False
 
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+  Wikipedia channel for IFTTT
+  ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+  Copyright 2015 Ori Livneh <ori@wikimedia.org>
+                 Stephen LaPorte <stephen.laporte@gmail.com>
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+"""
+
+import json
+import threading
+import time
+from urllib import urlencode
+
+from flask import current_app as app
+
+from caching import cache, make_key, VALIDATION
+from fetch import fetcher
+
+API_URL = 'https://%s.wikipedia.org/w/api.php'
+# The API takes at most this many titles or users per request.
+MAX_BATCH_SIZE = 50
+# How long the first lookup waits for others to join its batch.
+BATCH_WINDOW = 0.02
+LOOKUP_TIMEOUT = 10
+# Things that exist rarely stop existing; things that don't may be
+# created any minute, by the very user filling in the field.
+DEFAULT_POSITIVE_TTL = 24 * 60 * 60
+DEFAULT_NEGATIVE_TTL = 5 * 60
+
+
+def normalize(name):
+    """Normalize a title or user name roughly as MediaWiki does."""
+    name = name.replace('_', ' ').strip()
+    return name[:1].upper() + name[1:]
+
+
+def query_api(lang, params):
+    params = dict(params, format='json')
+    url = '%s?%s' % (API_URL % lang, urlencode(dict(
+        (key, value.encode('utf-8') if isinstance(value, unicode) else value)
+        for key, value in params.items())))
+    return json.loads(fetcher.get(url, timeout=LOOKUP_TIMEOUT))
+
+
+def lookup_titles(lang, titles):
+    """Which of `titles` are existing pages on `lang` Wikipedia."""
+    resp = query_api(lang, {'action': 'query',
+                            'prop': 'info',
+                            'titles': '|'.join(titles)})
+    query = resp.get('query', {})
+    renamed = {}
+    for key in ('normalized', 'converted'):
+        for rename in query.get(key, []):
+            renamed[rename['from']] = rename['to']
+    exists = dict((page['title'], int(page_id) > 0 and 'missing' not in page)
+                  for page_id, page in query.get('pages', {}).items())
+    ret = {}
+    for title in titles:
+        resolved = title
+        while resolved in renamed and renamed[resolved] != resolved:
+            resolved = renamed[resolved]
+        ret[title] = exists.get(resolved, False)
+    return ret
+
+
+def lookup_users(lang, users):
+    """Which of `users` are registered accounts on `lang` Wikipedia."""
+    resp = query_api(lang, {'action': 'query',
+                            'list': 'users',
+                            'ususers': '|'.join(users)})
+    exists = dict((user['name'], bool(user.get('userid')))
+                  for user in resp.get('query', {}).get('users', []))
+    return dict((user, exists.get(normalize(user), False)) for user in users)
+
+
+class Batch(object):
+    """Names waiting to be looked up together, and their results."""
+
+    def __init__(self):
+        self.names = set()
+        self.results = {}
+        self.error = None
+        self.done = threading.Event()
+
+
+class ExistenceChecker(object):
+    """Answers whether names exist on a wiki, caching positive and negative
+    answers for POSITIVE_TTL and NEGATIVE_TTL seconds respectively.
+
+    Names that are not cached are looked up in batches: the first caller
+    opens a batch for its wiki and waits BATCH_WINDOW seconds for
+    concurrent callers to add their names, then looks them all up with a
+    single API request, which every caller waits on."""
+
+    def __init__(self, kind, lookup):
+        self.kind = kind
+        self.lookup = lookup
+        self._lock = threading.Lock()
+        self._batches = {}
+
+    def key(self, lang, name):
+        return make_key(VALIDATION, self.kind, lang, normalize(name))
+
+    def join(self, lang, name):
+        """Add `name` to the open batch for `lang`, opening one if there
+        is none or it is full. Returns the batch and whether the caller
+        opened it."""
+        with self._lock:
+            batch = self._batches.get(lang)
+            leader = batch is None or len(batch.names) >= MAX_BATCH_SIZE
+            if leader:
+                batch = self._batches[lang] = Batch()
+            batch.names.add(name)
+            return batch, leader
+
+    def run(self, lang, batch):
+        time.sleep(BATCH_WINDOW)
+        with self._lock:
+            if self._batches.get(lang) is batch:
+                del self._batches[lang]
+        try:
+            batch.results = self.lookup(lang, sorted(batch.names))
+        except Exception as e:
+            batch.error = e
+        else:
+            positive_ttl = app.config.get('VALIDATION_POSITIVE_TTL',
+                                          DEFAULT_POSITIVE_TTL)
+            negative_ttl = app.config.get('VALIDATION_NEGATIVE_TTL',
+                                          DEFAULT_NEGATIVE_TTL)
+            for name, exists in batch.results.items():
+                cache.set(self.key(lang, name), '1' if exists else '0',
+                          timeout=positive_ttl if exists else negative_ttl)
+        finally:
+            batch.done.set()
+
+    def exists(self, lang, name):
+        cached = cache.get(self.key(lang, name))
+        if cached is not None:
+            return cached == '1'
+        batch, leader = self.join(lang, name)
+        if leader:
+            self.run(lang, batch)
+        elif not batch.done.wait(LOOKUP_TIMEOUT + BATCH_WINDOW):
+            raise RuntimeError('Timed out looking up %s' % self.kind)
+        if batch.error is not None:
+            raise batch.error
+        return batch.results.get(name, False)
+
+
+titles = ExistenceChecker('title', lookup_titles)
+users = ExistenceChecker('user', lookup_users)
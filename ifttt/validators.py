@@ -19,73 +19,60 @@
 
 """
 
+import re
+
 import flask
+import flask.views
 
-from .triggers import APIQueryTriggerView
 from .utils import is_valid_ip
+from .encoders import jsonify
+from . import validation
 
+DEFAULT_LANG = 'en'
+LANG_RE = re.compile(r'^[a-z][a-z-]*$')
 
-class ValidateArticleTitle(APIQueryTriggerView):
 
-    url_pattern = 'article_revisions/fields/title/validate'
-    wiki = 'en.wikipedia.org'
-    query_params = {'action': 'query',
-                    'prop': 'info',
-                    'titles': None,
-                    'format': 'json'}
-
-    def get_query(self):
-        self.query_params['titles'] = self.params.get('value')
-        if not self.query_params['titles']:
+class BaseValidatorView(flask.views.MethodView):
+    """Validate a trigger field value. IFTTT sends the value being
+    checked along with the other field values, so the lookup happens on
+    the wiki of the language the user chose."""
+
+    def get_value(self):
+        self.params = flask.request.get_json(force=True, silent=True) or {}
+        value = self.params.get('value')
+        if not value:
+            flask.abort(400)
+        values = self.params.get('values') or {}
+        self.lang = values.get('lang') or DEFAULT_LANG
+        if not LANG_RE.match(self.lang):
             flask.abort(400)
-        return super(ValidateArticleTitle, self).get_query()
+        return value
+
 
-    def check_page(self):
-        api_resp = self.get_query()
-        page_ids = api_resp['query']['pages'].keys()
-        if int(page_ids[0]) > 0:
-            return True
-        return False
+class ValidateArticleTitle(BaseValidatorView):
+
+    url_pattern = 'article_revisions/fields/title/validate'
 
     def post(self):
-        self.params = flask.request.get_json(force=True, silent=True) or {}
-        exists = self.check_page()
-        title = self.query_params['titles']
+        title = self.get_value()
+        exists = validation.titles.exists(self.lang, title)
         ret = {'valid': exists}
         if not exists:
             ret['message'] = ('A Wikipedia article on %s does not (yet)'
                               ' exist (go write it!)' % title)
-        return flask.jsonify(data=ret)
+        return jsonify(data=ret)
 
 
-class ValidateUser(APIQueryTriggerView):
+class ValidateUser(BaseValidatorView):
 
     url_pattern = 'user_revisions/fields/user/validate'
-    wiki = 'en.wikipedia.org'
-    query_params = {'action': 'query',
-                    'list': 'users',
-                    'ususers': None,
-                    'format': 'json'}
-
-    def get_query(self):
-        self.query_params['ususers'] = self.params.get('value')
-        if not self.query_params['ususers']:
-            flask.abort(400)
-        return super(ValidateUser, self).get_query()
-
-    def check_user(self):
-        api_resp = self.get_query()
-        user_ids = api_resp['query']['users']
-        if user_ids[0].get('userid'):
-            return True
-        return is_valid_ip(self.query_params['ususers'])
 
     def post(self):
-        self.params = flask.request.get_json(force=True, silent=True) or {}
-        exists = self.check_user()
-        title = self.query_params['ususers']
+        user = self.get_value()
+        # Anonymous edits are made under the IP address
+        exists = is_valid_ip(user) or validation.users.exists(self.lang, user)
         ret = {'valid': exists}
         if not exists:
             ret['message'] = ('There is no Wikipedian named %s'
-                              % title)
-        return flask.jsonify(data=ret)
+                              % user)
+        return jsonify(data=ret)
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+  Wikipedia channel for IFTTT
+  ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+  Copyright 2015 Ori Livneh <ori@wikimedia.org>
+                 Stephen LaPorte <stephen.laporte@gmail.com>
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+"""
+
+import errno
+import json
+import logging
+import os
+import threading
+import time
+
+_cur_dir = os.path.dirname(__file__)
+DEFAULT_WARMUP_FILE = os.path.join(_cur_dir, '../cache/warmup.json')
+# Distinct trigger queries counted per worker, and how many of the most
+# polled ones are handed to a new instance to replay.
+MAX_QUERIES = 5000
+DEFAULT_TOP = 200
+# Replaying stops after this many seconds, warm or not.
+DEFAULT_MAX_SECONDS = 120
+
+log = logging.getLogger(__name__)
+
+
+class PollHistory(object):
+    """How often each trigger query (trigger, fields and limit) has been
+    polled by IFTTT. When more than `maxsize` queries are counted, the
+    less polled half is forgotten."""
+
+    def __init__(self, maxsize=MAX_QUERIES):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def record(self, trigger, fields, limit):
+        key = (trigger, json.dumps(fields, sort_keys=True), limit)
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + 1
+            if len(self._counts) > self.maxsize:
+                keep = sorted(self._counts.items(), key=lambda item: item[1],
+                              reverse=True)[:self.maxsize // 2]
+                self._counts = dict(keep)
+
+    def top(self, n=DEFAULT_TOP):
+        with self._lock:
+            items = sorted(self._counts.items(), key=lambda item: item[1],
+                           reverse=True)[:n]
+        return [{'trigger': trigger,
+                 'fields': json.loads(fields),
+                 'limit': limit,
+                 'polls': polls}
+                for (trigger, fields, limit), polls in items]
+
+
+def warm(app, queries, view_classes, max_seconds=DEFAULT_MAX_SECONDS):
+    """Run each of `queries`, as listed by PollHistory.top, so that the
+    feeds, API responses, page images and database rows they read are
+    cached before the first request. Returns how many ran."""
+    deadline = time.time() + max_seconds
+    ran = 0
+    for query in queries:
+        if time.time() > deadline:
+            break
+        view_class = view_classes.get(query.get('trigger'))
+        if view_class is None:
+            continue
+        view = view_class()
+        view.fields = query['fields']
+        view.limit = query['limit']
+        view.params = {}
+        try:
+            with app.app_context():
+                view.get_data()
+        except Exception:
+            log.warning('Could not warm %s', query['trigger'], exc_info=True)
+        else:
+            ran += 1
+    return ran
+
+
+def warm_from_file(app, path, view_classes, max_seconds=DEFAULT_MAX_SECONDS):
+    """Replay the queries saved at `path` by a deploy, then remove it so
+    that later restarts don't replay them again. Every worker loading at
+    once reads the file and replays it into its own cache; whichever
+    finishes first removes it."""
+    try:
+        with open(path) as f:
+            queries = json.load(f)['data']
+    except IOError:
+        return 0
+    except (ValueError, KeyError, TypeError):
+        log.warning('Could not read warmup queries %s', path, exc_info=True)
+        queries = []
+    ran = warm(app, queries, view_classes, max_seconds)
+    log.info('Warmed %d of %d queries from %s', ran, len(queries), path)
+    try:
+        os.remove(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+    return ran
+
+
+poll_history = PollHistory()
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+  Wikipedia channel for IFTTT
+  ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+  Copyright 2015 Ori Livneh <ori@wikimedia.org>
+                 Stephen LaPorte <stephen.laporte@gmail.com>
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+
+  Optional router to run in front of several instances of the channel.
+  Requests are sent to instances by a consistent hash of their trigger
+  and wiki, so that each instance's caches only hold its share of the
+  wikis. It deliberately doesn't import the ifttt package, which would
+  set up a whole channel app in the router.
+
+"""
+
+import bisect
+import hashlib
+import httplib
+import json
+import os
+import re
+import socket
+import threading
+import time
+import urlparse
+
+from flask.config import Config
+
+# Points per backend on the hash ring
+REPLICAS = 100
+DEFAULT_MAX_INFLIGHT = 32
+DEFAULT_TIMEOUT = 60
+# A backend that refused or dropped a connection gets no requests for
+# this many seconds.
+DOWN_SECONDS = 10
+# Seconds between checks of ROUTING_BACKENDS_FILE for changes
+RELOAD_INTERVAL = 5
+
+TRIGGER_RE = re.compile(r'^/v1/triggers/([^/]+)')
+IDENTITY_RE = re.compile(r'^/v1/triggers/[^/]+/trigger_identity/')
+NO_BACKEND = ('502 Bad Gateway', [('Content-Type', 'application/json')],
+              json.dumps({'errors': [{'message': 'No backend available'}]}))
+HOP_BY_HOP = set(['connection', 'keep-alive', 'transfer-encoding', 'te',
+                  'trailer', 'upgrade', 'proxy-authenticate',
+                  'proxy-authorization'])
+
+
+def hash_key(key):
+    return int(hashlib.md5(key).hexdigest()[:16], 16)
+
+
+class HashRing(object):
+    """Consistent hash ring of backend addresses. Adding or removing a
+    backend only moves the keys that hash next to its points."""
+
+    def __init__(self, nodes, replicas=REPLICAS):
+        points = []
+        for node in nodes:
+            for i in range(replicas):
+                points.append((hash_key('%s#%d' % (node, i)), node))
+        points.sort()
+        self.hashes = [point for point, node in points]
+        self.nodes = [node for point, node in points]
+        self.size = len(set(nodes))
+
+    def preference(self, key):
+        """Every node, in the order `key` should try them."""
+        seen = []
+        if not self.nodes:
+            return seen
+        start = bisect.bisect(self.hashes, hash_key(key))
+        for i in range(len(self.nodes)):
+            node = self.nodes[(start + i) % len(self.nodes)]
+            if node not in seen:
+                seen.append(node)
+                if len(seen) == self.size:
+                    break
+        return seen
+
+
+class Backend(object):
+    """An instance of the channel, and the requests it is serving."""
+
+    def __init__(self, address):
+        self.address = address
+        self.host, _, port = address.rpartition(':')
+        self.port = int(port)
+        self.inflight = 0
+        self.routed = 0
+        self.failures = 0
+        self.down_until = 0
+
+    def stats(self):
+        return {'inflight': self.inflight,
+                'routed': self.routed,
+                'failures': self.failures,
+                'down': self.down_until > time.time()}
+
+
+def route_key(environ, body):
+    """The (trigger, lang) a request is about, as a ring key. Requests
+    that aren't for a trigger are keyed by path."""
+    path = environ.get('PATH_INFO', '')
+    match = TRIGGER_RE.match(path)
+    if not match:
+        return path
+    lang = urlparse.parse_qs(environ.get('QUERY_STRING', '')).get('lang')
+    lang = lang[0] if lang else ''
+    if body:
+        try:
+            params = json.loads(body)
+            lang = (params.get('triggerFields') or
+                    params.get('values') or {}).get('lang', lang)
+        except (ValueError, AttributeError):
+            pass
+    return (u'%s:%s' % (match.group(1), lang)).encode('utf-8')
+
+
+class Dispatcher(object):
+    """WSGI app that proxies each request to the backend its route key
+    hashes to. A backend that is down, or already serving
+    `max_inflight` requests, is passed over for the next one on the
+    ring. Trigger identity deletions go to every backend, since any of
+    them may have registered the identity for realtime notifications."""
+
+    def __init__(self, backends=(), backends_file=None,
+                 max_inflight=DEFAULT_MAX_INFLIGHT, timeout=DEFAULT_TIMEOUT,
+                 channel_key=None):
+        self.backends_file = backends_file
+        self.max_inflight = max_inflight
+        self.timeout = timeout
+        self.channel_key = channel_key
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+        self._backends = {}
+        self._mtime = None
+        self._checked_at = 0
+        self.set_backends(backends)
+        self.maybe_reload()
+
+    @classmethod
+    def from_config(cls, root):
+        config = Config(root)
+        # Load default config first, and override it with ifttt.cfg
+        config.from_pyfile('default.cfg', silent=True)
+        config.from_pyfile('ifttt.cfg', silent=True)
+        return cls(config.get('ROUTING_BACKENDS', ()),
+                   config.get('ROUTING_BACKENDS_FILE'),
+                   config.get('ROUTING_MAX_INFLIGHT', DEFAULT_MAX_INFLIGHT),
+                   config.get('ROUTING_TIMEOUT', DEFAULT_TIMEOUT),
+                   config.get('CHANNEL_KEY'))
+
+    def set_backends(self, addresses):
+        """Route to `addresses` from now on. Backends that stay keep their
+        counters, and requests they are serving finish undisturbed."""
+        with self._lock:
+            self._backends = dict((address,
+                                   self._backends.get(address) or
+                                   Backend(address))
+                                  for address in addresses)
+            self.ring = HashRing(sorted(self._backends))
+
+    def maybe_reload(self):
+        """Pick up changes to the backends file, one address per line."""
+        now = time.time()
+        if not self.backends_file or self._checked_at + RELOAD_INTERVAL > now:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.backends_file).st_mtime
+            if mtime == self._mtime:
+                return
+            with open(self.backends_file) as f:
+                addresses = [line.strip() for line in f
+                             if line.strip() and not line.startswith('#')]
+        except (IOError, OSError):
+            return
+        self._mtime = mtime
+        self.set_backends(addresses)
+
+    def choose(self, key, exclude=()):
+        """The backend to send `key` to, counted as serving it."""
+        now = time.time()
+        with self._lock:
+            candidates = [self._backends[address]
+                          for address in self.ring.preference(key)
+                          if address not in exclude]
+            up = [b for b in candidates if b.down_until <= now] or candidates
+            if not up:
+                return None
+            for backend in up:
+                if backend.inflight < self.max_inflight:
+                    break
+            else:
+                backend = min(up, key=lambda b: b.inflight)
+            if backend is not up[0]:
+                self.fallbacks += 1
+            backend.inflight += 1
+            backend.routed += 1
+            return backend
+
+    def release(self, backend, failed=False):
+        with self._lock:
+            backend.inflight -= 1
+            if failed:
+                backend.failures += 1
+                backend.down_until = time.time() + DOWN_SECONDS
+
+    def forward(self, backend, environ, body):
+        path = environ.get('PATH_INFO', '')
+        if environ.get('QUERY_STRING'):
+            path += '?' + environ['QUERY_STRING']
+        headers = dict((key[5:].replace('_', '-').title(), value)
+                       for key, value in environ.items()
+                       if key.startswith('HTTP_') and
+                       key[5:].replace('_', '-').lower() not in HOP_BY_HOP)
+        if environ.get('CONTENT_TYPE'):
+            headers['Content-Type'] = environ['CONTENT_TYPE']
+        headers['Content-Length'] = str(len(body))
+        conn = httplib.HTTPConnection(backend.host, backend.port,
+                                      timeout=self.timeout)
+        try:
+            conn.request(environ['REQUEST_METHOD'], path, body, headers)
+            resp = conn.getresponse()
+            return ('%d %s' % (resp.status, resp.reason),
+                    [(key.title(), value) for key, value in resp.getheaders()
+                     if key.lower() not in HOP_BY_HOP],
+                    resp.read())
+        finally:
+            conn.close()
+
+    def proxy(self, key, environ, body):
+        """Send the request to the backend for `key`, moving on to the
+        next one if it can't be reached."""
+        tried = set()
+        while True:
+            backend = self.choose(key, tried)
+            if backend is None:
+                return NO_BACKEND
+            tried.add(backend.address)
+            try:
+                ret = self.forward(backend, environ, body)
+            except (socket.error, httplib.HTTPException):
+                self.release(backend, failed=True)
+                continue
+            self.release(backend)
+            return ret
+
+    def broadcast(self, environ, body):
+        """Send the request to every backend, answering with the first
+        response."""
+        with self._lock:
+            backends = self._backends.values()
+        ret = None
+        for backend in backends:
+            try:
+                resp = self.forward(backend, environ, body)
+            except (socket.error, httplib.HTTPException):
+                continue
+            ret = ret or resp
+        return ret or NO_BACKEND
+
+    def stats(self):
+        with self._lock:
+            return {'backends': dict((address, backend.stats())
+                                     for address, backend
+                                     in self._backends.items()),
+                    'fallbacks': self.fallbacks}
+
+    def __call__(self, environ, start_response):
+        self.maybe_reload()
+        if environ.get('PATH_INFO') == '/v1/routing':
+            if environ.get('HTTP_IFTTT_CHANNEL_KEY') != self.channel_key:
+                start_response('401 Unauthorized',
+                               [('Content-Type', 'application/json')])
+                return [json.dumps({'errors': [{'message': 'Unauthorized'}]})]
+            start_response('200 OK', [('Content-Type', 'application/json')])
+            return [json.dumps({'data': self.stats()})]
+        length = environ.get('CONTENT_LENGTH')
+        body = environ['wsgi.input'].read(int(length)) if length else ''
+        if (environ.get('REQUEST_METHOD') == 'DELETE' and
+                IDENTITY_RE.match(environ.get('PATH_INFO', ''))):
+            status, headers, content = self.broadcast(environ, body)
+        else:
+            status, headers, content = self.proxy(route_key(environ, body),
+                                                  environ, body)
+        start_response(status, headers)
+        return [content]
+
+
+application = Dispatcher.from_config(os.path.dirname(os.path.abspath(
+    __file__)))
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+import unittest
+
+from ifttt.admission import AdmissionControl, Gate
+
+
+class GateTest(unittest.TestCase):
+
+    def test_sheds_beyond_slots_and_queue(self):
+        gate = Gate(1, 0, 1.0)
+        self.assertTrue(gate.enter())
+        self.assertFalse(gate.enter())
+        gate.leave()
+        self.assertTrue(gate.enter())
+        stats = gate.stats()
+        self.assertEqual((stats['admitted'], stats['shed']), (2, 1))
+
+    def test_queued_request_gets_freed_slot(self):
+        gate = Gate(1, 1, 5.0)
+        gate.enter()
+        admitted = []
+        waiter = threading.Thread(target=lambda: admitted.append(gate.enter()))
+        waiter.start()
+        while not gate.stats()['waiting']:
+            time.sleep(0.001)
+        gate.leave()
+        waiter.join()
+        self.assertEqual(admitted, [True])
+        self.assertEqual(gate.stats()['max_waiting'], 1)
+
+    def test_queued_request_times_out(self):
+        gate = Gate(1, 1, 0.01)
+        gate.enter()
+        self.assertFalse(gate.enter())
+        self.assertEqual(gate.stats()['waiting'], 0)
+
+    def test_no_wait(self):
+        gate = Gate(1, 1, 5.0)
+        gate.enter()
+        self.assertFalse(gate.enter(wait=0))
+
+
+class AdmissionControlTest(unittest.TestCase):
+
+    def test_budgets_per_trigger(self):
+        control = AdmissionControl((4, 8, 1.0), {'Slow': (1, 2, 0.5)})
+        self.assertEqual(control.gate('Slow').slots, 1)
+        self.assertEqual(control.gate('Fast').slots, 4)
+        self.assertIs(control.gate('Slow'), control.gate('Slow'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from ifttt import caching
+from ifttt.caching import (BoundedCache, cache, make_key, API, FEEDS,
+                           RESPONSES, ENTRY_OVERHEAD, load_snapshot,
+                           write_snapshot)
+
+PAYLOAD = 'x' * 300
+
+
+class BoundedCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.entry_size = len(make_key(FEEDS, 'a')) + len(PAYLOAD) + \
+            ENTRY_OVERHEAD
+        self.cache = BoundedCache(budget=3 * self.entry_size,
+                                  quotas={FEEDS: 2 * self.entry_size,
+                                          API: 2 * self.entry_size})
+
+    def test_namespace_quota_evicts_least_recently_used(self):
+        self.cache.set(make_key(FEEDS, 'a'), PAYLOAD)
+        self.cache.set(make_key(FEEDS, 'b'), PAYLOAD)
+        self.assertEqual(self.cache.get(make_key(FEEDS, 'a')), PAYLOAD)
+        self.cache.set(make_key(FEEDS, 'c'), PAYLOAD)
+        self.assertTrue(self.cache.has(make_key(FEEDS, 'a')))
+        self.assertFalse(self.cache.has(make_key(FEEDS, 'b')))
+        self.assertTrue(self.cache.has(make_key(FEEDS, 'c')))
+        stats = self.cache.stats()
+        self.assertEqual(stats['bytes'], 2 * self.entry_size)
+        self.assertEqual(stats['namespaces'][FEEDS]['evictions'], 1)
+
+    def test_budget_evicts_from_fullest_namespace(self):
+        self.cache.set(make_key(FEEDS, 'a'), PAYLOAD)
+        self.cache.set(make_key(FEEDS, 'b'), PAYLOAD)
+        self.cache.set(make_key(API, 'a'), PAYLOAD)
+        self.cache.set(make_key(API, 'b'), PAYLOAD[:-100])
+        self.assertLessEqual(self.cache.size, self.cache.budget)
+        self.assertFalse(self.cache.has(make_key(FEEDS, 'a')))
+        self.assertTrue(self.cache.has(make_key(API, 'a')))
+
+    def test_oversized_values_are_not_stored(self):
+        self.cache.set(make_key(FEEDS, 'a'), PAYLOAD * 10)
+        self.assertIsNone(self.cache.get(make_key(FEEDS, 'a')))
+        self.assertEqual(self.cache.size, 0)
+
+    def test_expired_entries_are_dropped(self):
+        self.cache.set(make_key(FEEDS, 'a'), PAYLOAD, timeout=-1)
+        self.assertIsNone(self.cache.get(make_key(FEEDS, 'a')))
+        self.assertEqual(self.cache.size, 0)
+
+    def test_values_round_trip(self):
+        cache = BoundedCache(compress_min_size=100)
+        value = {'entries': [PAYLOAD] * 10}
+        cache.set(make_key(API, 'a'), value)
+        self.assertEqual(cache.get(make_key(API, 'a')), value)
+        self.assertLess(cache.size, len(PAYLOAD) * 10)
+
+    def test_export_and_restore(self):
+        self.cache.set(make_key(FEEDS, 'a'), {'a': 1})
+        self.cache.set(make_key(API, 'a'), 'b')
+        other = BoundedCache()
+        for entry in self.cache.export([FEEDS]):
+            other.restore(*entry)
+        self.assertEqual(other.get(make_key(FEEDS, 'a')), {'a': 1})
+        self.assertIsNone(other.get(make_key(API, 'a')))
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache', 'snapshot.bin')
+        self.keys = [make_key(FEEDS, 'snapshot-test'),
+                     make_key(RESPONSES, 'snapshot-test')]
+
+    def tearDown(self):
+        for key in self.keys:
+            cache.delete(key)
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        cache.set(self.keys[0], ['entry'], timeout=60)
+        cache.set(self.keys[1], 'body', timeout=60)
+        self.assertGreaterEqual(write_snapshot(self.path), 1)
+        for key in self.keys:
+            cache.delete(key)
+        self.assertGreaterEqual(load_snapshot(self.path), 1)
+        self.assertEqual(cache.get(self.keys[0]), ['entry'])
+        # Responses are not worth keeping across restarts
+        self.assertIsNone(cache.get(self.keys[1]))
+
+    def test_other_versions_are_ignored(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'wb') as f:
+            f.write('IFTTT-CACHE 0\n')
+        self.assertEqual(load_snapshot(self.path), 0)
+        self.assertEqual(load_snapshot(self.path + '.missing'), 0)
+
+    def test_only_unreadable_snapshots_are_logged(self):
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        caching.log.addHandler(handler)
+        try:
+            load_snapshot(self.path)
+            self.assertEqual(records, [])
+            os.makedirs(os.path.dirname(self.path))
+            with open(self.path, 'wb') as f:
+                f.write('IFTTT-CACHE %d\nnot zlib' % caching.SNAPSHOT_VERSION)
+            self.assertEqual(load_snapshot(self.path), 0)
+            self.assertEqual(len(records), 1)
+        finally:
+            caching.log.removeHandler(handler)
+
+
+if __name__ == '__main__':
+    unittest.main()
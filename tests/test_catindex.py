@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import datetime
+import threading
+import time
+import unittest
+
+from ifttt import app
+from ifttt import catindex
+from ifttt.dal import CategoryLink
+
+
+def link(page_id, age=0):
+    return CategoryLink(page_id, 0, 'Page_%d' % page_id,
+                        datetime.datetime.utcnow() -
+                        datetime.timedelta(seconds=age))
+
+
+class CategoryIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rows = [link(1, 3600), link(2)]
+        self.reads = []
+        self.release = threading.Event()
+        self.release.set()
+        self._get_category_links = catindex.get_category_links
+        catindex.get_category_links = self.get_category_links
+        self.index = catindex.CategoryIndex()
+
+    def tearDown(self):
+        catindex.get_category_links = self._get_category_links
+
+    def get_category_links(self, category, lang='en', since=None):
+        self.reads.append(since)
+        if since is None:
+            self.release.wait(5)
+            return list(self.rows)
+        return [row for row in self.rows if row.cl_timestamp >= since]
+
+    def get(self):
+        with app.app_context():
+            return self.index.get('Foo', 'en')
+
+    def test_first_build_is_synchronous(self):
+        members = self.get()
+        self.assertIn(1, members)
+        self.assertIn(2, members)
+        self.assertNotIn(3, members)
+
+    def test_first_build_is_shared(self):
+        self.release.clear()
+        threads = [threading.Thread(target=self.get) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual([since for since in self.reads if since is None],
+                         [None])
+
+    def test_refresh_adds_new_members(self):
+        members = self.get()
+        self.rows.append(link(3))
+        members.refreshed_at = 0
+        self.get()
+        self.assertIn(3, members)
+        self.assertEqual([row.page_id for row in members.added_since(
+            datetime.datetime.utcnow() - datetime.timedelta(minutes=1))],
+            [3, 2])
+
+    def test_rebuild_serves_previous_index(self):
+        members = self.get()
+        self.rows = [link(2), link(4)]
+        self.release.clear()
+        members.built_at -= catindex.REBUILD_INTERVAL + 1
+        self.assertIn(1, self.get())
+        self.assertNotIn(4, members)
+        self.release.set()
+        deadline = time.time() + 5
+        while 1 in members and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertNotIn(1, members)
+        self.assertIn(4, members)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import gzip
+import StringIO
+import unittest
+
+import flask
+
+from ifttt import app
+from ifttt.compression import compress_response
+
+BODY = '{"data":[%s]}' % ','.join(['{"title":"Foo"}'] * 100)
+
+
+def gunzip(data):
+    return gzip.GzipFile(fileobj=StringIO.StringIO(data)).read()
+
+
+class CompressResponseTest(unittest.TestCase):
+
+    def compress(self, accept, body=BODY, status=200):
+        headers = {'Accept-Encoding': accept} if accept else {}
+        with app.test_request_context(headers=headers):
+            response = flask.Response(body, status=status,
+                                      mimetype='application/json')
+            return compress_response(flask.request, response)
+
+    def test_gzip(self):
+        response = self.compress('gzip, deflate')
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gunzip(response.get_data()), BODY)
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(response.mimetype, 'application/json')
+
+    def test_not_accepted(self):
+        response = self.compress(None)
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.get_data(), BODY)
+
+    def test_small_and_error_responses_are_left_alone(self):
+        self.assertNotIn('Content-Encoding',
+                         self.compress('gzip', body='{}').headers)
+        self.assertNotIn('Content-Encoding',
+                         self.compress('gzip', status=400).headers)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import collections
+import time
+import unittest
+
+from ifttt import app
+from ifttt import dal
+from ifttt.dal import (RowBuffer, RowCache, TitleRevisionCache,
+                       RC_TIMESTAMP_FORMAT, stream)
+
+Row = collections.namedtuple('Row', ['rc_id', 'rc_timestamp'])
+TitleRow = collections.namedtuple('TitleRow', ['rc_id', 'rc_title',
+                                               'rc_timestamp'])
+
+
+def ago(seconds):
+    return time.strftime(RC_TIMESTAMP_FORMAT,
+                         time.gmtime(time.time() - seconds))
+
+
+class RowCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.table = [Row(1, ago(300)), Row(2, ago(200)), Row(3, ago(100))]
+        self.since_ids = []
+        self.cache = RowCache()
+        self._config = dict(app.config)
+        app.config['DAL_REFRESH_INTERVAL'] = 0
+
+    def tearDown(self):
+        app.config.clear()
+        app.config.update(self._config)
+
+    def query(self, since_id):
+        self.since_ids.append(since_id)
+        return [row for row in self.table if row.rc_id > since_id]
+
+    def fetch(self, **kwargs):
+        with app.app_context():
+            return [row.rc_id for row in self.cache.fetch('key', self.query,
+                                                          **kwargs)]
+
+    def test_refresh_only_asks_above_watermark(self):
+        self.assertEqual(self.fetch(), [3, 2, 1])
+        self.table.append(Row(4, ago(0)))
+        self.assertEqual(self.fetch(), [4, 3, 2, 1])
+        self.assertEqual(self.since_ids, [0, 3])
+
+    def test_rows_within_interval_are_served_from_buffer(self):
+        app.config['DAL_REFRESH_INTERVAL'] = 60
+        self.fetch()
+        self.table.append(Row(4, ago(0)))
+        self.assertEqual(self.fetch(), [3, 2, 1])
+        self.assertEqual(self.since_ids, [0])
+
+    def test_limit(self):
+        self.assertEqual(self.fetch(limit=2), [3, 2])
+
+
+class RowBufferTest(unittest.TestCase):
+
+    def test_old_rows_are_evicted(self):
+        buf = RowBuffer(hours=1)
+        # rc_id 2 was saved late, with an older timestamp than rc_id 1
+        buf.extend([Row(1, ago(60)), Row(2, ago(7200)), Row(3, ago(30))])
+        self.assertEqual([row.rc_id for row in buf.newest_first()], [3, 1])
+        self.assertEqual(buf.watermark, 3)
+
+    def test_rows_below_watermark_are_ignored(self):
+        buf = RowBuffer()
+        buf.extend([Row(5, ago(0))])
+        buf.extend([Row(4, ago(0)), Row(6, ago(0))])
+        self.assertEqual([row.rc_id for row in buf.newest_first()], [6, 5])
+
+
+class TitleRevisionCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.table = [TitleRow(1, 'Foo', ago(300)),
+                      TitleRow(2, 'Bar', ago(200)),
+                      TitleRow(3, 'Foo', ago(100)),
+                      TitleRow(4, 'Baz', ago(50))]
+        self.queries = []
+        self._get_title_revisions = dal.get_title_revisions
+        dal.get_title_revisions = self.get_title_revisions
+        self._config = dict(app.config)
+        app.config['DAL_REFRESH_INTERVAL'] = 60
+        self.cache = TitleRevisionCache()
+
+    def tearDown(self):
+        dal.get_title_revisions = self._get_title_revisions
+        app.config.clear()
+        app.config.update(self._config)
+
+    def get_title_revisions(self, titles, lang, hours, since_id):
+        self.queries.append((sorted(titles), since_id))
+        return [row for row in self.table
+                if row.rc_title in titles and row.rc_id > since_id]
+
+    def fetch(self, titles, limit=50):
+        with app.app_context():
+            return [row.rc_id for row in self.cache.fetch(titles, 'en', 1,
+                                                          limit)]
+
+    def test_titles_are_shared_between_lists(self):
+        self.assertEqual(self.fetch(['Foo', 'Bar']), [3, 2, 1])
+        self.assertEqual(self.fetch(['Foo', 'Baz'], limit=2), [4, 3])
+        # Only Baz was missing the second time
+        self.assertEqual(self.queries, [(['Bar', 'Foo'], 0), (['Baz'], 0)])
+
+    def test_refresh_asks_above_lowest_watermark(self):
+        self.fetch(['Foo', 'Bar'])
+        app.config['DAL_REFRESH_INTERVAL'] = 0
+        self.table.append(TitleRow(5, 'Bar', ago(0)))
+        self.assertEqual(self.fetch(['Foo', 'Bar']), [5, 3, 2, 1])
+        self.assertEqual(self.queries[-1], (['Bar', 'Foo'], 2))
+
+
+class FakeCursor(object):
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.fetches = 0
+        self.closed = False
+
+    def fetchmany(self, size):
+        self.fetches += 1
+        ret, self.rows = self.rows[:size], self.rows[size:]
+        return ret
+
+    def close(self):
+        self.closed = True
+
+
+class StreamTest(unittest.TestCase):
+
+    def test_rows_are_fetched_in_chunks_as_records(self):
+        cursor = FakeCursor([(i, '20260101000000') for i in range(5)])
+        rows = stream(cursor, cursor, Row, size=2)
+        self.assertEqual(next(rows), Row(0, '20260101000000'))
+        self.assertEqual(cursor.fetches, 1)
+        self.assertEqual([row.rc_id for row in rows], [1, 2, 3, 4])
+        self.assertEqual(cursor.fetches, 4)
+        self.assertTrue(cursor.closed)
+
+    def test_connection_is_closed_when_abandoned(self):
+        cursor = FakeCursor([(i, '20260101000000') for i in range(5)])
+        rows = stream(cursor, cursor, Row, size=2)
+        next(rows)
+        rows.close()
+        self.assertTrue(cursor.closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+
+from ifttt.encoders import dumps, encode_data, encode_item
+
+
+class EncoderTest(unittest.TestCase):
+
+    def test_compact_and_ascii(self):
+        self.assertEqual(dumps([u'Caf\xe9', {'score': 0.1}]),
+                         '["Caf\\u00e9",{"score":0.1}]')
+
+    def test_floats_round_trip(self):
+        score = 1.0 / 3
+        self.assertEqual(json.loads(dumps([score]))[0], score)
+
+    def test_encoded_items_are_reused(self):
+        item = {'title': 'Foo', 'meta': {'id': 'a'}}
+        first = encode_item(item, key='test-item')
+        item['title'] = 'Bar'
+        self.assertEqual(encode_item(item, key='test-item'), first)
+        self.assertEqual(json.loads(encode_item(item))['title'], 'Bar')
+
+    def test_data_body(self):
+        items = [{'a': 1}, {'b': 2}]
+        body = encode_data([encode_item(item) for item in items])
+        self.assertEqual(json.loads(body), {'data': items})
+
+
+if __name__ == '__main__':
+    unittest.main()
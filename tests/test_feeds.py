@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import os
+import unittest
+
+import feedparser
+import lxml.html
+
+from ifttt.feeds import read_featured_feed, parse_summary
+from ifttt.triggers import ArticleOfTheDay, PictureOfTheDay, WordOfTheDay
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+class FeaturedFeedTest(unittest.TestCase):
+    """Trigger items scraped from the recorded feeds must match what
+    they were when the feeds were read with feedparser."""
+
+    def compare(self, view_class, name, url):
+        path = os.path.join(FIXTURES, name + '.xml')
+        view = view_class()
+        with open(path) as f:
+            expected = [view.parse_entry(entry,
+                                         lxml.html.fromstring(entry.summary))
+                        for entry in feedparser.parse(f, response_headers={
+                            'content-location': url}).entries]
+        with open(path) as f:
+            actual = [view.parse_entry(entry, parse_summary(entry.summary,
+                                                            url))
+                      for entry in read_featured_feed(f)]
+        self.assertTrue(expected)
+        self.assertEqual(actual, expected)
+        return actual
+
+    def test_article_of_the_day(self):
+        items = self.compare(ArticleOfTheDay, 'featured',
+                             'https://en.wikipedia.org/w/api.php')
+        self.assertNotIn('mw-parser-output', items[0]['summary'])
+
+    def test_picture_of_the_day(self):
+        items = self.compare(PictureOfTheDay, 'potd',
+                             'https://commons.wikimedia.org/w/api.php')
+        self.assertNotIn('mw-parser-output', items[0]['description'])
+
+    def test_word_of_the_day(self):
+        items = self.compare(WordOfTheDay, 'wotd',
+                             'https://en.wiktionary.org/w/api.php')
+        self.assertNotIn('mw.loader', items[0]['definition'])
+
+
+if __name__ == '__main__':
+    unittest.main()
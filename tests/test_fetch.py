@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+import unittest
+
+from ifttt.fetch import Fetcher, MIN_SAMPLES
+
+URL = 'https://en.wikipedia.org/w/api.php'
+
+
+class FakeFetcher(Fetcher):
+    """Fetcher whose requests take the given numbers of seconds, in
+    turn, and answer with the number of the request."""
+
+    def __init__(self, delays, **kwargs):
+        super(FakeFetcher, self).__init__(**kwargs)
+        self.delays = list(delays)
+        self.calls = 0
+        self._calls_lock = threading.Lock()
+
+    def read(self, host, request, timeout):
+        with self._calls_lock:
+            call = self.calls
+            self.calls += 1
+        delay = self.delays[call]
+        if delay is None:
+            raise IOError('request %d failed' % call)
+        time.sleep(delay)
+        host.samples.append(delay)
+        return str(call)
+
+    def warm_up(self, seconds=0.01):
+        host = self.host(URL)
+        host.samples.extend([seconds] * MIN_SAMPLES)
+
+
+class FetcherTest(unittest.TestCase):
+
+    def test_not_hedged_without_samples(self):
+        fetcher = FakeFetcher([0.1], max_rate=1)
+        self.assertEqual(fetcher.get(URL), '0')
+        self.assertEqual(fetcher.stats()['en.wikipedia.org']['hedges'], 0)
+
+    def test_slow_request_is_hedged(self):
+        fetcher = FakeFetcher([1.0, 0], max_rate=1)
+        fetcher.warm_up()
+        start = time.time()
+        self.assertEqual(fetcher.get(URL), '1')
+        self.assertLess(time.time() - start, 0.5)
+        stats = fetcher.stats()['en.wikipedia.org']
+        self.assertEqual((stats['hedges'], stats['hedge_wins']), (1, 1))
+
+    def test_fast_request_is_not_hedged(self):
+        fetcher = FakeFetcher([0], max_rate=1)
+        fetcher.warm_up()
+        self.assertEqual(fetcher.get(URL), '0')
+        self.assertEqual(fetcher.calls, 1)
+
+    def test_hedges_are_rate_limited(self):
+        fetcher = FakeFetcher([0.2, 0], max_rate=0.05)
+        fetcher.warm_up()
+        self.assertEqual(fetcher.get(URL), '0')
+        self.assertEqual(fetcher.calls, 1)
+
+    def test_failed_attempt_falls_back_to_the_other(self):
+        fetcher = FakeFetcher([0.2, None], max_rate=1)
+        fetcher.warm_up()
+        self.assertEqual(fetcher.get(URL), '0')
+        self.assertEqual(fetcher.stats()['en.wikipedia.org']['hedge_wins'],
+                         0)
+
+    def test_both_attempts_fail(self):
+        fetcher = FakeFetcher([None, None], max_rate=1)
+        fetcher.warm_up()
+        self.assertRaises(IOError, fetcher.get, URL)
+
+
+if __name__ == '__main__':
+    unittest.main()
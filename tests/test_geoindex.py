@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from ifttt import geoindex
+from ifttt.dal import GeoTag
+
+
+class GeoIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tags = [GeoTag('San_Jose', 37.3382, -121.8863),
+                     GeoTag('Santa_Clara', 37.3541, -121.9552),
+                     GeoTag('Fiji', -17.7134, 179.9999),
+                     GeoTag('Taveuni', -16.8, -179.9999),
+                     GeoTag('Amundsen-Scott', -89.9978, 139.2729)]
+        self.queries = []
+        self._get_geotagged_pages = geoindex.get_geotagged_pages
+        geoindex.get_geotagged_pages = self.get_geotagged_pages
+        self.index = geoindex.GeoIndex()
+
+    def tearDown(self):
+        geoindex.get_geotagged_pages = self._get_geotagged_pages
+
+    def get_geotagged_pages(self, south, west, north, east, lang='en'):
+        self.queries.append((south, west, north, east))
+        return [tag for tag in self.tags
+                if south <= tag.gt_lat <= north and west <= tag.gt_lon <= east]
+
+    def test_missing_cells_are_read_at_once(self):
+        titles = self.index.titles_near('en', 37.3382, -121.8863, 10000)
+        self.assertEqual(titles, ['San Jose', 'Santa Clara'])
+        self.assertEqual(len(self.queries), 1)
+        self.index.titles_near('en', 37.3382, -121.8863, 10000)
+        self.assertEqual(len(self.queries), 1)
+        # One column further west is missing, and read alone
+        self.index.titles_near('en', 37.3382, -121.9863, 10000)
+        self.assertEqual(len(self.queries), 2)
+        south, west, north, east = self.queries[1]
+        self.assertAlmostEqual(east - west, geoindex.CELL_DEGREES)
+
+    def test_dateline(self):
+        titles = self.index.titles_near('en', -17.7134, 179.99, 10000)
+        self.assertEqual(titles, ['Fiji'])
+        self.assertEqual(len(self.queries), 2)
+
+    def test_poles_bypass_the_grid(self):
+        titles = self.index.titles_near('en', -89.99, 0, 10000)
+        self.assertEqual(titles, ['Amundsen-Scott'])
+        self.assertEqual(len(self.queries), 1)
+        self.assertEqual(len(self.index.cells), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import Queue
+import shutil
+import tempfile
+import unittest
+
+from ifttt.logs import QueueHandler, SamplingFilter, StructuredFormatter
+
+
+def record(message, level=logging.INFO, **extra):
+    ret = logging.LogRecord('ifttt.test', level, __file__, 1, message, (),
+                            None)
+    ret.__dict__.update(extra)
+    return ret
+
+
+class StalledHandler(QueueHandler):
+    """QueueHandler whose queue nothing drains."""
+
+    def start(self):
+        return Queue.Queue(self.maxsize), None
+
+
+class QueueHandlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'ifttt.log')
+        self.handler = QueueHandler(self.path)
+        self.handler.setFormatter(StructuredFormatter())
+
+    def tearDown(self):
+        self.handler.stop()
+        shutil.rmtree(self.directory)
+
+    def lines(self):
+        with open(self.path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_records_are_written_as_json_lines(self):
+        self.handler.handle(record('polled', trigger='NewArticle',
+                                   identity='abc'))
+        self.handler.stop()
+        line, = self.lines()
+        self.assertEqual((line['message'], line['trigger'], line['identity'],
+                          line['level']),
+                         ('polled', 'NewArticle', 'abc', 'INFO'))
+
+    def test_arguments_are_rendered_when_logged(self):
+        args = ['a']
+        rec = logging.LogRecord('ifttt.test', logging.INFO, __file__, 1,
+                                '%s', (args,), None)
+        self.handler.handle(rec)
+        args.append('b')
+        self.handler.stop()
+        self.assertEqual(self.lines()[0]['message'], "['a']")
+
+    def test_full_queue_drops_records(self):
+        handler = StalledHandler(self.path, maxsize=1)
+        for i in range(3):
+            handler.handle(record('message %d' % i))
+        self.assertEqual(handler.dropped, 2)
+
+
+class SamplingFilterTest(unittest.TestCase):
+
+    def test_one_in_rate_info_lines_per_trigger(self):
+        sampler = SamplingFilter(1, {'NewArticle': 3})
+        kept = [sampler.filter(record('x', trigger='NewArticle'))
+                for i in range(6)]
+        self.assertEqual(kept, [True, False, False, True, False, False])
+        self.assertTrue(sampler.filter(record('x', trigger='Other')))
+        self.assertTrue(sampler.filter(record('x', logging.WARNING,
+                                              trigger='NewArticle')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import time
+import unittest
+
+from ifttt.feeds import FeedEntry, newest_published
+from ifttt.policies import (CachePolicy, DailyRollover, FixedTTL,
+                            AdaptiveTTL, DAY, DEFAULT_TTL)
+
+
+def entry(ts):
+    return FeedEntry(str(ts), tuple(time.gmtime(ts)), '')
+
+
+class DailyRolloverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = DailyRollover(newest=newest_published, prewarm=False)
+        self.midnight = time.time() // DAY * DAY
+
+    def test_current_feed_is_cached_until_rollover(self):
+        timeout = self.policy.timeout('feed', [entry(self.midnight - DAY),
+                                               entry(self.midnight)])
+        expected = self.policy.next_rollover() - time.time()
+        self.assertAlmostEqual(timeout, expected, delta=2)
+
+    def test_stale_feed_is_cached_briefly(self):
+        timeout = self.policy.timeout('feed', [entry(self.midnight - DAY)])
+        self.assertEqual(timeout, DEFAULT_TTL)
+
+    def test_empty_feed_is_stale(self):
+        self.assertEqual(self.policy.timeout('feed', []), DEFAULT_TTL)
+
+    def test_next_rollover_is_after_midnight(self):
+        self.assertEqual(self.policy.next_rollover(self.midnight + 60),
+                         self.midnight + self.policy.delay)
+        self.assertEqual(self.policy.next_rollover(self.midnight + 3600),
+                         self.midnight + DAY + self.policy.delay)
+
+
+class PolicyTest(unittest.TestCase):
+
+    def test_default_and_fixed_ttl(self):
+        self.assertEqual(CachePolicy().timeout('key', 'value'), DEFAULT_TTL)
+        self.assertEqual(FixedTTL(42).timeout('key', 'value'), 42)
+
+    def test_adaptive_ttl_follows_changes(self):
+        policy = AdaptiveTTL(min_ttl=1, max_ttl=10000, initial_ttl=100)
+        policy.observe('key', 'a', now=0)
+        policy.observe('key', 'b', now=20)
+        busy = policy.observe('key', 'c', now=40)
+        policy.observe('quiet', 'a', now=0)
+        quiet = policy.observe('quiet', 'a', now=5000)
+        self.assertLess(busy, quiet)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from ifttt import app
+from ifttt.realtime import LocalSink, RealtimeNotifier
+
+
+class FakeTrigger(object):
+    """Trigger whose items are whatever the test says they are."""
+
+    ids = []
+
+    def get_data(self):
+        return [{'meta': {'id': item_id}} for item_id in self.ids]
+
+
+class RealtimeNotifierTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self._config = dict(app.config)
+        app.config['REALTIME_LOCK_FILE'] = os.path.join(self.directory,
+                                                        'realtime.lock')
+        app.config['REALTIME_SPOOL_FILE'] = os.path.join(self.directory,
+                                                         'realtime.spool')
+        self.sink = LocalSink()
+        self.notifier = RealtimeNotifier()
+        self.notifier.configure(app, [FakeTrigger], self.sink)
+        FakeTrigger.ids = ['a', 'b']
+
+    def tearDown(self):
+        app.config.clear()
+        app.config.update(self._config)
+        shutil.rmtree(self.directory)
+
+    def register(self, identity):
+        self.notifier.register(identity, FakeTrigger, {'lang': 'en'}, 50,
+                               FakeTrigger().get_data())
+
+    def test_notifies_once_when_items_change(self):
+        self.register('one')
+        self.register('two')
+        now = time.time()
+        self.assertEqual(self.notifier.tick(now), [])
+        later = now + self.notifier.min_interval
+        self.assertEqual(self.notifier.tick(later), [])
+        FakeTrigger.ids = ['a', 'b', 'c']
+        later += self.notifier.min_interval
+        self.assertEqual(sorted(self.notifier.tick(later)), ['one', 'two'])
+        later += self.notifier.min_interval
+        self.assertEqual(self.notifier.tick(later), [])
+        self.assertEqual(len(self.sink.sent), 1)
+        self.assertEqual(sorted(self.sink.sent[0]), ['one', 'two'])
+
+    def test_forgotten_identities_are_not_notified(self):
+        self.register('one')
+        self.notifier.forget('one')
+        FakeTrigger.ids = ['c']
+        self.notifier.tick(time.time() + self.notifier.min_interval)
+        self.assertEqual(self.sink.sent, [])
+
+    def test_one_worker_runs_the_checks(self):
+        other = RealtimeNotifier()
+        other.configure(app, [FakeTrigger], LocalSink())
+        self.assertTrue(self.notifier.claim())
+        self.assertFalse(other.claim())
+        self.register('one')
+        self.assertEqual(other.tick(), [])
+        self.notifier.tick()
+        self.assertEqual(self.notifier.stats()['identities'], 1)
+        self.assertEqual(other.stats()['identities'], 0)
+
+    def test_registrations_are_spooled_on_tick(self):
+        spool_path = app.config['REALTIME_SPOOL_FILE']
+        self.register('one')
+        self.register('two')
+        self.assertFalse(os.path.exists(spool_path))
+        self.assertEqual(self.notifier.stats()['queued'], 2)
+        self.assertEqual(self.notifier.spool(), 2)
+        with open(spool_path) as f:
+            self.assertEqual(len(f.readlines()), 2)
+        self.assertEqual(self.notifier.stats()['queued'], 0)
+
+    def test_full_spool_drops_registrations(self):
+        self.notifier.max_spool_bytes = 1
+        self.register('one')
+        self.assertEqual(self.notifier.spool(), 0)
+        self.notifier.tick()
+        stats = self.notifier.stats()
+        self.assertEqual(stats['identities'], 0)
+        self.assertEqual(stats['dropped'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
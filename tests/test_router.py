@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import socket
+import StringIO
+import tempfile
+import time
+import unittest
+
+import router
+from router import Dispatcher, HashRing, route_key
+
+BACKENDS = ['10.0.0.1:8081', '10.0.0.2:8081', '10.0.0.3:8081']
+
+
+def environ(path, body='', method='POST', query=''):
+    return {'PATH_INFO': path,
+            'QUERY_STRING': query,
+            'REQUEST_METHOD': method,
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': StringIO.StringIO(body)}
+
+
+class FakeDispatcher(Dispatcher):
+    """Dispatcher that records where requests would have gone, and treats
+    the backends in `down` as unreachable."""
+
+    def __init__(self, *args, **kwargs):
+        super(FakeDispatcher, self).__init__(*args, **kwargs)
+        self.sent = []
+        self.down = set()
+
+    def forward(self, backend, environ, body):
+        if backend.address in self.down:
+            raise socket.error('connection refused')
+        self.sent.append(backend.address)
+        return '200 OK', [], backend.address
+
+
+class HashRingTest(unittest.TestCase):
+
+    def test_preference_lists_every_node_once(self):
+        ring = HashRing(BACKENDS)
+        self.assertEqual(sorted(ring.preference('NewArticle:en')), BACKENDS)
+
+    def test_removing_a_node_only_moves_its_keys(self):
+        keys = ['trigger%d:lang%d' % (i, i) for i in range(500)]
+        before = HashRing(BACKENDS)
+        after = HashRing(BACKENDS[:2])
+        for key in keys:
+            owner = before.preference(key)[0]
+            if owner != BACKENDS[2]:
+                self.assertEqual(after.preference(key)[0], owner)
+
+
+class RouteKeyTest(unittest.TestCase):
+
+    def test_trigger_and_lang(self):
+        body = json.dumps({'triggerFields': {'lang': 'fr'}})
+        self.assertEqual(route_key(environ('/v1/triggers/new_article'),
+                                   body), 'new_article:fr')
+
+    def test_lang_from_query_string(self):
+        self.assertEqual(route_key(environ('/v1/triggers/new_article',
+                                           method='GET', query='lang=de'),
+                                   ''), 'new_article:de')
+
+    def test_other_paths(self):
+        self.assertEqual(route_key(environ('/v1/status'), ''), '/v1/status')
+
+
+class DispatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dispatcher = FakeDispatcher(BACKENDS)
+
+    def call(self, env):
+        return self.dispatcher(env, lambda status, headers: None)[0]
+
+    def request(self, lang):
+        return environ('/v1/triggers/new_article',
+                       json.dumps({'triggerFields': {'lang': lang}}))
+
+    def test_same_wiki_goes_to_same_backend(self):
+        first = self.call(self.request('en'))
+        self.assertEqual(self.call(self.request('en')), first)
+
+    def test_down_backend_is_passed_over(self):
+        first = self.call(self.request('en'))
+        self.dispatcher.down.add(first)
+        second = self.call(self.request('en'))
+        self.assertNotEqual(second, first)
+        # Then it is skipped outright for a while
+        self.dispatcher.down.clear()
+        self.assertEqual(self.call(self.request('en')), second)
+
+    def test_busy_backend_is_passed_over(self):
+        key = route_key(self.request('en'), '')
+        self.dispatcher.max_inflight = 1
+        busy = self.dispatcher.choose(key)
+        self.assertNotEqual(self.dispatcher.choose(key), busy)
+        self.assertEqual(self.dispatcher.fallbacks, 1)
+
+    def test_identity_deletions_go_to_every_backend(self):
+        self.call(environ('/v1/triggers/new_article/trigger_identity/abc',
+                          method='DELETE'))
+        self.assertEqual(sorted(self.dispatcher.sent), BACKENDS)
+
+
+class BackendsFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'backends')
+        self._interval = router.RELOAD_INTERVAL
+        router.RELOAD_INTERVAL = 0
+
+    def tearDown(self):
+        router.RELOAD_INTERVAL = self._interval
+        shutil.rmtree(self.directory)
+
+    def write(self, addresses, mtime):
+        with open(self.path, 'w') as f:
+            f.write('# backends\n' + '\n'.join(addresses) + '\n')
+        os.utime(self.path, (mtime, mtime))
+
+    def test_backends_are_reloaded(self):
+        now = time.time()
+        self.write(BACKENDS[:1], now - 10)
+        dispatcher = FakeDispatcher(backends_file=self.path)
+        self.assertEqual(dispatcher.ring.preference('x'), BACKENDS[:1])
+        self.write(BACKENDS[1:2], now)
+        dispatcher.maybe_reload()
+        self.assertEqual(dispatcher.ring.preference('x'), BACKENDS[1:2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import calendar
+import datetime
+import random
+import time
+import unittest
+
+from ifttt import timestamps
+from ifttt.timestamps import (mw_to_epoch, mw_to_epoch_many, mw_to_iso8601,
+                              iso8601_to_epoch, epoch_to_iso8601,
+                              datetime_to_epoch, datetime_to_iso8601)
+
+
+def strptime_epoch(ts, fmt='%Y%m%d%H%M%S'):
+    return calendar.timegm(time.strptime(ts, fmt))
+
+
+class TimestampTest(unittest.TestCase):
+
+    def setUp(self):
+        rand = random.Random(0)
+        self.epochs = [rand.randint(0, 4102444800) for i in range(1000)]
+        self.epochs += [0, 951782400, 951868800, 4107542399]  # around leap days
+        self.mw = [time.strftime('%Y%m%d%H%M%S', time.gmtime(ts))
+                   for ts in self.epochs]
+
+    def test_mw_to_epoch_matches_strptime(self):
+        for ts, epoch in zip(self.mw, self.epochs):
+            self.assertEqual(mw_to_epoch(ts), epoch)
+            self.assertEqual(mw_to_epoch(ts), strptime_epoch(ts))
+
+    def test_many_matches_one_at_a_time(self):
+        self.assertEqual(mw_to_epoch_many(self.mw), self.epochs)
+        self.assertEqual(mw_to_epoch_many(self.mw[:3]), self.epochs[:3])
+
+    def test_many_without_numpy(self):
+        numpy, timestamps.numpy = timestamps.numpy, None
+        try:
+            self.assertEqual(mw_to_epoch_many(self.mw), self.epochs)
+        finally:
+            timestamps.numpy = numpy
+
+    def test_iso8601_round_trip(self):
+        for ts, epoch in zip(self.mw, self.epochs):
+            iso = mw_to_iso8601(ts)
+            self.assertEqual(iso, epoch_to_iso8601(epoch))
+            self.assertEqual(iso8601_to_epoch(iso), epoch)
+
+    def test_datetimes(self):
+        dt = datetime.datetime(2016, 2, 29, 23, 59, 58)
+        self.assertEqual(datetime_to_epoch(dt),
+                         strptime_epoch('20160229235958'))
+        self.assertEqual(datetime_to_iso8601(dt), '2016-02-29T23:59:58Z')
+
+    def test_malformed(self):
+        self.assertRaises(ValueError, mw_to_epoch, '2016022923595')
+        self.assertRaises(ValueError, mw_to_iso8601, '')
+        self.assertRaises(ValueError, iso8601_to_epoch, '2016-02-29 23:59:58')
+        if timestamps.numpy is not None:
+            self.assertRaises(ValueError, mw_to_epoch_many,
+                              self.mw[:-1] + ['2016'])
+            self.assertRaises(ValueError, mw_to_epoch_many,
+                              self.mw[:-1] + ['201601010000000'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+import time
+import unittest
+
+from ifttt import app
+from ifttt.dal import Change
+from ifttt.trending import LocalSource, TrendingEngine, TrendingIndex
+
+
+def change(rc_id, title, user, ts):
+    return Change(rc_id, title,
+                  time.strftime('%Y%m%d%H%M%S', time.gmtime(ts)),
+                  rc_id, rc_id - 1, user, 0, 0, '')
+
+
+class BlockingSource(LocalSource):
+    """LocalSource whose polls wait until they are released."""
+
+    def __init__(self, lang, changes=()):
+        super(BlockingSource, self).__init__(lang, changes)
+        self.release = threading.Event()
+
+    def poll(self):
+        self.release.wait(5)
+        return super(BlockingSource, self).poll()
+
+
+def parse(page):
+    return {'title': page.title, 'edits': page.edits,
+            'editors': page.editors, 'score': page.trendiness}
+
+
+class TrendingEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        now = int(time.time())
+        self.source = BlockingSource('en', [
+            change(1, 'Foo', 'A', now - 120),
+            change(2, 'Foo', 'B', now - 60),
+            change(3, 'Bar', 'A', now - 30)])
+        self.engine = TrendingEngine(lambda lang: self.source)
+        self.engine.configure(app)
+
+    def tearDown(self):
+        self.source.release.set()
+
+    def wait_until_ready(self, lang):
+        deadline = time.time() + 5
+        while not self.engine.wiki(lang).ready and time.time() < deadline:
+            time.sleep(0.01)
+
+    def test_not_ready_until_first_poll(self):
+        self.assertEqual(self.engine.index('en', 24, parse).items, [])
+        self.assertEqual(self.engine.trending('en', 24), [])
+        self.source.release.set()
+        self.wait_until_ready('en')
+        items = self.engine.index('en', 24, parse).query(min_edits=2)
+        self.assertEqual([(item['title'], item['edits'], item['editors'])
+                          for item in items], [('Foo', 2, 2)])
+
+    def test_later_polls_add_changes(self):
+        self.source.release.set()
+        self.wait_until_ready('en')
+        self.source.push(change(4, 'Bar', 'C', int(time.time())))
+        self.engine.refresh_due(time.time() + self.engine.poll_interval)
+        titles = [page.title for page in self.engine.trending('en', 1)
+                  if page.edits == 2]
+        self.assertEqual(sorted(titles), ['Bar', 'Foo'])
+
+
+class TrendingIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.items = [{'title': 'Foo Bar', 'edits': 30, 'editors': 8,
+                       'score': 3.0},
+                      {'title': 'Bar', 'edits': 10, 'editors': 2,
+                       'score': 2.0},
+                      {'title': 'Baz', 'edits': 25, 'editors': 7,
+                       'score': 1.0}]
+        self.index = TrendingIndex(self.items)
+
+    def titles(self, *args, **kwargs):
+        return [item['title'] for item in self.index.query(*args, **kwargs)]
+
+    def test_thresholds_keep_index_order(self):
+        self.assertEqual(self.titles(20, 6), ['Foo Bar', 'Baz'])
+        self.assertEqual(self.titles(0, 0, 1.5), ['Foo Bar', 'Bar'])
+        self.assertEqual(self.titles(31), [])
+
+    def test_title_contains(self):
+        self.assertEqual(self.titles(title_contains='bar'),
+                         ['Foo Bar', 'Bar'])
+        self.assertEqual(self.titles(title_contains='r\nb'), [])
+        self.assertEqual(self.titles(20, title_contains='BA'),
+                         ['Foo Bar', 'Baz'])
+
+    def test_matches_a_scan(self):
+        for edits in (0, 10, 25, 30):
+            for editors in (0, 2, 7, 8):
+                expected = [item['title'] for item in self.items
+                            if item['edits'] >= edits and
+                            item['editors'] >= editors]
+                self.assertEqual(self.titles(edits, editors), expected)
+
+
+class TrendingTopicsTest(unittest.TestCase):
+
+    def test_bad_hours_are_rejected(self):
+        client = app.test_client()
+        resp = client.post('/v1/triggers/trending_topics',
+                           data=json.dumps({'triggerFields': {'hrs': 'abc'}}),
+                           headers={'IFTTT-Channel-Key':
+                                    app.config.get('CHANNEL_KEY')})
+        self.assertEqual(resp.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+
+import flask
+
+from ifttt import app
+from ifttt import triggers
+from ifttt.caching import cache, make_key, IMAGES
+from ifttt.triggers import (ArticleRevisions, NewArticle, NewPage,
+                            RenderedFeed, get_page_image)
+
+BODY = '<rss>%s</rss>' % ('<item/>' * 100)
+
+
+class RenderedFeedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.feed = RenderedFeed(BODY, 'abc')
+
+    def get(self, **headers):
+        with app.test_request_context(headers=headers):
+            return self.feed.make_response(flask.request)
+
+    def test_full_response(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_data(), BODY)
+        self.assertEqual(response.headers['ETag'], '"abc"')
+
+    def test_gzipped_body_is_reused(self):
+        response = self.get(**{'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.get_data(), self.feed.gzipped)
+
+    def test_refused_gzip_is_not_sent(self):
+        response = self.get(**{'Accept-Encoding': 'gzip;q=0, identity'})
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.get_data(), BODY)
+
+    def test_conditional_get(self):
+        self.assertEqual(self.get(**{'If-None-Match': '"abc"'}).status_code,
+                         304)
+        self.assertEqual(self.get(**{'If-None-Match': '"def"'}).status_code,
+                         200)
+
+
+class ProjectionTest(unittest.TestCase):
+
+    def test_only_record_fields_are_kept(self):
+        resp = {'query': {'recentchanges': [
+            {'timestamp': '2026-10-19T00:00:00Z', 'title': 'Foo',
+             'user': 'A', 'newlen': 10, 'oldlen': 0, 'comment': 'new',
+             'rcid': 1, 'pageid': 2, 'revid': 3}]}}
+        rows = NewArticle().project(resp)
+        self.assertEqual(rows, [NewPage('2026-10-19T00:00:00Z', 'Foo', 'A',
+                                        10, 0, 'new')])
+
+    def test_missing_results_are_empty(self):
+        self.assertEqual(NewArticle().project({'batchcomplete': ''}), [])
+
+    def test_nested_results(self):
+        resp = {'query': {'pages': {'2': {'revisions': [
+            {'revid': 3, 'parentid': 1, 'timestamp': '2026-10-19T00:00:00Z',
+             'user': 'A', 'size': 10, 'comment': '', 'tags': []}]}}}}
+        rows = ArticleRevisions().project(resp)
+        self.assertEqual([row.revid for row in rows], [3])
+        self.assertFalse(hasattr(rows[0], 'tags'))
+
+
+class FakeFetcher(object):
+
+    def __init__(self, resp):
+        self.resp = resp
+        self.urls = []
+
+    def get(self, url):
+        self.urls.append(url)
+        return json.dumps(self.resp)
+
+
+class PageImageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fetcher = FakeFetcher({'query': {
+            'normalized': [{'from': 'page_image_test',
+                            'to': 'Page image test'}],
+            'pages': {'1': {'title': 'Page image test',
+                            'thumbnail': {'source': 'a.jpg'}},
+                      '2': {'title': 'Other page image test'}}}})
+        self._fetcher, triggers.fetcher = triggers.fetcher, self.fetcher
+
+    def tearDown(self):
+        triggers.fetcher = self._fetcher
+        for name in ('page image test', 'Other page image test'):
+            cache.delete(make_key(IMAGES, 'en', name))
+
+    def test_images_are_keyed_by_the_given_titles(self):
+        titles = ['page_image_test', 'Other_page_image_test']
+        expected = {'page_image_test': 'a.jpg', 'Other_page_image_test': None}
+        self.assertEqual(get_page_image(titles), expected)
+        # The second time, from the cache
+        self.assertEqual(get_page_image(titles), expected)
+        self.assertEqual(len(self.fetcher.urls), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import unittest
+import uuid
+
+import lxml.html
+
+from ifttt.utils import (LRUCache, memoize, select, select_all, url_to_uuid5,
+                         diff_url)
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def test_least_recently_used_is_forgotten(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+        self.assertEqual(len(cache), 2)
+        cache.resize(1)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_stats(self):
+        cache = LRUCache(2)
+        cache.get('a')
+        cache.set('a', 1)
+        cache.get('a')
+        self.assertEqual(cache.stats()['hit_rate'], 0.5)
+
+
+class MemoizeTest(unittest.TestCase):
+
+    def test_results_are_remembered(self):
+        calls = []
+
+        @memoize(maxsize=10)
+        def double(x):
+            calls.append(x)
+            return x * 2
+
+        self.assertEqual([double(1), double(2), double(1)], [2, 4, 2])
+        self.assertEqual(calls, [1, 2])
+        self.assertEqual(double.cache.hits, 1)
+
+    def test_none_is_remembered(self):
+        calls = []
+
+        @memoize()
+        def nothing():
+            calls.append(1)
+
+        nothing()
+        nothing()
+        self.assertEqual(calls, [1])
+
+    def test_meta_ids_are_unchanged(self):
+        url = u'https://en.wikipedia.org/wiki/Caf\xe9'
+        self.assertEqual(url_to_uuid5(url),
+                         str(uuid.uuid5(uuid.NAMESPACE_URL,
+                                        url.encode('utf-8'))))
+        self.assertEqual(url_to_uuid5(url), url_to_uuid5(url))
+        self.assertEqual(diff_url('en.wikipedia.org', 2, 1),
+                         'https://en.wikipedia.org/w/index.php?diff=2&oldid=1')
+
+
+class SelectTest(unittest.TestCase):
+
+    def test_matches_cssselect(self):
+        doc = lxml.html.fromstring('<div><p class="a">x</p><p>y</p>'
+                                   '<a class="image"><img src="i"></a>'
+                                   '</div>')
+        for selector in ('p:first-of-type', 'a.image img', '.a'):
+            self.assertIs(select(doc, selector), doc.cssselect(selector)[0])
+        self.assertRaises(IndexError, select, doc, 'table')
+        self.assertEqual(select_all(doc, 'p'), doc.cssselect('p'))
+        self.assertEqual(select_all(doc, 'table'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
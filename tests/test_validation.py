@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import threading
+import unittest
+import uuid
+
+from ifttt import app
+from ifttt import validation
+from ifttt.validation import ExistenceChecker
+
+
+class ExistenceCheckerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.lookups = []
+        self.existing = set(['Foo', 'Bar'])
+        # A kind of its own, so that nothing is cached yet
+        self.checker = ExistenceChecker(uuid.uuid4().hex, self.lookup)
+
+    def lookup(self, lang, names):
+        self.lookups.append(names)
+        return dict((name, name in self.existing) for name in names)
+
+    def exists(self, name, results=None):
+        with app.app_context():
+            ret = self.checker.exists('en', name)
+        if results is not None:
+            results[name] = ret
+        return ret
+
+    def test_answers_are_cached(self):
+        self.assertTrue(self.exists('Foo'))
+        self.assertFalse(self.exists('Baz'))
+        self.assertTrue(self.exists('Foo'))
+        self.assertFalse(self.exists('Baz'))
+        self.assertEqual(self.lookups, [['Foo'], ['Baz']])
+
+    def test_concurrent_lookups_are_batched(self):
+        window, validation.BATCH_WINDOW = validation.BATCH_WINDOW, 0.5
+        self.addCleanup(setattr, validation, 'BATCH_WINDOW', window)
+        results = {}
+        threads = [threading.Thread(target=self.exists, args=(name, results))
+                   for name in ('Foo', 'Bar', 'Baz')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, {'Foo': True, 'Bar': True, 'Baz': False})
+        self.assertEqual(self.lookups, [['Bar', 'Baz', 'Foo']])
+
+    def test_errors_reach_every_caller(self):
+        def fail(lang, names):
+            raise IOError('API unavailable')
+        self.checker.lookup = fail
+        self.assertRaises(IOError, self.exists, 'Foo')
+
+
+if __name__ == '__main__':
+    unittest.main()
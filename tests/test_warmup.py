@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from ifttt import app
+from ifttt.warmup import PollHistory, warm, warm_from_file
+
+try:
+    import fabfile
+except ImportError:
+    fabfile = None
+
+
+class FakeTrigger(object):
+    """Trigger that records the queries it was run for."""
+
+    runs = []
+
+    def get_data(self):
+        if self.fields.get('fail'):
+            raise ValueError('no such page')
+        FakeTrigger.runs.append((self.fields, self.limit))
+        return []
+
+
+class PollHistoryTest(unittest.TestCase):
+
+    def test_top_queries_most_polled_first(self):
+        history = PollHistory()
+        for i in range(3):
+            history.record('NewArticle', {'lang': 'en'}, 50)
+        history.record('NewArticle', {'lang': 'fr'}, 50)
+        top = history.top(1)
+        self.assertEqual(top, [{'trigger': 'NewArticle',
+                                'fields': {'lang': 'en'},
+                                'limit': 50,
+                                'polls': 3}])
+
+    def test_least_polled_are_forgotten(self):
+        history = PollHistory(maxsize=4)
+        for i in range(4):
+            history.record('NewArticle', {'lang': 'en'}, 50)
+        for lang in ('a', 'b', 'c', 'd'):
+            history.record('NewArticle', {'lang': lang}, 50)
+        top = history.top()
+        self.assertLessEqual(len(top), 4)
+        self.assertEqual(top[0]['fields'], {'lang': 'en'})
+
+
+class WarmTest(unittest.TestCase):
+
+    def setUp(self):
+        FakeTrigger.runs = []
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'warmup.json')
+        self.queries = [{'trigger': 'FakeTrigger',
+                         'fields': {'lang': 'en'}, 'limit': 50},
+                        {'trigger': 'FakeTrigger',
+                         'fields': {'fail': True}, 'limit': 50},
+                        {'trigger': 'Gone', 'fields': {}, 'limit': 50}]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_warm_runs_known_triggers(self):
+        ran = warm(app, self.queries, {'FakeTrigger': FakeTrigger})
+        self.assertEqual(ran, 1)
+        self.assertEqual(FakeTrigger.runs, [({'lang': 'en'}, 50)])
+
+    def test_warm_stops_at_deadline(self):
+        self.assertEqual(warm(app, self.queries, {'FakeTrigger': FakeTrigger},
+                              max_seconds=-1), 0)
+
+    def test_warm_from_file_replays_once(self):
+        with open(self.path, 'w') as f:
+            json.dump({'data': self.queries}, f)
+        self.assertEqual(warm_from_file(app, self.path,
+                                        {'FakeTrigger': FakeTrigger}), 1)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(warm_from_file(app, self.path,
+                                        {'FakeTrigger': FakeTrigger}), 0)
+
+    def test_file_removed_by_another_worker(self):
+        path = self.path
+
+        class OtherWorkerFinishes(FakeTrigger):
+            def get_data(self):
+                os.remove(path)
+                return FakeTrigger.get_data(self)
+
+        with open(self.path, 'w') as f:
+            json.dump({'data': self.queries[:1]}, f)
+        self.assertEqual(warm_from_file(app, self.path, {
+            'FakeTrigger': OtherWorkerFinishes}), 1)
+
+    def test_unreadable_file_is_removed(self):
+        with open(self.path, 'w') as f:
+            f.write('{')
+        self.assertEqual(warm_from_file(app, self.path, {}), 0)
+        self.assertFalse(os.path.exists(self.path))
+
+
+class Output(str):
+    succeeded = True
+
+
+@unittest.skipIf(fabfile is None, 'fabric is not installed')
+class RollingDeployTest(unittest.TestCase):
+
+    def setUp(self):
+        self.commands = []
+        self._sr = fabfile.sr
+        fabfile.sr = self.sr
+        self.backends = ''
+
+    def tearDown(self):
+        fabfile.sr = self._sr
+
+    def sr(self, *args):
+        self.commands.append(args)
+        return Output(self.backends)
+
+    def test_live_port(self):
+        self.backends = '127.0.0.1:8082\n'
+        self.assertEqual(fabfile.live_port(), 8082)
+        self.backends = ''
+        self.assertIsNone(fabfile.live_port())
+
+    def test_switch_router_replaces_backends_file(self):
+        fabfile.switch_router(8081)
+        command = ' '.join(self.commands[-1])
+        self.assertIn('127.0.0.1:8081', command)
+        self.assertTrue(command.endswith('mv %s.new %s' % (
+            fabfile.BACKENDS_FILE, fabfile.BACKENDS_FILE)))
+
+
+if __name__ == '__main__':
+    unittest.main()